@@ -0,0 +1,189 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+from collections import OrderedDict
+from app.metrics import LatencyWindow
+from app.ratelimit import TokenBucket
+
+# Priorities, most urgent first
+DIRECT = 0  # DMs and messages that mention Sona
+GROUP = 1  # group messages Sona picks up without being asked
+BACKGROUND = 2  # summaries and other housekeeping LLM calls
+PRIORITY_NAMES = {DIRECT: "direct", GROUP: "group", BACKGROUND: "background"}
+
+ADMISSION_SENDER_PER_MINUTE = float(os.getenv("ADMISSION_SENDER_PER_MINUTE", "20"))
+ADMISSION_SENDER_BURST = float(os.getenv("ADMISSION_SENDER_BURST", "5"))
+ADMISSION_GROUP_PER_MINUTE = float(os.getenv("ADMISSION_GROUP_PER_MINUTE", "30"))
+ADMISSION_GROUP_BURST = float(os.getenv("ADMISSION_GROUP_BURST", "10"))
+# Match the provider's requests-per-minute quota
+ADMISSION_GLOBAL_PER_MINUTE = float(os.getenv("ADMISSION_GLOBAL_PER_MINUTE", "1000"))
+ADMISSION_GLOBAL_BURST = float(os.getenv("ADMISSION_GLOBAL_BURST", "20"))
+ADMISSION_MAX_WAIT_SECONDS = {
+    DIRECT: float(os.getenv("ADMISSION_DIRECT_MAX_WAIT_SECONDS", "10")),
+    GROUP: float(os.getenv("ADMISSION_GROUP_MAX_WAIT_SECONDS", "3")),
+    BACKGROUND: float(os.getenv("ADMISSION_BACKGROUND_MAX_WAIT_SECONDS", "30")),
+}
+# Lower-priority work is shed outright once this many requests are waiting
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "50"))
+ADMISSION_MAX_BUCKETS = int(os.getenv("ADMISSION_MAX_BUCKETS", "10000"))
+
+
+class _Buckets:
+    """
+    Token buckets per key, least recently used dropped past a cap.
+    A dropped bucket was idle, i.e. full, so dropping it changes nothing.
+    """
+
+    def __init__(self, per_minute: float, burst: float, max_buckets: int):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+
+    def get(self, key: str) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class AdmissionController:
+    """
+    Decides which LLM-bound work runs, and in what order.
+
+    Each sender and each group has its own token bucket, so one chatty
+    chat can't use up the provider quota. On top of that a global bucket
+    matched to the provider limit is handed out in priority order: DMs and
+    mentions first, then unprompted group replies, then background work.
+    Work that can't be admitted within its priority's max wait is shed,
+    and lower-priority work is shed right away when the queue is long.
+    """
+
+    def __init__(
+        self,
+        sender_per_minute: float = ADMISSION_SENDER_PER_MINUTE,
+        sender_burst: float = ADMISSION_SENDER_BURST,
+        group_per_minute: float = ADMISSION_GROUP_PER_MINUTE,
+        group_burst: float = ADMISSION_GROUP_BURST,
+        global_per_minute: float = ADMISSION_GLOBAL_PER_MINUTE,
+        global_burst: float = ADMISSION_GLOBAL_BURST,
+        max_queued: int = ADMISSION_MAX_QUEUED,
+    ):
+        self.senders = _Buckets(sender_per_minute, sender_burst, ADMISSION_MAX_BUCKETS)
+        self.groups = _Buckets(group_per_minute, group_burst, ADMISSION_MAX_BUCKETS)
+        self.bucket = TokenBucket(global_per_minute / 60, global_burst)
+        self.max_queued = max_queued
+
+        # (priority, sequence, future) waiting for a global token
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._dispatcher: asyncio.Task = None
+
+        self.admitted = {p: 0 for p in PRIORITY_NAMES}
+        self.shed = {p: 0 for p in PRIORITY_NAMES}
+        self.wait_time = {p: LatencyWindow() for p in PRIORITY_NAMES}
+
+    async def admit(
+        self, priority: int, sender_id: str = None, group_id: str = None
+    ) -> bool:
+        """
+        Wait for permission to make one LLM call.
+        Returns False if the work should be dropped instead.
+        """
+        started = time.perf_counter()
+        deadline = started + ADMISSION_MAX_WAIT_SECONDS[priority]
+
+        buckets = []
+        if sender_id:
+            buckets.append(self.senders.get(sender_id))
+        if group_id:
+            buckets.append(self.groups.get(group_id))
+
+        # Per-chat limits: only the most urgent work waits for a refill
+        for bucket in buckets:
+            wait = bucket.time_until()
+            if wait > 0 and (
+                priority != DIRECT or time.perf_counter() + wait > deadline
+            ):
+                return self._shed(priority, "chat rate limit")
+        for bucket in buckets:
+            await bucket.acquire()
+
+        if not self._waiting and self.bucket.try_acquire():
+            return self._admit(priority, started)
+
+        queued_ahead = sum(
+            1 for p, _, f in self._waiting if p <= priority and not f.done()
+        )
+        if priority != DIRECT and queued_ahead >= self.max_queued:
+            return self._shed(priority, "queue full")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._sequence), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(future), timeout=deadline - time.perf_counter()
+            )
+        except asyncio.TimeoutError:
+            if not future.done():
+                # The dispatcher skips cancelled entries
+                future.cancel()
+                return self._shed(priority, "waited too long")
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        return self._admit(priority, started)
+
+    async def _dispatch(self):
+        while self._waiting:
+            await self.bucket.acquire()
+            while self._waiting:
+                _, _, future = heapq.heappop(self._waiting)
+                if not future.done():
+                    future.set_result(True)
+                    break
+            else:
+                # Everyone gave up meanwhile; hand the token back
+                self.bucket.tokens = min(self.bucket.capacity, self.bucket.tokens + 1)
+
+    def _admit(self, priority: int, started: float) -> bool:
+        self.admitted[priority] += 1
+        self.wait_time[priority].record(time.perf_counter() - started)
+        return True
+
+    def _shed(self, priority: int, reason: str) -> bool:
+        self.shed[priority] += 1
+        print(f"[ADMISSION] Shedding {PRIORITY_NAMES[priority]} work: {reason}")
+        return False
+
+    def stats(self) -> dict:
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, future in self._waiting:
+            if not future.done():
+                queued[PRIORITY_NAMES[priority]] += 1
+        return {
+            "senders_tracked": len(self.senders),
+            "groups_tracked": len(self.groups),
+            "queued": queued,
+            "admitted": {PRIORITY_NAMES[p]: n for p, n in self.admitted.items()},
+            "shed": {PRIORITY_NAMES[p]: n for p, n in self.shed.items()},
+            "wait_time": {
+                PRIORITY_NAMES[p]: window.snapshot()
+                for p, window in self.wait_time.items()
+            },
+        }
+
+
+admission = AdmissionController()
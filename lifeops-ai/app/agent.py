@@ -1,41 +1,108 @@
+import time
 from app.prompts import SYSTEM_PROMPT
-from openai import OpenAI
+from app.llm import llm
 from app.db import save_memory, get_user_memories, save_group_context, get_group_context
-import os
-
-# Initialize Groq client (Groq uses OpenAI-compatible API)
-client = OpenAI(
-    api_key=os.getenv("GROQ_API_KEY"), base_url="https://api.groq.com/openai/v1"
+from app.profile import profiles, format_profile
+from app.retrieval import memory_index
+from app.context import context_builder, summaries, CONTEXT_FETCH_TURNS
+from app.intents import intent_router
+from app.streaming import SentenceSplitter, reply_timings, STREAM_REPLIES
+from app.response_cache import response_cache, fingerprint
+from app.admission import admission, DIRECT, GROUP
+from app.group_summary import group_summarizer
+
+ERROR_REPLY = "Sorry, I encountered an error processing your message."
+BUSY_REPLY = (
+    "I'm getting a lot of messages right now, give me a minute and ask again 🙏"
 )
 
 
-def get_ai_response(user_message: str, system_prompt: str = None) -> str:
+async def get_ai_response(
+    user_message: str,
+    system_prompt: str = None,
+    on_chunk=None,
+    cache_key=None,
+    admission_key=None,
+) -> str:
     """
     Get AI response from Groq using the provided prompts.
+    With on_chunk, the reply is streamed and each finished sentence or line
+    is passed to `await on_chunk(text)` while the rest is still generating.
+    With cache_key=(scope, context fingerprint), a cached answer to the same
+    question is returned as is, and complete answers are cached.
+    With admission_key=(priority, sender_id, group_id), the call waits for
+    admission control first and returns None if it was shed.
     """
+    if cache_key is not None:
+        cached = response_cache.get(*cache_key, user_message)
+        if cached is not None:
+            print("[CACHE] Serving cached response")
+            return cached
+
+    if admission_key is not None and not await admission.admit(*admission_key):
+        return None
+
     messages = []
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
     messages.append({"role": "user", "content": user_message})
 
+    if on_chunk is None or not STREAM_REPLIES:
+        try:
+            response = await llm.complete(messages, temperature=0.7, max_tokens=1024)
+        except Exception as e:
+            print(f"Error calling Groq API: {e!r}")
+            return ERROR_REPLY
+        if cache_key is not None:
+            response_cache.put(*cache_key, user_message, response)
+        return response
+
+    started = time.perf_counter()
+    first_sent = None
+    sent = []
+    splitter = SentenceSplitter()
+
+    async def emit(chunk: str):
+        nonlocal first_sent
+        await on_chunk(chunk)
+        if first_sent is None:
+            first_sent = time.perf_counter()
+        sent.append(chunk)
+
     try:
-        response = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=1024,
-        )
-        return response.choices[0].message.content
+        async for delta in llm.stream(messages, temperature=0.7, max_tokens=1024):
+            for chunk in splitter.feed(delta):
+                await emit(chunk)
+        rest = splitter.flush()
+        if rest:
+            await emit(rest)
     except Exception as e:
-        print(f"Error calling Groq API: {e}")
-        return "Sorry, I encountered an error processing your message."
+        print(f"Error streaming from Groq API: {e!r}")
+        if not sent:
+            await emit(ERROR_REPLY)
+            return ERROR_REPLY
+        # Partial answer; already sent but not worth caching
+        return "\n".join(sent)
+    finally:
+        reply_timings.record(started, first_sent, len(sent))
+
+    response = "\n".join(sent)
+    if cache_key is not None:
+        response_cache.put(*cache_key, user_message, response)
+    return response
 
 
 async def process_message(
-    sender_id: str, message_text: str, group_id: str = None, user_name: str = None
+    sender_id: str,
+    message_text: str,
+    group_id: str = None,
+    user_name: str = None,
+    on_chunk=None,
 ):
     """
     Process incoming messages with intelligent group chat handling and automatic memory.
+    When on_chunk is given the AI reply is streamed through it (see
+    get_ai_response); canned replies are only returned.
     """
     print(
         f"Processing message from {sender_id} ({user_name or 'Unknown'}, group: {group_id}): {message_text}"
@@ -48,12 +115,15 @@ async def process_message(
     if group_id:
         await save_group_context(group_id, message_text, sender_id)
 
+    # One pass over the text finds the mention and every intent
+    route = intent_router.route(message_text)
+
     # GROUP CHAT LOGIC: Only respond when mentioned or when we should help
     if group_id:
-        is_mentioned = "sona" in message_text.lower() or "@sona" in message_text.lower()
+        is_mentioned = route.mentioned
 
         # Check if this is something Sona should respond to even without mention
-        should_respond_anyway = _should_respond_to_group_message(message_text)
+        should_respond_anyway = _should_respond(route)
 
         if not is_mentioned and not should_respond_anyway:
             print("Ignoring group message (not mentioned and not relevant)")
@@ -65,37 +135,80 @@ async def process_message(
             message_text = message_text[1:].strip()
 
     # Check for specific intents
-    msg_lower = message_text.lower()
-
     # Summary intent
-    if "summary" in msg_lower or "summarize" in msg_lower:
+    if "summary" in route:
+        if group_id:
+            summary = await group_summarizer.summarize(group_id, sender_id)
+            if summary is None:
+                return BUSY_REPLY
+            if summary:
+                return f"here's the recap:\n{summary}"
+            return "nothing to summarize yet"
         return "sure, let me summarize this chat for you"
 
     # Task/reminder intent
-    if any(word in msg_lower for word in ["remind", "task", "todo", "due", "deadline"]):
+    if "task" in route:
         return "noted! I'll keep track of that for you"
 
     # Calendar intent
-    if "schedule" in msg_lower or "calendar" in msg_lower or "meeting" in msg_lower:
+    if "calendar" in route:
         return "checking your calendar... 📅"
 
+    # PROFILE: Known facts about the user, kept apart from the conversation
+    profile = await profiles.get(sender_id)
+
     # MEMORY RETRIEVAL: Get conversation history
-    memories = await get_user_memories(sender_id, limit=10)
-    context_str = ""
+    # (legacy "User's name is X" rows live in the profile now)
+    memories = await get_user_memories(
+        sender_id, limit=CONTEXT_FETCH_TURNS, exclude_types=("profile",)
+    )
 
-    if memories:
-        print(f"[MEMORY] Found {len(memories)} memories")
-        context_str = "\n\nPrevious conversation context:\n"
-        for mem in memories:
-            context_str += f"- {mem['content']}\n"
+    # LONG-TERM RECALL: Older memories relevant to this message
+    recent = {mem["content"] for mem in memories}
+    relevant = [
+        content
+        for content, score in await memory_index.search(sender_id, message_text, k=5)
+        if content not in recent
+    ]
+    if relevant:
+        print(f"[MEMORY] Recalled {len(relevant)} relevant older memories")
+
+    # Build the prompt within the token budget; turns that don't fit are
+    # folded into the rolling summary in the background
+    enhanced_prompt, overflow = context_builder.build(
+        SYSTEM_PROMPT,
+        message_text,
+        profile_section=format_profile(profile),
+        relevant=relevant,
+        summary=summaries.get(sender_id),
+        recent=memories,
+    )
+    if overflow:
+        summaries.refresh(sender_id, overflow)
+
+    # RESPONSE CACHE: same question with the same facts gets the same answer.
+    # Recent turns are left out of the fingerprint so a repeated question
+    # can hit; anything else the user says in between clears their entries
+    # (ResponseCache.on_memory). Very short follow-ups are never cached.
+    cache_key = (
+        response_cache.scope(sender_id, group_id),
+        fingerprint(format_profile(profile), relevant, summaries.get(sender_id)),
+    )
 
-    # Build enhanced prompt with memory
-    enhanced_prompt = SYSTEM_PROMPT
-    if context_str:
-        enhanced_prompt += context_str
+    # ADMISSION: DMs and mentions go ahead of unprompted group replies
+    priority = DIRECT if not group_id or route.mentioned else GROUP
 
     # Get AI response with full context
-    ai_response = get_ai_response(message_text, enhanced_prompt)
+    ai_response = await get_ai_response(
+        message_text,
+        enhanced_prompt,
+        on_chunk,
+        cache_key=cache_key,
+        admission_key=(priority, sender_id, group_id),
+    )
+    if ai_response is None:
+        # Shed by admission control; only people who asked us directly hear back
+        return BUSY_REPLY if priority == DIRECT else None
 
     # AUTO-SAVE: Save Sona's response too
     await save_memory(sender_id, f"Sona replied: {ai_response}", "conversation")
@@ -108,30 +221,9 @@ def _should_respond_to_group_message(message: str) -> bool:
     Determine if Sona should respond to a group message even without being mentioned.
     Returns True for questions about tasks, scheduling, or when help seems needed.
     """
-    msg_lower = message.lower()
-
-    # Respond to direct questions
-    if message.startswith("?") or any(
-        msg_lower.startswith(q)
-        for q in ["what", "when", "who", "where", "how", "can someone"]
-    ):
-        return True
-
-    # Respond to task/coordination keywords
-    help_keywords = [
-        "deadline",
-        "due date",
-        "meeting",
-        "schedule",
-        "task",
-        "remind",
-        "todo",
-        "who's doing",
-        "who can",
-        "need help",
-    ]
+    return _should_respond(intent_router.route(message))
 
-    if any(keyword in msg_lower for keyword in help_keywords):
-        return True
 
-    return False
+def _should_respond(route) -> bool:
+    # Direct questions and task/coordination keywords (see intents.json)
+    return "question" in route or "group_help" in route
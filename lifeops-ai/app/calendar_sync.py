@@ -0,0 +1,322 @@
+import os
+import time
+import bisect
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from app.google_auth import google_tokens
+from app.metrics import LatencyWindow
+
+# Point this at bench/stub_calendar.py to test without Google
+GOOGLE_CALENDAR_URL = os.getenv(
+    "GOOGLE_CALENDAR_URL", "https://www.googleapis.com/calendar/v3"
+)
+CALENDAR_SYNC_SECONDS = float(os.getenv("CALENDAR_SYNC_SECONDS", "120"))
+# Calendars nobody has looked at for this long stop being synced and are dropped
+CALENDAR_IDLE_SECONDS = float(os.getenv("CALENDAR_IDLE_SECONDS", "86400"))
+CALENDAR_MAX_USERS = int(os.getenv("CALENDAR_MAX_USERS", "5000"))
+# Past events older than this are not kept
+CALENDAR_PAST_DAYS = float(os.getenv("CALENDAR_PAST_DAYS", "1"))
+CALENDAR_PAGE_SIZE = int(os.getenv("CALENDAR_PAGE_SIZE", "250"))
+
+
+class SyncTokenExpired(Exception):
+    """Google answered 410 Gone; the calendar has to be synced from scratch."""
+
+
+def _event_time(value: dict) -> float:
+    if not value:
+        return None
+    if value.get("dateTime"):
+        moment = datetime.fromisoformat(value["dateTime"].replace("Z", "+00:00"))
+    elif value.get("date"):
+        # All-day events; the user's timezone isn't known here
+        moment = datetime.fromisoformat(value["date"]).replace(tzinfo=timezone.utc)
+    else:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+class EventStore:
+    """
+    One user's events, indexed by start time for range queries.
+    """
+
+    def __init__(self):
+        # event id -> event dict with "start_ts"/"end_ts"
+        self.events = {}
+        # sorted (start_ts, event id)
+        self._index = []
+        # Longest event seen, so overlap checks know how far back to look
+        self._max_duration = 0.0
+        self.sync_token = None
+        self.synced_at = 0.0
+        self.used_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.events)
+
+    def apply(self, item: dict):
+        """
+        Apply one item from an events.list response.
+        """
+        self._remove(item["id"])
+        if item.get("status") == "cancelled":
+            return
+        start = _event_time(item.get("start"))
+        if start is None:
+            return
+        end = _event_time(item.get("end")) or start
+        event = {
+            "id": item["id"],
+            "summary": item.get("summary") or "(no title)",
+            "start": item["start"].get("dateTime") or item["start"].get("date"),
+            "start_ts": start,
+            "end_ts": end,
+        }
+        self.events[item["id"]] = event
+        bisect.insort(self._index, (start, item["id"]))
+        self._max_duration = max(self._max_duration, end - start)
+
+    def _remove(self, event_id: str):
+        event = self.events.pop(event_id, None)
+        if event is not None:
+            i = bisect.bisect_left(self._index, (event["start_ts"], event_id))
+            del self._index[i]
+
+    def prune(self, before: float):
+        """
+        Drop events that ended before the given time.
+        """
+        limit = bisect.bisect_left(self._index, (before,))
+        for _, event_id in self._index[:limit]:
+            if self.events[event_id]["end_ts"] < before:
+                self._remove(event_id)
+
+    def between(self, start: float, end: float) -> list:
+        """
+        Events starting in [start, end), in start order.
+        """
+        lo = bisect.bisect_left(self._index, (start,))
+        hi = bisect.bisect_left(self._index, (end,))
+        return [self.events[event_id] for _, event_id in self._index[lo:hi]]
+
+    def overlapping(self, start: float, end: float) -> list:
+        """
+        Events that overlap [start, end).
+        """
+        lo = bisect.bisect_left(self._index, (start - self._max_duration,))
+        hi = bisect.bisect_left(self._index, (end,))
+        return [
+            self.events[event_id]
+            for _, event_id in self._index[lo:hi]
+            if self.events[event_id]["end_ts"] > start
+        ]
+
+
+class CalendarSync:
+    """
+    Local copies of users' Google calendars, kept current with incremental
+    sync.
+
+    The first time a calendar is used it is fetched in full, and Google's
+    nextSyncToken is kept. After that a background loop asks only for what
+    changed since that token, every CALENDAR_SYNC_SECONDS, for every
+    calendar used within CALENDAR_IDLE_SECONDS. If Google answers 410 Gone
+    the sync token has expired, and the calendar is fetched in full again.
+    A full fetch builds a new store and swaps it in when complete, so
+    readers never see a half-synced calendar.
+
+    list_events and conflict checks read the in-memory store, so only the
+    first look at a calendar waits on Google.
+    """
+
+    def __init__(self, base_url: str = GOOGLE_CALENDAR_URL):
+        self.base_url = base_url
+        self._stores = OrderedDict()
+        self._inflight = {}
+        self._task: asyncio.Task = None
+
+        self.full_syncs = 0
+        self.incremental_syncs = 0
+        self.expired_tokens = 0
+        self.failures = 0
+        self.changes = 0
+        self.sync_time = LatencyWindow()
+        self.query_time = LatencyWindow()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for task in list(self._inflight.values()):
+            task.cancel()
+
+    async def events(self, user_id: str, start: datetime, end: datetime) -> list:
+        """
+        Events starting between start and end, or None if the calendar
+        isn't available (not connected, or the first sync failed).
+        """
+        store = await self._store(user_id)
+        if store is None:
+            return None
+        started = time.perf_counter()
+        events = store.between(start.timestamp(), end.timestamp())
+        self.query_time.record(time.perf_counter() - started)
+        return events
+
+    async def conflicts(self, user_id: str, start: datetime, end: datetime) -> list:
+        """
+        Events overlapping [start, end), or None if the calendar isn't available.
+        """
+        store = await self._store(user_id)
+        if store is None:
+            return None
+        started = time.perf_counter()
+        events = store.overlapping(start.timestamp(), end.timestamp())
+        self.query_time.record(time.perf_counter() - started)
+        return events
+
+    async def _store(self, user_id: str) -> EventStore:
+        store = self._stores.get(user_id)
+        if store is None or store.sync_token is None:
+            await self.sync(user_id)
+            store = self._stores.get(user_id)
+            if store is None or store.sync_token is None:
+                return None
+        store.used_at = time.monotonic()
+        self._stores.move_to_end(user_id)
+        return store
+
+    async def sync(self, user_id: str) -> bool:
+        """
+        Bring one calendar up to date. Concurrent calls for the same user
+        share one sync.
+        """
+        task = self._inflight.get(user_id)
+        if task is None or task.done():
+            task = asyncio.create_task(self._sync(user_id))
+            self._inflight[user_id] = task
+            task.add_done_callback(lambda done: self._finished(user_id, done))
+        return await asyncio.shield(task)
+
+    def _finished(self, user_id: str, task: asyncio.Task):
+        if self._inflight.get(user_id) is task:
+            del self._inflight[user_id]
+
+    async def _sync(self, user_id: str) -> bool:
+        started = time.perf_counter()
+        store = self._stores.get(user_id)
+        try:
+            if store is not None and store.sync_token is not None:
+                try:
+                    items, token = await self._fetch(user_id, store.sync_token)
+                    for item in items:
+                        store.apply(item)
+                    self.incremental_syncs += 1
+                    self.changes += len(items)
+                except SyncTokenExpired:
+                    self.expired_tokens += 1
+                    print(f"[CALENDAR] Sync token for {user_id} expired; resyncing")
+                    store = None
+            if store is None or store.sync_token is None:
+                fresh = EventStore()
+                items, token = await self._fetch(user_id, None)
+                for item in items:
+                    fresh.apply(item)
+                if store is not None:
+                    fresh.used_at = store.used_at
+                store = fresh
+                self.full_syncs += 1
+        except Exception as e:
+            self.failures += 1
+            print(f"[CALENDAR] Sync for {user_id} failed: {e!r}")
+            return False
+
+        if token is None:
+            # Not connected to Google
+            return False
+        store.sync_token = token
+        store.synced_at = time.monotonic()
+        store.prune(time.time() - CALENDAR_PAST_DAYS * 86400)
+        self._remember(user_id, store)
+        self.sync_time.record(time.perf_counter() - started)
+        return True
+
+    async def _fetch(self, user_id: str, sync_token: str):
+        """
+        Page through events.list. Returns (items, next sync token); the
+        token is None when the user has no usable Google credentials.
+        """
+        access_token = await google_tokens.get(user_id)
+        if not access_token:
+            return [], None
+
+        params = {"singleEvents": "true", "maxResults": CALENDAR_PAGE_SIZE}
+        if sync_token:
+            params["syncToken"] = sync_token
+        else:
+            past = datetime.now(timezone.utc) - timedelta(days=CALENDAR_PAST_DAYS)
+            params["timeMin"] = past.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+        url = f"{self.base_url}/calendars/primary/events"
+        items = []
+        retried = False
+        while True:
+            response = await google_tokens.client.get(
+                url, params=params, headers={"Authorization": f"Bearer {access_token}"}
+            )
+            if response.status_code == 401 and not retried:
+                retried = True
+                access_token = await google_tokens.refresh(user_id)
+                if not access_token:
+                    return [], None
+                continue
+            if response.status_code == 410:
+                raise SyncTokenExpired()
+            response.raise_for_status()
+
+            page = response.json()
+            items.extend(page.get("items", []))
+            if page.get("nextPageToken"):
+                params["pageToken"] = page["nextPageToken"]
+                continue
+            return items, page.get("nextSyncToken")
+
+    def _remember(self, user_id: str, store: EventStore):
+        self._stores[user_id] = store
+        self._stores.move_to_end(user_id)
+        while len(self._stores) > CALENDAR_MAX_USERS:
+            self._stores.popitem(last=False)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(CALENDAR_SYNC_SECONDS)
+            now = time.monotonic()
+            for user_id, store in list(self._stores.items()):
+                if now - store.used_at > CALENDAR_IDLE_SECONDS:
+                    self._stores.pop(user_id, None)
+                elif now - store.synced_at >= CALENDAR_SYNC_SECONDS:
+                    await self.sync(user_id)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._stores),
+            "events": sum(len(store) for store in self._stores.values()),
+            "full_syncs": self.full_syncs,
+            "incremental_syncs": self.incremental_syncs,
+            "expired_tokens": self.expired_tokens,
+            "changes": self.changes,
+            "failures": self.failures,
+            "sync_time": self.sync_time.snapshot(),
+            "query_time": self.query_time.snapshot(),
+        }
+
+
+calendar_sync = CalendarSync()
@@ -0,0 +1,229 @@
+import os
+import asyncio
+from collections import OrderedDict
+from app.llm import llm
+from app.admission import admission, BACKGROUND
+from app.prompts import CONVERSATION_SUMMARY_PROMPT
+from app.metrics import ValueWindow
+from app.db import _parse_timestamp
+
+# Token budget for the whole prompt (system + context + user message)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2500"))
+MEMORY_ITEM_MAX_TOKENS = int(os.getenv("MEMORY_ITEM_MAX_TOKENS", "150"))
+# Recent turns shown verbatim; older fetched turns are folded into the summary
+CONTEXT_MAX_TURNS = int(os.getenv("CONTEXT_MAX_TURNS", "10"))
+CONTEXT_FETCH_TURNS = int(os.getenv("CONTEXT_FETCH_TURNS", "20"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "200"))
+SUMMARY_MIN_NEW_TURNS = int(os.getenv("SUMMARY_MIN_NEW_TURNS", "6"))
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "5000"))
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception as e:
+    print(f"[CONTEXT] tiktoken unavailable ({e!r}), estimating tokens from length")
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # Roughly 4 characters per token for English chat
+    return len(text) // 4 + 1
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _encoding is not None:
+        return (
+            _encoding.decode(_encoding.encode(text, disallowed_special=())[:max_tokens])
+            + "…"
+        )
+    return text[: max_tokens * 4] + "…"
+
+
+class ConversationSummaries:
+    """
+    Rolling per-user summaries of turns that no longer fit in the prompt.
+
+    Summaries are refreshed in the background with one small LLM call once
+    enough new turns have fallen out of the window, so the request path
+    only ever reads the cached text.
+    """
+
+    def __init__(self, max_users: int = SUMMARY_CACHE_SIZE):
+        self.max_users = max_users
+        # user_id -> (summary, created_at of the newest turn covered)
+        self._summaries = OrderedDict()
+        self._refreshing = {}
+
+        self.refreshes = 0
+        self.failures = 0
+
+    def get(self, user_id: str) -> str:
+        entry = self._summaries.get(user_id)
+        if entry is None:
+            return ""
+        self._summaries.move_to_end(user_id)
+        return entry[0]
+
+    def refresh(self, user_id: str, turns: list):
+        """
+        Fold turns (newest first) into the user's summary in the background.
+        """
+        if user_id in self._refreshing:
+            return
+
+        _, covered = self._summaries.get(user_id, ("", None))
+        new_turns = [
+            t
+            for t in reversed(turns)
+            if covered is None or _parse_timestamp(t["created_at"]) > covered
+        ]
+        if len(new_turns) < SUMMARY_MIN_NEW_TURNS:
+            return
+
+        self._refreshing[user_id] = asyncio.create_task(
+            self._refresh(user_id, new_turns)
+        )
+
+    async def _refresh(self, user_id: str, new_turns: list):
+        summary = self.get(user_id)
+        lines = "\n".join(
+            f"- {truncate_tokens(t['content'], MEMORY_ITEM_MAX_TOKENS)}"
+            for t in new_turns
+        )
+        messages = [
+            {"role": "system", "content": CONVERSATION_SUMMARY_PROMPT},
+            {
+                "role": "user",
+                "content": f"Current summary:\n{summary or '(none)'}\n\nNew messages:\n{lines}",
+            },
+        ]
+        try:
+            if not await admission.admit(BACKGROUND):
+                return
+            updated = await llm.complete(
+                messages, temperature=0.2, max_tokens=SUMMARY_MAX_TOKENS
+            )
+            covered = _parse_timestamp(new_turns[-1]["created_at"])
+            self._summaries[user_id] = (updated.strip(), covered)
+            self._summaries.move_to_end(user_id)
+            while len(self._summaries) > self.max_users:
+                self._summaries.popitem(last=False)
+            self.refreshes += 1
+        except Exception as e:
+            self.failures += 1
+            print(f"[CONTEXT] Summary refresh failed for {user_id}: {e!r}")
+        finally:
+            self._refreshing.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._summaries),
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "in_progress": len(self._refreshing),
+        }
+
+
+class ContextBuilder:
+    """
+    Assembles the system prompt within a fixed token budget.
+
+    Sections are added by priority: system prompt, profile, relevant older
+    memories, the rolling summary, then recent turns newest first. Whatever
+    doesn't fit is left out.
+    """
+
+    def __init__(self, budget: int = PROMPT_TOKEN_BUDGET):
+        self.budget = budget
+        self.prompt_tokens = ValueWindow()
+        self.dropped_turns = ValueWindow()
+
+    def build(
+        self,
+        system_prompt: str,
+        user_message: str,
+        profile_section: str = "",
+        relevant: list = (),
+        summary: str = "",
+        recent: list = (),
+    ):
+        """
+        Return (prompt, overflow) where overflow lists the recent turns
+        (newest first) that were not included verbatim.
+        """
+        prompt = system_prompt
+        used = count_tokens(system_prompt) + count_tokens(user_message)
+
+        def fits(text: str) -> bool:
+            return used + count_tokens(text) <= self.budget
+
+        if profile_section and fits(profile_section):
+            prompt += profile_section
+            used += count_tokens(profile_section)
+
+        section, _ = self._list_section(
+            "\n\nThings they mentioned before:\n", relevant, self.budget - used
+        )
+        prompt += section
+        used += count_tokens(section)
+
+        if summary:
+            section = f"\n\nEarlier in this chat:\n{summary}\n"
+            if fits(section):
+                prompt += section
+                used += count_tokens(section)
+
+        turns = list(recent[:CONTEXT_MAX_TURNS])
+        section, included = self._list_section(
+            "\n\nPrevious conversation context:\n",
+            [turn["content"] for turn in turns],
+            self.budget - used,
+        )
+        prompt += section
+        used += count_tokens(section)
+
+        overflow = turns[included:] + list(recent[CONTEXT_MAX_TURNS:])
+        self.prompt_tokens.record(used)
+        self.dropped_turns.record(len(overflow))
+        print(f"[CONTEXT] prompt_tokens={used} dropped_turns={len(overflow)}")
+        return prompt, overflow
+
+    @staticmethod
+    def _list_section(header: str, items: list, remaining: int):
+        """
+        Return (section, number of items that fit).
+        """
+        if not items:
+            return "", 0
+
+        section = header
+        used = count_tokens(header)
+        added = 0
+        for item in items:
+            line = f"- {truncate_tokens(item, MEMORY_ITEM_MAX_TOKENS)}\n"
+            cost = count_tokens(line)
+            if used + cost > remaining:
+                break
+            section += line
+            used += cost
+            added += 1
+        return (section, added) if added else ("", 0)
+
+    def stats(self) -> dict:
+        return {
+            "budget": self.budget,
+            "tokenizer": "cl100k_base" if _encoding is not None else "estimate",
+            "prompt_tokens": self.prompt_tokens.snapshot(),
+            "dropped_turns": self.dropped_turns.snapshot(),
+        }
+
+
+context_builder = ContextBuilder()
+summaries = ConversationSummaries()
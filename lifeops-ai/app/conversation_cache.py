@@ -0,0 +1,123 @@
+import os
+from collections import OrderedDict, deque
+
+CONVERSATION_WINDOW = int(os.getenv("CONVERSATION_WINDOW", "30"))
+CONVERSATION_CACHE_MAX_BYTES = int(
+    os.getenv("CONVERSATION_CACHE_MAX_BYTES", str(32 * 1024 * 1024))
+)
+
+# Rough per-row overhead of the dict itself on top of its text
+ROW_OVERHEAD_BYTES = 200
+
+
+class _Window:
+    def __init__(self, size: int):
+        self.rows = deque(maxlen=size)
+        # True when the database held fewer rows than the window when it was
+        # loaded, i.e. the window is the user's whole history
+        self.complete = False
+        self.bytes = 0
+
+
+class ConversationCache:
+    """
+    In-process ring buffer of each user's most recent memories.
+
+    A user's window is loaded from the database once, then kept current by
+    appending on every write, so building context usually needs no read.
+    Users are evicted least-recently-used once the global byte cap is hit.
+    """
+
+    def __init__(
+        self,
+        window: int = CONVERSATION_WINDOW,
+        max_bytes: int = CONVERSATION_CACHE_MAX_BYTES,
+    ):
+        self.window = window
+        self.max_bytes = max_bytes
+        self._users = OrderedDict()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size(row: dict) -> int:
+        return len(row.get("content") or "") + ROW_OVERHEAD_BYTES
+
+    def get(self, user_id: str, limit: int, exclude_types: tuple = ()) -> list:
+        """
+        Return the newest `limit` rows (newest first) or None on a miss.
+        """
+        entry = self._users.get(user_id)
+        if entry is not None:
+            rows = [
+                r for r in reversed(entry.rows) if r["memory_type"] not in exclude_types
+            ]
+            if len(rows) >= limit or entry.complete:
+                self.hits += 1
+                self._users.move_to_end(user_id)
+                return rows[:limit]
+
+        self.misses += 1
+        return None
+
+    def fill(self, user_id: str, rows: list, complete: bool):
+        """
+        Load a user's window from database rows given newest first.
+        """
+        self.invalidate(user_id)
+        entry = _Window(self.window)
+        entry.complete = complete and len(rows) <= self.window
+        self._users[user_id] = entry
+        for row in reversed(rows[: self.window]):
+            self._push(entry, row)
+        self._evict()
+
+    def append(self, user_id: str, row: dict):
+        """
+        Record a new write. Users that are not cached stay cold.
+        """
+        entry = self._users.get(user_id)
+        if entry is None:
+            return
+        self._push(entry, row)
+        self._evict()
+
+    def _push(self, entry: _Window, row: dict):
+        if len(entry.rows) == entry.rows.maxlen:
+            dropped = self._size(entry.rows[0])
+            entry.bytes -= dropped
+            self.bytes -= dropped
+            # Older history now exists outside the window
+            entry.complete = False
+        entry.rows.append(row)
+        entry.bytes += self._size(row)
+        self.bytes += self._size(row)
+
+    def invalidate(self, user_id: str):
+        entry = self._users.pop(user_id, None)
+        if entry is not None:
+            self.bytes -= entry.bytes
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and len(self._users) > 1:
+            _, entry = self._users.popitem(last=False)
+            self.bytes -= entry.bytes
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "users": len(self._users),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+conversation_cache = ConversationCache()
@@ -0,0 +1,440 @@
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from app.db import get_client, execute
+
+# memory: single process (default); sqlite: workers sharing one host/volume;
+# supabase: any number of instances
+COORDINATION_BACKEND = os.getenv("COORDINATION_BACKEND", "memory")
+COORDINATION_SQLITE_PATH = os.getenv("COORDINATION_SQLITE_PATH", "coordination.sqlite3")
+LEADER_LEASE_SECONDS = float(os.getenv("LEADER_LEASE_SECONDS", "15"))
+SHARED_STATE_MAX_ENTRIES = int(os.getenv("SHARED_STATE_MAX_ENTRIES", "100000"))
+# How often the scheduler leader deletes expired shared state (0 disables)
+STATE_PURGE_INTERVAL_SECONDS = float(os.getenv("STATE_PURGE_INTERVAL_SECONDS", "3600"))
+
+# Identifies this process as a lease holder
+NODE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class MemoryBackend:
+    """
+    In-process leases and state. Only correct for a single worker.
+    """
+
+    shared = False
+
+    def __init__(self, max_entries: int = SHARED_STATE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._leases = {}
+        self._state = OrderedDict()
+
+    async def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        now = time.time()
+        current = self._leases.get(name)
+        if current and current[0] != holder and current[1] > now:
+            return False
+        self._leases[name] = (holder, now + ttl)
+        return True
+
+    async def release_lease(self, name: str, holder: str):
+        if self._leases.get(name, (None,))[0] == holder:
+            del self._leases[name]
+
+    async def get(self, key: str) -> str:
+        entry = self._state.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.time():
+            del self._state[key]
+            return None
+        return entry[0]
+
+    async def set(self, key: str, value: str, ttl: float = None):
+        self._state[key] = (value, time.time() + ttl if ttl else None)
+        self._state.move_to_end(key)
+        while len(self._state) > self.max_entries:
+            self._state.popitem(last=False)
+
+    async def add(self, key: str, value: str = "", ttl: float = None) -> bool:
+        if await self.get(key) is not None:
+            return False
+        await self.set(key, value, ttl)
+        return True
+
+    async def delete(self, key: str):
+        self._state.pop(key, None)
+
+    async def purge(self) -> int:
+        now = time.time()
+        expired = [
+            key
+            for key, (_, expires_at) in self._state.items()
+            if expires_at is not None and expires_at <= now
+        ]
+        for key in expired:
+            del self._state[key]
+        return len(expired)
+
+    async def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """
+    Leases and state in a SQLite file shared by every worker on one host,
+    or a local stand-in for Postgres when testing failover.
+    All access happens on one dedicated thread per process.
+    """
+
+    shared = True
+
+    def __init__(self, path: str = COORDINATION_SQLITE_PATH):
+        self.path = path
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="coordination"
+        )
+        self._conn: sqlite3.Connection = None
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS shared_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT,
+                    expires_at REAL
+                )
+                """)
+        return self._conn
+
+    def _acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        now = time.time()
+        conn = self._connect()
+        # One statement, so two workers can't both win
+        conn.execute(
+            """
+            INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                holder = excluded.holder, expires_at = excluded.expires_at
+            WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+            """,
+            (name, holder, now + ttl, now),
+        )
+        row = conn.execute(
+            "SELECT holder FROM leases WHERE name = ?", (name,)
+        ).fetchone()
+        return row is not None and row[0] == holder
+
+    def _release_lease(self, name: str, holder: str):
+        self._connect().execute(
+            "DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder)
+        )
+
+    def _get(self, key: str) -> str:
+        row = (
+            self._connect()
+            .execute(
+                "SELECT value FROM shared_state WHERE key = ? "
+                "AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time()),
+            )
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def _set(self, key: str, value: str, ttl: float = None):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, time.time() + ttl if ttl else None),
+        )
+
+    def _add(self, key: str, value: str, ttl: float = None) -> bool:
+        now = time.time()
+        cursor = self._connect().execute(
+            """
+            INSERT INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                value = excluded.value, expires_at = excluded.expires_at
+            WHERE shared_state.expires_at IS NOT NULL AND shared_state.expires_at <= ?
+            """,
+            (key, value, now + ttl if ttl else None, now),
+        )
+        return cursor.rowcount == 1
+
+    def _delete(self, key: str):
+        self._connect().execute("DELETE FROM shared_state WHERE key = ?", (key,))
+
+    def _purge(self) -> int:
+        cursor = self._connect().execute(
+            "DELETE FROM shared_state WHERE expires_at IS NOT NULL AND expires_at <= ?",
+            (time.time(),),
+        )
+        return cursor.rowcount
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        return await self._run(self._acquire_lease, name, holder, ttl)
+
+    async def release_lease(self, name: str, holder: str):
+        await self._run(self._release_lease, name, holder)
+
+    async def get(self, key: str) -> str:
+        return await self._run(self._get, key)
+
+    async def set(self, key: str, value: str, ttl: float = None):
+        await self._run(self._set, key, value, ttl)
+
+    async def add(self, key: str, value: str = "", ttl: float = None) -> bool:
+        return await self._run(self._add, key, value, ttl)
+
+    async def delete(self, key: str):
+        await self._run(self._delete, key)
+
+    async def purge(self) -> int:
+        return await self._run(self._purge)
+
+    async def close(self):
+        await self._run(self._close)
+
+
+class SupabaseBackend:
+    """
+    Leases and state in Postgres through PostgREST (tables `leases` and
+    `shared_state` in supabase_schema.sql).
+
+    A lease is taken with a conditional update that only matches when this
+    node already holds it or it has expired, so at most one node wins.
+    Expiry uses node clocks; keep the lease much longer than clock skew.
+    """
+
+    shared = True
+
+    @staticmethod
+    def _at(seconds: float = 0) -> str:
+        # "Z" rather than "+00:00" so the value survives PostgREST filter syntax
+        moment = datetime.now(timezone.utc) + timedelta(seconds=seconds)
+        return moment.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+    async def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        db = await get_client()
+        if not db:
+            return False
+
+        row = {"name": name, "holder": holder, "expires_at": self._at(ttl)}
+        # First node ever to ask creates the row
+        result = await execute(
+            db.table("leases").upsert(row, on_conflict="name", ignore_duplicates=True)
+        )
+        if result.data:
+            return True
+
+        result = await execute(
+            db.table("leases")
+            .update({"holder": holder, "expires_at": row["expires_at"]})
+            .eq("name", name)
+            .or_(f'holder.eq."{holder}",expires_at.lt.{self._at()}')
+        )
+        return bool(result.data)
+
+    async def release_lease(self, name: str, holder: str):
+        db = await get_client()
+        if db:
+            await execute(
+                db.table("leases").delete().eq("name", name).eq("holder", holder)
+            )
+
+    async def get(self, key: str) -> str:
+        db = await get_client()
+        if not db:
+            return None
+        result = await execute(
+            db.table("shared_state")
+            .select("value, expires_at")
+            .eq("key", key)
+            .or_(f"expires_at.is.null,expires_at.gt.{self._at()}")
+            .limit(1)
+        )
+        return result.data[0]["value"] if result.data else None
+
+    async def set(self, key: str, value: str, ttl: float = None):
+        db = await get_client()
+        if db:
+            await execute(
+                db.table("shared_state").upsert(
+                    {
+                        "key": key,
+                        "value": value,
+                        "expires_at": self._at(ttl) if ttl else None,
+                    },
+                    on_conflict="key",
+                )
+            )
+
+    async def add(self, key: str, value: str = "", ttl: float = None) -> bool:
+        db = await get_client()
+        if not db:
+            return True
+        row = {"key": key, "value": value, "expires_at": self._at(ttl) if ttl else None}
+        result = await execute(
+            db.table("shared_state").upsert(
+                row, on_conflict="key", ignore_duplicates=True
+            )
+        )
+        if result.data:
+            return True
+        # Present; take it over only if it has expired
+        result = await execute(
+            db.table("shared_state")
+            .update({"value": value, "expires_at": row["expires_at"]})
+            .eq("key", key)
+            .lt("expires_at", self._at())
+        )
+        return bool(result.data)
+
+    async def delete(self, key: str):
+        db = await get_client()
+        if db:
+            await execute(db.table("shared_state").delete().eq("key", key))
+
+    async def purge(self) -> int:
+        db = await get_client()
+        if not db:
+            return 0
+        result = await execute(
+            db.table("shared_state").delete().lt("expires_at", self._at())
+        )
+        return len(result.data or [])
+
+    async def close(self):
+        pass
+
+
+def create_backend(kind: str = COORDINATION_BACKEND):
+    if kind == "sqlite":
+        return SQLiteBackend()
+    if kind == "supabase":
+        return SupabaseBackend()
+    if kind != "memory":
+        print(f"[COORDINATION] Unknown backend {kind!r}, using memory")
+    return MemoryBackend()
+
+
+class LeaderElector:
+    """
+    Keeps one node in charge of a named role (e.g. the scheduler).
+
+    Every node tries to take or renew the lease every ttl/3 seconds. The
+    holder runs the on_elected callbacks; if it can't renew before its
+    lease runs out it steps down and runs on_demoted, and another node
+    takes over once the lease expires. A clean shutdown releases the lease
+    so failover is immediate.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        backend,
+        ttl: float = LEADER_LEASE_SECONDS,
+        node_id: str = NODE_ID,
+    ):
+        self.name = name
+        self.backend = backend
+        self.ttl = ttl
+        self.node_id = node_id
+        self.is_leader = False
+        self.on_elected = []
+        self.on_demoted = []
+
+        self._valid_until = 0.0
+        self._task: asyncio.Task = None
+
+        self.elections = 0
+        self.renew_failures = 0
+
+    async def start(self):
+        await self._tick()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            await self._tick()
+
+    async def _tick(self):
+        started = time.monotonic()
+        try:
+            held = await self.backend.acquire_lease(self.name, self.node_id, self.ttl)
+        except Exception as e:
+            self.renew_failures += 1
+            print(f"[COORDINATION] Lease check for {self.name} failed: {e!r}")
+            # Keep leading only while our last lease is certainly still valid
+            held = self.is_leader and time.monotonic() < self._valid_until
+
+        if held:
+            # Leave a margin for the time the call took
+            self._valid_until = started + self.ttl - self.ttl / 3
+            if not self.is_leader:
+                self.is_leader = True
+                self.elections += 1
+                print(f"[COORDINATION] {self.node_id} is now leader for {self.name}")
+                await self._notify(self.on_elected)
+        elif self.is_leader:
+            self.is_leader = False
+            print(f"[COORDINATION] {self.node_id} lost leadership of {self.name}")
+            await self._notify(self.on_demoted)
+
+    async def _notify(self, callbacks: list):
+        for callback in callbacks:
+            try:
+                result = callback()
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                print(f"[COORDINATION] Leadership callback failed: {e!r}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.is_leader:
+            self.is_leader = False
+            await self._notify(self.on_demoted)
+            try:
+                await self.backend.release_lease(self.name, self.node_id)
+            except Exception as e:
+                print(f"[COORDINATION] Failed to release {self.name}: {e!r}")
+
+    def stats(self) -> dict:
+        return {
+            "node_id": self.node_id,
+            "is_leader": self.is_leader,
+            "elections": self.elections,
+            "renew_failures": self.renew_failures,
+        }
+
+
+shared_state = create_backend()
+scheduler_leader = LeaderElector("scheduler", shared_state)
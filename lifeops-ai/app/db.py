@@ -1,14 +1,190 @@
 import os
-from supabase import create_client, Client
+import asyncio
+import httpx
+from supabase import acreate_client, AsyncClient
+from supabase.lib.client_options import AsyncClientOptions
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timezone
+from app.writebuffer import WriteBuffer
+from app.storage import SQLiteStore, Replicator, STORAGE_BACKEND, STORAGE_REPLICATE
+from app.conversation_cache import conversation_cache
 
 load_dotenv()
 
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 
-supabase: Client = create_client(url, key) if url and key else None
+# Connection pool and limits for the async Supabase client
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_CONCURRENCY = int(os.getenv("DB_MAX_CONCURRENCY", "10"))
+DB_TIMEOUT_SECONDS = float(os.getenv("DB_TIMEOUT_SECONDS", "5"))
+
+# Write-behind batching for memories and group messages
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "50"))
+WRITE_FLUSH_INTERVAL_SECONDS = float(os.getenv("WRITE_FLUSH_INTERVAL_SECONDS", "0.5"))
+WRITE_MAX_PENDING = int(os.getenv("WRITE_MAX_PENDING", "5000"))
+
+# Created lazily on the running event loop, see get_client()
+supabase: AsyncClient = None
+_http_client: httpx.AsyncClient = None
+_init_lock = asyncio.Lock()
+_db_slots = asyncio.Semaphore(DB_MAX_CONCURRENCY)
+# Used instead of Supabase when STORAGE_BACKEND=sqlite
+_store: SQLiteStore = None
+_replicator: Replicator = None
+
+
+async def get_client():
+    """
+    Return the shared storage client: the local SQLite store when
+    STORAGE_BACKEND=sqlite, otherwise the Supabase client. Both take the
+    same query builder calls.
+    """
+    global _store, _replicator
+
+    if STORAGE_BACKEND != "sqlite":
+        return await _supabase_client()
+
+    if _store is None:
+        _store = SQLiteStore(replicate=STORAGE_REPLICATE)
+        print(f"[DB] Using SQLite storage at {_store.path}")
+        if STORAGE_REPLICATE:
+            _replicator = Replicator(_store, _supabase_client, execute)
+            _replicator.start()
+    return _store
+
+
+async def _supabase_client() -> AsyncClient:
+    """
+    Return the shared async Supabase client, creating it on first use.
+    All PostgREST calls go through one pooled HTTP client.
+    """
+    global supabase, _http_client
+
+    if supabase is not None or not (url and key):
+        return supabase
+
+    async with _init_lock:
+        if supabase is None:
+            _http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=DB_POOL_SIZE,
+                    max_keepalive_connections=DB_POOL_SIZE,
+                ),
+                timeout=DB_TIMEOUT_SECONDS,
+                follow_redirects=True,
+                http2=True,
+            )
+            supabase = await acreate_client(
+                url, key, options=AsyncClientOptions(httpx_client=_http_client)
+            )
+            print(
+                f"[DB] Async Supabase client ready (pool={DB_POOL_SIZE}, concurrency={DB_MAX_CONCURRENCY})"
+            )
+
+    return supabase
+
+
+async def execute(query, timeout: float = None):
+    """
+    Run a PostgREST query builder without blocking the event loop.
+    Calls are bounded by the concurrency limit and a per-call timeout.
+    """
+    async with _db_slots:
+        return await asyncio.wait_for(
+            query.execute(), timeout=timeout or DB_TIMEOUT_SECONDS
+        )
+
+
+def db_load() -> float:
+    """
+    Fraction of the query concurrency limit currently in use.
+    """
+    return 1 - _db_slots._value / DB_MAX_CONCURRENCY
+
+
+# Callbacks run with (user_id, row) for every saved memory, e.g. the retrieval index
+memory_listeners = []
+# Callbacks run with (group_id, row) for every saved group message
+group_listeners = []
+
+memory_writes = WriteBuffer(
+    "memories",
+    get_client,
+    execute,
+    batch_size=WRITE_BATCH_SIZE,
+    flush_interval=WRITE_FLUSH_INTERVAL_SECONDS,
+    max_pending=WRITE_MAX_PENDING,
+)
+group_writes = WriteBuffer(
+    "group_messages",
+    get_client,
+    execute,
+    batch_size=WRITE_BATCH_SIZE,
+    flush_interval=WRITE_FLUSH_INTERVAL_SECONDS,
+    max_pending=WRITE_MAX_PENDING,
+)
+
+
+def _configured() -> bool:
+    return STORAGE_BACKEND == "sqlite" or bool(url and key)
+
+
+def _parse_timestamp(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _merge_pending(rows: list, pending: list, text_field: str, limit: int) -> list:
+    """
+    Combine rows read from the database with writes that are still buffered,
+    newest first. Rows that landed while the query ran are only kept once.
+    """
+    if not pending:
+        return rows
+
+    stored = {(_parse_timestamp(r["created_at"]), r[text_field]) for r in rows}
+    merged = rows + [
+        r
+        for r in pending
+        if (_parse_timestamp(r["created_at"]), r[text_field]) not in stored
+    ]
+    merged.sort(key=lambda r: _parse_timestamp(r["created_at"]), reverse=True)
+    return merged[:limit]
+
+
+def write_stats() -> dict:
+    return {"memories": memory_writes.stats(), "group_messages": group_writes.stats()}
+
+
+def storage_stats() -> dict:
+    if _store is None:
+        return {"backend": STORAGE_BACKEND}
+    stats = _store.stats()
+    if _replicator is not None:
+        stats["replication"] = _replicator.stats()
+    return stats
+
+
+async def close_db():
+    """
+    Flush buffered writes and close the pooled HTTP client on shutdown.
+    """
+    global supabase, _http_client, _store, _replicator
+
+    await memory_writes.close()
+    await group_writes.close()
+    if _replicator is not None:
+        # Unreplicated writes stay in the log and go out after the restart
+        await _replicator.stop()
+        _replicator = None
+    if _store is not None:
+        await _store.close()
+        _store = None
+    if _http_client is not None:
+        await _http_client.aclose()
+    supabase = None
+    _http_client = None
 
 
 async def save_memory(user_id: str, content: str, memory_type: str = "general"):
@@ -19,53 +195,71 @@ async def save_memory(user_id: str, content: str, memory_type: str = "general"):
         f"[DEBUG] save_memory called: user_id={user_id}, content='{content}', type={memory_type}"
     )
 
-    if not supabase:
+    if not _configured():
         print("[ERROR] Supabase not configured - check .env file!")
         return None
 
-    try:
-        result = (
-            supabase.table("memories")
-            .insert(
-                {
-                    "user_id": user_id,
-                    "content": content,
-                    "memory_type": memory_type,
-                    "created_at": datetime.utcnow().isoformat(),
-                }
-            )
-            .execute()
-        )
-        print(f"[SUCCESS] Memory saved to database!")
-        return result
-    except Exception as e:
-        print(f"[ERROR] Error saving memory: {e}")
-        import traceback
+    # Buffered; written in the next batch insert
+    row = {
+        "user_id": user_id,
+        "content": content,
+        "memory_type": memory_type,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    memory_writes.add(row)
+    conversation_cache.append(user_id, row)
+    for listener in memory_listeners:
+        listener(user_id, row)
+    return row
 
-        traceback.print_exc()
-        return None
 
-
-async def get_user_memories(user_id: str, limit: int = 10):
+async def get_user_memories(user_id: str, limit: int = 10, exclude_types: tuple = ()):
     """
-    Retrieve recent memories for a user.
+    Retrieve recent memories for a user, optionally skipping some memory types.
+    Served from the conversation cache when the user's window is loaded.
     """
-    if not supabase:
+    cached = conversation_cache.get(user_id, limit, exclude_types)
+    if cached is not None:
+        return cached
+
+    db = await get_client()
+    if not db:
         print("Supabase not configured")
         return []
 
     try:
-        result = (
-            supabase.table("memories")
+        # Load the whole window so the next reads come from memory
+        window = max(limit, conversation_cache.window)
+        result = await execute(
+            db.table("memories")
+            .select("*")
+            .eq("user_id", user_id)
+            .order("created_at", desc=True)
+            .limit(window)
+        )
+        stored = result.data if result.data else []
+        rows = _merge_pending(
+            stored, memory_writes.pending_rows(user_id=user_id), "content", window
+        )
+        complete = len(stored) < window
+        conversation_cache.fill(user_id, rows, complete)
+
+        rows = [row for row in rows if row["memory_type"] not in exclude_types]
+        if len(rows) >= limit or complete:
+            return rows[:limit]
+
+        # Too many excluded rows in the window; ask the database directly
+        result = await execute(
+            db.table("memories")
             .select("*")
             .eq("user_id", user_id)
+            .not_.in_("memory_type", list(exclude_types))
             .order("created_at", desc=True)
             .limit(limit)
-            .execute()
         )
         return result.data if result.data else []
     except Exception as e:
-        print(f"Error retrieving memories: {e}")
+        print(f"Error retrieving memories: {e!r}")
         return []
 
 
@@ -75,51 +269,44 @@ async def save_group_context(group_id: str, message: str, sender_id: str):
     """
     print(f"[DEBUG] save_group_context called: group_id={group_id}, sender={sender_id}")
 
-    if not supabase:
+    if not _configured():
         print("[ERROR] Supabase not configured")
         return None
 
-    try:
-        result = (
-            supabase.table("group_messages")
-            .insert(
-                {
-                    "group_id": group_id,
-                    "sender_id": sender_id,
-                    "message": message,
-                    "created_at": datetime.utcnow().isoformat(),
-                }
-            )
-            .execute()
-        )
-        print(f"[SUCCESS] Group context saved!")
-        return result
-    except Exception as e:
-        print(f"[ERROR] Error saving group context: {e}")
-        import traceback
-
-        traceback.print_exc()
-        return None
+    # Buffered; written in the next batch insert
+    row = {
+        "group_id": group_id,
+        "sender_id": sender_id,
+        "message": message,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    group_writes.add(row)
+    for listener in group_listeners:
+        listener(group_id, row)
+    return row
 
 
 async def get_group_context(group_id: str, limit: int = 20):
     """
     Retrieve recent group conversation context.
     """
-    if not supabase:
+    db = await get_client()
+    if not db:
         print("Supabase not configured")
         return []
 
     try:
-        result = (
-            supabase.table("group_messages")
+        result = await execute(
+            db.table("group_messages")
             .select("*")
             .eq("group_id", group_id)
             .order("created_at", desc=True)
             .limit(limit)
-            .execute()
         )
-        return result.data if result.data else []
+        rows = result.data if result.data else []
+        return _merge_pending(
+            rows, group_writes.pending_rows(group_id=group_id), "message", limit
+        )
     except Exception as e:
-        print(f"Error retrieving group context: {e}")
+        print(f"Error retrieving group context: {e!r}")
         return []
@@ -0,0 +1,146 @@
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from app.db import get_client, execute
+from app.coordination import shared_state
+
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "50000"))
+DEDUP_TTL_SECONDS = float(os.getenv("DEDUP_TTL_SECONDS", "86400"))
+# Also claim message IDs in the processed_messages table so several
+# workers/instances agree on what has been seen
+DEDUP_SHARED = os.getenv("DEDUP_SHARED", "false").lower() == "true"
+
+
+class MessageDeduplicator:
+    """
+    Remembers recently seen WhatsApp message IDs so retried webhook
+    deliveries are only processed once.
+
+    The local store is an LRU with a TTL; lookups and inserts are O(1) and
+    never touch the database. In shared mode the worker additionally claims
+    each ID in Supabase before processing it.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEDUP_MAX_ENTRIES,
+        ttl: float = DEDUP_TTL_SECONDS,
+        shared: bool = DEDUP_SHARED,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self._seen = OrderedDict()
+
+        self.duplicates = 0
+        self.shared_duplicates = 0
+        self.purged = 0
+
+    def check_and_mark(self, message_id: str) -> bool:
+        """
+        Return True if the ID was already seen, otherwise remember it.
+        """
+        if not message_id:
+            return False
+
+        now = time.monotonic()
+        expires_at = self._seen.get(message_id)
+        if expires_at is not None and expires_at > now:
+            self.duplicates += 1
+            return True
+
+        self._seen[message_id] = now + self.ttl
+        self._seen.move_to_end(message_id)
+        self._evict(now)
+        return False
+
+    def forget(self, message_id: str):
+        """
+        Drop an ID, e.g. when the message could not be queued and Meta will retry.
+        """
+        self._seen.pop(message_id, None)
+
+    def _evict(self, now: float):
+        # Entries share one TTL, so the oldest insert is always the first to expire
+        while self._seen:
+            oldest_id, expires_at = next(iter(self._seen.items()))
+            if len(self._seen) <= self.max_entries and expires_at > now:
+                break
+            del self._seen[oldest_id]
+
+    async def claim(self, message_id: str) -> bool:
+        """
+        Claim the ID in the shared store. Returns False if another worker or
+        instance already claimed it. Always True when shared mode is off.
+        """
+        if not message_id:
+            return True
+        if not self.shared:
+            if not shared_state.shared:
+                return True
+            # Workers coordinate through the shared-state backend instead
+            try:
+                claimed = await shared_state.add(f"msg:{message_id}", ttl=self.ttl)
+            except Exception as e:
+                print(f"[DEDUP] Shared-state claim failed for {message_id}: {e!r}")
+                return True
+            if not claimed:
+                self.shared_duplicates += 1
+            return claimed
+
+        db = await get_client()
+        if not db:
+            return True
+
+        try:
+            result = await execute(
+                db.table("processed_messages").upsert(
+                    {"message_id": message_id},
+                    on_conflict="message_id",
+                    ignore_duplicates=True,
+                )
+            )
+        except Exception as e:
+            # Fail open: a rare double reply beats dropping a message
+            print(f"[DEDUP] Shared claim failed for {message_id}: {e!r}")
+            return True
+
+        if not result.data:
+            self.shared_duplicates += 1
+            return False
+        return True
+
+    async def purge(self) -> int:
+        """
+        Delete processed_messages rows older than the TTL; Meta stops
+        retrying long before then. Only used in shared mode.
+        """
+        if not self.shared:
+            return 0
+        db = await get_client()
+        if not db:
+            return 0
+
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        result = await execute(
+            db.table("processed_messages")
+            .delete()
+            .lt("created_at", cutoff.strftime("%Y-%m-%dT%H:%M:%S.%fZ"))
+        )
+        purged = len(result.data or [])
+        self.purged += purged
+        return purged
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._seen),
+            "max_entries": self.max_entries,
+            "shared": self.shared,
+            "duplicates": self.duplicates,
+            "shared_duplicates": self.shared_duplicates,
+            "purged": self.purged,
+        }
+
+
+deduplicator = MessageDeduplicator()
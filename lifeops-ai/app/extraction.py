@@ -0,0 +1,293 @@
+import os
+import time
+import json
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timezone
+from app.db import group_listeners
+from app.llm import llm
+from app.prompts import TASK_EXTRACTION_PROMPT
+from app.admission import admission, BACKGROUND
+from app.metrics import LatencyWindow, ValueWindow
+from app.retrieval import TOKEN_RE
+from app.tools.tasks import create_tasks, get_group_tasks
+
+TASK_EXTRACTION_ENABLED = os.getenv("TASK_EXTRACTION_ENABLED", "true").lower() == "true"
+# A group's batch is extracted once it has this many messages...
+TASK_EXTRACTION_BATCH_SIZE = int(os.getenv("TASK_EXTRACTION_BATCH_SIZE", "20"))
+# ...or this long after its first message, whichever comes first
+TASK_EXTRACTION_MAX_DELAY_SECONDS = float(
+    os.getenv("TASK_EXTRACTION_MAX_DELAY_SECONDS", "60")
+)
+TASK_EXTRACTION_WORKERS = int(os.getenv("TASK_EXTRACTION_WORKERS", "2"))
+TASK_EXTRACTION_QUEUE_SIZE = int(os.getenv("TASK_EXTRACTION_QUEUE_SIZE", "20"))
+# Messages waiting across all groups; past this new messages are not extracted
+TASK_EXTRACTION_MAX_PENDING = int(os.getenv("TASK_EXTRACTION_MAX_PENDING", "2000"))
+TASK_EXTRACTION_MAX_TOKENS = int(os.getenv("TASK_EXTRACTION_MAX_TOKENS", "600"))
+TASK_EXTRACTION_MAX_TASK_CHARS = int(os.getenv("TASK_EXTRACTION_MAX_TASK_CHARS", "300"))
+TASK_EXTRACTION_RECENT_SIZE = int(os.getenv("TASK_EXTRACTION_RECENT_SIZE", "10000"))
+GROUP_MESSAGE_MAX_CHARS = int(os.getenv("GROUP_MESSAGE_MAX_CHARS", "500"))
+
+
+def _task_key(text: str) -> str:
+    return " ".join(TOKEN_RE.findall(text.lower()))
+
+
+def _parse_due(value) -> str:
+    """
+    Normalize an extracted deadline to an ISO timestamp, or None.
+    """
+    if not isinstance(value, str) or not value.strip():
+        return None
+    try:
+        due_at = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if due_at.tzinfo is None:
+        due_at = due_at.replace(tzinfo=timezone.utc)
+    return due_at.isoformat()
+
+
+class TaskExtractor:
+    """
+    Pulls tasks out of group conversations in the background.
+
+    Every saved group message is appended to its group's pending batch.
+    A batch is handed to the worker queue when it reaches
+    TASK_EXTRACTION_BATCH_SIZE messages or TASK_EXTRACTION_MAX_DELAY_SECONDS
+    after its first message, and each batch costs one JSON-mode LLM call at
+    background priority. Extracted tasks are validated, deduplicated within
+    the batch, against recently extracted tasks and against the group's
+    pending tasks, then inserted in one request.
+
+    When the workers fall behind, full batches wait in their group until
+    the queue has room; once TASK_EXTRACTION_MAX_PENDING messages are
+    waiting, new messages are counted as dropped instead of buffered.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = TASK_EXTRACTION_BATCH_SIZE,
+        max_delay: float = TASK_EXTRACTION_MAX_DELAY_SECONDS,
+        max_pending: int = TASK_EXTRACTION_MAX_PENDING,
+    ):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        # group_id -> list of group_messages rows
+        self._pending = {}
+        self._pending_count = 0
+        self._timers = {}
+        self._queue: asyncio.Queue = None
+        self._workers = []
+        # Keys of recently extracted tasks, per group
+        self._recent = OrderedDict()
+
+        self.batches = 0
+        self.messages = 0
+        self.tasks_found = 0
+        self.tasks_inserted = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.dropped = 0
+        self.deferred = 0
+        self.shed = 0
+        self.failures = 0
+        self.batch_time = LatencyWindow()
+        self.batch_size_window = ValueWindow()
+        self.tasks_per_batch = ValueWindow()
+
+    def start(self):
+        if not TASK_EXTRACTION_ENABLED:
+            return
+        self._queue = asyncio.Queue(maxsize=TASK_EXTRACTION_QUEUE_SIZE)
+        self._workers = [
+            asyncio.create_task(self._work()) for _ in range(TASK_EXTRACTION_WORKERS)
+        ]
+
+    async def stop(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    def on_group_message(self, group_id: str, row: dict):
+        # Registered as a db.group_listeners hook
+        if self._queue is None:
+            return
+        if self._pending_count >= self.max_pending:
+            self.dropped += 1
+            return
+
+        batch = self._pending.setdefault(group_id, [])
+        batch.append(row)
+        self._pending_count += 1
+        if len(batch) >= self.batch_size:
+            self._flush(group_id)
+        elif group_id not in self._timers:
+            self._timers[group_id] = asyncio.get_running_loop().call_later(
+                self.max_delay, self._flush, group_id
+            )
+
+    def _flush(self, group_id: str):
+        timer = self._timers.pop(group_id, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.get(group_id)
+        if not batch or self._queue is None:
+            return
+
+        rows = batch[: self.batch_size]
+        try:
+            self._queue.put_nowait((group_id, rows))
+        except asyncio.QueueFull:
+            # Keep the messages and retry later; the pending cap bounds memory
+            self.deferred += 1
+            self._timers[group_id] = asyncio.get_running_loop().call_later(
+                self.max_delay, self._flush, group_id
+            )
+            return
+
+        del batch[: len(rows)]
+        self._pending_count -= len(rows)
+        if not batch:
+            del self._pending[group_id]
+        elif len(batch) >= self.batch_size:
+            self._flush(group_id)
+        else:
+            self._timers[group_id] = asyncio.get_running_loop().call_later(
+                self.max_delay, self._flush, group_id
+            )
+
+    async def _work(self):
+        while True:
+            group_id, rows = await self._queue.get()
+            try:
+                await self._extract(group_id, rows)
+            except Exception as e:
+                self.failures += 1
+                print(f"[EXTRACTION] Failed batch for {group_id}: {e!r}")
+            finally:
+                self._queue.task_done()
+
+    async def _extract(self, group_id: str, rows: list):
+        if not await admission.admit(BACKGROUND):
+            self.shed += 1
+            return
+
+        started = time.perf_counter()
+        lines = "\n".join(
+            f"{row['sender_id']}: {row['message'][:GROUP_MESSAGE_MAX_CHARS]}"
+            for row in rows
+        )
+        messages = [
+            {"role": "system", "content": TASK_EXTRACTION_PROMPT},
+            {
+                "role": "user",
+                "content": f"Current time: {datetime.now(timezone.utc).isoformat()}\n\n{lines}",
+            },
+        ]
+        raw = await llm.complete(
+            messages,
+            temperature=0.0,
+            max_tokens=TASK_EXTRACTION_MAX_TOKENS,
+            response_format={"type": "json_object"},
+        )
+
+        tasks = self._validate(raw, {row["sender_id"] for row in rows})
+        tasks = await self._dedupe(group_id, tasks)
+        inserted = await create_tasks(group_id, tasks) if tasks else []
+        for task in tasks:
+            self._remember(group_id, task["task_text"])
+
+        self.batches += 1
+        self.messages += len(rows)
+        self.tasks_inserted += len(inserted)
+        self.batch_size_window.record(len(rows))
+        self.tasks_per_batch.record(len(inserted))
+        self.batch_time.record(time.perf_counter() - started)
+        if inserted:
+            print(
+                f"[EXTRACTION] {len(inserted)} tasks from {len(rows)} messages in {group_id}"
+            )
+
+    def _validate(self, raw: str, senders: set) -> list:
+        try:
+            items = json.loads(raw).get("tasks")
+        except (ValueError, AttributeError):
+            self.invalid += 1
+            print(f"[EXTRACTION] Unparseable extraction: {raw[:200]!r}")
+            return []
+        if not isinstance(items, list):
+            self.invalid += 1
+            return []
+
+        tasks = []
+        for item in items:
+            self.tasks_found += 1
+            text = item.get("task") if isinstance(item, dict) else None
+            if not isinstance(text, str) or not _task_key(text):
+                self.invalid += 1
+                continue
+            owner = item.get("owner")
+            tasks.append(
+                {
+                    "task_text": text.strip()[:TASK_EXTRACTION_MAX_TASK_CHARS],
+                    # Only senders in the batch can own a task
+                    "owner": owner if owner in senders else None,
+                    "due_at": _parse_due(item.get("due_at")),
+                }
+            )
+        return tasks
+
+    async def _dedupe(self, group_id: str, tasks: list) -> list:
+        if not tasks:
+            return []
+        existing = {
+            _task_key(row["task_text"]) for row in await get_group_tasks(group_id)
+        }
+        unique = []
+        for task in tasks:
+            key = _task_key(task["task_text"])
+            if key in existing or (group_id, key) in self._recent:
+                self.duplicates += 1
+                continue
+            existing.add(key)
+            unique.append(task)
+        return unique
+
+    def _remember(self, group_id: str, text: str):
+        self._recent[(group_id, _task_key(text))] = None
+        while len(self._recent) > TASK_EXTRACTION_RECENT_SIZE:
+            self._recent.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": TASK_EXTRACTION_ENABLED,
+            "pending_messages": self._pending_count,
+            "queued_batches": self._queue.qsize() if self._queue else 0,
+            "batches": self.batches,
+            "messages": self.messages,
+            "tasks_found": self.tasks_found,
+            "tasks_inserted": self.tasks_inserted,
+            "duplicates": self.duplicates,
+            "invalid": self.invalid,
+            "dropped": self.dropped,
+            "deferred": self.deferred,
+            "shed": self.shed,
+            "failures": self.failures,
+            "tasks_per_message": (
+                round(self.tasks_inserted / self.messages, 3) if self.messages else 0.0
+            ),
+            "batch_time": self.batch_time.snapshot(),
+            "batch_size": self.batch_size_window.snapshot(),
+            "tasks_per_batch": self.tasks_per_batch.snapshot(),
+        }
+
+
+task_extractor = TaskExtractor()
+group_listeners.append(task_extractor.on_group_message)
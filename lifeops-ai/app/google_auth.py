@@ -0,0 +1,327 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timezone
+import httpx
+from app.db import get_client, execute, _parse_timestamp
+from app.metrics import LatencyWindow
+
+GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
+GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
+TOKEN_URL = "https://oauth2.googleapis.com/token"
+
+# Tokens expiring within this window are refreshed in the background
+GOOGLE_TOKEN_REFRESH_AHEAD_SECONDS = float(
+    os.getenv("GOOGLE_TOKEN_REFRESH_AHEAD_SECONDS", "600")
+)
+GOOGLE_TOKEN_CHECK_SECONDS = float(os.getenv("GOOGLE_TOKEN_CHECK_SECONDS", "60"))
+GOOGLE_TOKEN_CACHE_SIZE = int(os.getenv("GOOGLE_TOKEN_CACHE_SIZE", "10000"))
+GOOGLE_TOKEN_PAGE_SIZE = int(os.getenv("GOOGLE_TOKEN_PAGE_SIZE", "1000"))
+# How long "this user has not connected Google" is remembered
+GOOGLE_TOKEN_MISS_TTL_SECONDS = float(os.getenv("GOOGLE_TOKEN_MISS_TTL_SECONDS", "60"))
+GOOGLE_HTTP_CONNECTIONS = int(os.getenv("GOOGLE_HTTP_CONNECTIONS", "20"))
+
+
+class GoogleTokenManager:
+    """
+    Per-user Google access tokens, kept fresh ahead of time.
+
+    Every connected user's tokens are loaded into memory on start. A
+    background loop refreshes any token expiring within
+    GOOGLE_TOKEN_REFRESH_AHEAD_SECONDS, so get() normally returns a valid
+    token straight from memory. Refreshes for the same user are
+    single-flight: concurrent callers share one request to Google. All
+    calls to Google go through one pooled HTTP client, which the calendar
+    tool shares as well.
+
+    Only a user missing from the cache (e.g. who connected through another
+    instance) or a token that already expired waits on a lookup.
+    """
+
+    def __init__(self, max_users: int = GOOGLE_TOKEN_CACHE_SIZE):
+        self.max_users = max_users
+        # user_id -> google_tokens dict, with "expires_at" as a unix timestamp
+        self._tokens = OrderedDict()
+        # user_id -> monotonic time until which "not connected" is trusted
+        self._missing = {}
+        # user_id -> in-flight refresh or load
+        self._inflight = {}
+        self._task: asyncio.Task = None
+        self.client: httpx.AsyncClient = None
+
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.revoked = 0
+        self.waited = 0
+        self.refresh_time = LatencyWindow()
+
+    def _ensure_client(self) -> httpx.AsyncClient:
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=GOOGLE_HTTP_CONNECTIONS,
+                    max_keepalive_connections=GOOGLE_HTTP_CONNECTIONS,
+                ),
+                timeout=10.0,
+            )
+        return self.client
+
+    async def start(self):
+        self._ensure_client()
+        await self._load_all()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for task in list(self._inflight.values()):
+            task.cancel()
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def get(self, user_id: str) -> str:
+        """
+        Return a valid access token for the user, or None if they haven't
+        connected Google (or revoked access).
+        """
+        tokens = self._tokens.get(user_id)
+        if tokens is not None:
+            self._tokens.move_to_end(user_id)
+            if tokens["expires_at"] > time.time():
+                self.hits += 1
+                if (
+                    tokens["expires_at"] - time.time()
+                    < GOOGLE_TOKEN_REFRESH_AHEAD_SECONDS
+                ):
+                    self._single_flight(user_id, self._refresh)
+                return tokens["access_token"]
+            # Background refresh fell behind or failed; this caller has to wait
+            self.waited += 1
+            await self._single_flight(user_id, self._refresh)
+        else:
+            if self._missing.get(user_id, 0) > time.monotonic():
+                return None
+            self.misses += 1
+            await self._single_flight(user_id, self._load)
+
+        tokens = self._tokens.get(user_id)
+        if tokens is None or tokens["expires_at"] <= time.time():
+            return None
+        return tokens["access_token"]
+
+    async def refresh(self, user_id: str) -> str:
+        """
+        Force a refresh, e.g. after Google rejected the cached token.
+        """
+        await self._single_flight(user_id, self._refresh)
+        tokens = self._tokens.get(user_id)
+        return tokens["access_token"] if tokens else None
+
+    async def store(self, user_id: str, tokens: dict):
+        """
+        Save tokens from the OAuth code exchange.
+        """
+        self._missing.pop(user_id, None)
+        await self._save(user_id, self._with_expiry(tokens, fresh=True))
+
+    async def exchange_code(self, code: str, redirect_uri: str) -> dict:
+        """
+        Exchange an OAuth authorization code. Returns Google's token response,
+        or None if the exchange failed.
+        """
+        response = await self._ensure_client().post(
+            TOKEN_URL,
+            data={
+                "client_id": GOOGLE_CLIENT_ID,
+                "client_secret": GOOGLE_CLIENT_SECRET,
+                "code": code,
+                "grant_type": "authorization_code",
+                "redirect_uri": redirect_uri,
+            },
+        )
+        if response.status_code != 200:
+            print(f"[GOOGLE] Code exchange failed: {response.status_code}")
+            return None
+        return response.json()
+
+    def _single_flight(self, user_id: str, fn) -> asyncio.Future:
+        task = self._inflight.get(user_id)
+        if task is None or task.done():
+            task = asyncio.create_task(fn(user_id))
+            self._inflight[user_id] = task
+            task.add_done_callback(lambda done: self._finished(user_id, done))
+        # Shielded so a cancelled caller doesn't cancel everyone else's refresh
+        return asyncio.shield(task)
+
+    def _finished(self, user_id: str, task: asyncio.Task):
+        if self._inflight.get(user_id) is task:
+            del self._inflight[user_id]
+
+    @staticmethod
+    def _with_expiry(tokens: dict, fresh: bool = False) -> dict:
+        # expires_in only means something relative to a response just received
+        tokens = dict(tokens)
+        expires_in = tokens.pop("expires_in", None)
+        if fresh and expires_in is not None:
+            tokens["expires_at"] = time.time() + float(expires_in)
+        elif isinstance(tokens.get("expires_at"), str):
+            tokens["expires_at"] = _parse_timestamp(tokens["expires_at"]).timestamp()
+        # Tokens saved before expiry was tracked get refreshed on first use
+        tokens["expires_at"] = float(tokens.get("expires_at") or 0)
+        return tokens
+
+    def _remember(self, user_id: str, tokens: dict):
+        self._tokens[user_id] = tokens
+        self._tokens.move_to_end(user_id)
+        while len(self._tokens) > self.max_users:
+            self._tokens.popitem(last=False)
+
+    async def _load(self, user_id: str):
+        db = await get_client()
+        if not db:
+            return
+        try:
+            result = await execute(
+                db.table("users").select("google_tokens").eq("whatsapp_id", user_id)
+            )
+        except Exception as e:
+            print(f"[GOOGLE] Failed to load tokens for {user_id}: {e!r}")
+            return
+        self.loads += 1
+        tokens = (result.data or [{}])[0].get("google_tokens")
+        if not tokens:
+            self._missing[user_id] = time.monotonic() + GOOGLE_TOKEN_MISS_TTL_SECONDS
+            return
+        tokens = self._with_expiry(tokens)
+        self._remember(user_id, tokens)
+        if tokens["expires_at"] <= time.time():
+            await self._refresh(user_id)
+
+    async def _load_all(self):
+        db = await get_client()
+        if not db:
+            return
+        offset = 0
+        while True:
+            try:
+                result = await execute(
+                    db.table("users")
+                    .select("whatsapp_id, google_tokens")
+                    .not_.is_("google_tokens", "null")
+                    .range(offset, offset + GOOGLE_TOKEN_PAGE_SIZE - 1)
+                )
+            except Exception as e:
+                print(f"[GOOGLE] Failed to preload tokens: {e!r}")
+                return
+            rows = result.data or []
+            for row in rows:
+                self._remember(
+                    row["whatsapp_id"], self._with_expiry(row["google_tokens"])
+                )
+            self.loads += len(rows)
+            if len(rows) < GOOGLE_TOKEN_PAGE_SIZE:
+                break
+            offset += GOOGLE_TOKEN_PAGE_SIZE
+
+    async def _run(self):
+        while True:
+            horizon = time.time() + GOOGLE_TOKEN_REFRESH_AHEAD_SECONDS
+            for user_id, tokens in list(self._tokens.items()):
+                if tokens["expires_at"] < horizon and tokens.get("refresh_token"):
+                    self._single_flight(user_id, self._refresh)
+            await asyncio.sleep(GOOGLE_TOKEN_CHECK_SECONDS)
+
+    async def _refresh(self, user_id: str):
+        tokens = self._tokens.get(user_id)
+        if not tokens or not tokens.get("refresh_token"):
+            return
+
+        started = time.perf_counter()
+        try:
+            response = await self._ensure_client().post(
+                TOKEN_URL,
+                data={
+                    "client_id": GOOGLE_CLIENT_ID,
+                    "client_secret": GOOGLE_CLIENT_SECRET,
+                    "refresh_token": tokens["refresh_token"],
+                    "grant_type": "refresh_token",
+                },
+            )
+        except httpx.HTTPError as e:
+            # Keep the old token; the next check retries
+            self.refresh_failures += 1
+            print(f"[GOOGLE] Token refresh for {user_id} failed: {e!r}")
+            return
+
+        if response.status_code == 400 and "invalid_grant" in response.text:
+            # The user revoked access or the refresh token expired
+            self.revoked += 1
+            print(f"[GOOGLE] Refresh token for {user_id} rejected; dropping it")
+            self._tokens.pop(user_id, None)
+            self._missing[user_id] = time.monotonic() + GOOGLE_TOKEN_MISS_TTL_SECONDS
+            await self._persist(user_id, None)
+            return
+        if response.status_code != 200:
+            self.refresh_failures += 1
+            print(
+                f"[GOOGLE] Token refresh for {user_id} failed: {response.status_code}"
+            )
+            return
+
+        self.refreshes += 1
+        self.refresh_time.record(time.perf_counter() - started)
+        # Google only sometimes rotates the refresh token
+        await self._save(
+            user_id, {**tokens, **self._with_expiry(response.json(), fresh=True)}
+        )
+
+    async def _save(self, user_id: str, tokens: dict):
+        self._remember(user_id, tokens)
+        stored = dict(tokens)
+        stored["expires_at"] = datetime.fromtimestamp(
+            tokens["expires_at"], timezone.utc
+        ).isoformat()
+        await self._persist(user_id, stored)
+
+    async def _persist(self, user_id: str, tokens: dict):
+        db = await get_client()
+        if not db:
+            return
+        try:
+            await execute(
+                db.table("users")
+                .update({"google_tokens": tokens})
+                .eq("whatsapp_id", user_id)
+            )
+        except Exception as e:
+            print(f"[GOOGLE] Failed to save tokens for {user_id}: {e!r}")
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            "users": len(self._tokens),
+            "expiring_soon": sum(
+                1
+                for tokens in self._tokens.values()
+                if tokens["expires_at"] - now < GOOGLE_TOKEN_REFRESH_AHEAD_SECONDS
+            ),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "waited": self.waited,
+            "loads": self.loads,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "revoked": self.revoked,
+            "refresh_time": self.refresh_time.snapshot(),
+        }
+
+
+google_tokens = GoogleTokenManager()
@@ -0,0 +1,261 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+from app.db import get_client, execute, group_writes
+from app.llm import llm
+from app.prompts import GROUP_SUMMARY_PROMPT
+from app.admission import admission, DIRECT, BACKGROUND
+from app.metrics import LatencyWindow
+
+# Messages folded into the summary per LLM call
+GROUP_SUMMARY_CHUNK = int(os.getenv("GROUP_SUMMARY_CHUNK", "50"))
+# LLM calls a summary request may make; older unsummarized messages are skipped
+GROUP_SUMMARY_REQUEST_CHUNKS = int(os.getenv("GROUP_SUMMARY_REQUEST_CHUNKS", "1"))
+GROUP_SUMMARY_MAX_TOKENS = int(os.getenv("GROUP_SUMMARY_MAX_TOKENS", "300"))
+GROUP_MESSAGE_MAX_CHARS = int(os.getenv("GROUP_MESSAGE_MAX_CHARS", "500"))
+# Background refresh of recently active groups (0 disables)
+GROUP_SUMMARY_REFRESH_SECONDS = float(os.getenv("GROUP_SUMMARY_REFRESH_SECONDS", "0"))
+GROUP_SUMMARY_SCAN_LIMIT = int(os.getenv("GROUP_SUMMARY_SCAN_LIMIT", "5000"))
+
+
+class GroupSummarizer:
+    """
+    Rolling per-group summaries, stored in group_summaries together with the
+    id of the last group_messages row they cover.
+
+    Only messages after that checkpoint are read, and they are folded into
+    the existing summary GROUP_SUMMARY_CHUNK at a time, saving the
+    checkpoint after each chunk. A summary request makes at most
+    GROUP_SUMMARY_REQUEST_CHUNKS calls, admitted as direct work: if more
+    messages are waiting (a long history on first use, or a busy group
+    without the background refresh) only the newest ones are folded and
+    the older ones are skipped. It makes none when the optional background
+    refresh has kept up; that refresh folds everything, in order, as
+    background work.
+    """
+
+    def __init__(
+        self,
+        chunk: int = GROUP_SUMMARY_CHUNK,
+        request_chunks: int = GROUP_SUMMARY_REQUEST_CHUNKS,
+    ):
+        self.chunk = chunk
+        self.request_chunks = request_chunks
+        # group_id -> (summary, last_message_id)
+        self._checkpoints = {}
+        self._locks = {}
+        self._last_scan = None
+
+        self.folds = 0
+        self.messages_folded = 0
+        self.backlogs_skipped = 0
+        self.failures = 0
+        self.fold_time = LatencyWindow()
+
+    async def summarize(self, group_id: str, sender_id: str = None) -> str:
+        """
+        Bring the group's summary up to date and return it. Returns None if
+        admission control shed the request and there is no summary yet.
+        """
+        summary, _, shed = await self.refresh(
+            group_id, DIRECT, sender_id, max_chunks=self.request_chunks
+        )
+        return None if shed and not summary else summary
+
+    async def refresh(
+        self,
+        group_id: str,
+        priority: int = None,
+        sender_id: str = None,
+        max_chunks: int = None,
+    ):
+        """
+        Fold messages since the checkpoint into the summary.
+        Returns (summary, last_message_id, shed). With a priority, each LLM
+        call goes through admission control and stops early if it is shed.
+        With max_chunks, only the newest max_chunks chunks are folded.
+        """
+        lock = self._locks.setdefault(group_id, asyncio.Lock())
+        async with lock:
+            summary, last_id = await self._load(group_id)
+
+            db = await get_client()
+            if not db:
+                return summary, last_id, False
+
+            # Buffered messages have no id yet; write them out first
+            if group_writes.pending_rows(group_id=group_id):
+                await group_writes.flush()
+
+            if max_chunks is not None:
+                last_id = await self._skip_backlog(
+                    db, group_id, last_id, max_chunks * self.chunk
+                )
+
+            shed = False
+            folds = 0
+            while max_chunks is None or folds < max_chunks:
+                try:
+                    result = await execute(
+                        db.table("group_messages")
+                        .select("id, sender_id, message")
+                        .eq("group_id", group_id)
+                        .gt("id", last_id)
+                        .order("id")
+                        .limit(self.chunk)
+                    )
+                except Exception as e:
+                    print(f"[GROUP SUMMARY] Failed to read {group_id}: {e!r}")
+                    break
+                rows = result.data or []
+                if not rows:
+                    break
+                if priority is not None and not await admission.admit(
+                    priority, sender_id, group_id
+                ):
+                    shed = True
+                    break
+
+                try:
+                    summary = await self._fold(summary, rows)
+                except Exception as e:
+                    self.failures += 1
+                    print(f"[GROUP SUMMARY] Failed to fold {group_id}: {e!r}")
+                    break
+                folds += 1
+                last_id = rows[-1]["id"]
+                await self._save(group_id, summary, last_id)
+                if len(rows) < self.chunk:
+                    break
+
+            return summary, last_id, shed
+
+    async def _skip_backlog(self, db, group_id: str, last_id: int, keep: int) -> int:
+        """
+        If more than `keep` messages follow the checkpoint, move it up to
+        just before the newest `keep`.
+        """
+        try:
+            result = await execute(
+                db.table("group_messages")
+                .select("id")
+                .eq("group_id", group_id)
+                .gt("id", last_id)
+                .order("id", desc=True)
+                .range(keep, keep)
+            )
+        except Exception as e:
+            print(f"[GROUP SUMMARY] Failed to check backlog for {group_id}: {e!r}")
+            return last_id
+        if not result.data:
+            return last_id
+        self.backlogs_skipped += 1
+        print(
+            f"[GROUP SUMMARY] Summarizing only the last {keep} messages of {group_id}"
+        )
+        return result.data[0]["id"]
+
+    async def _fold(self, summary: str, rows: list) -> str:
+        lines = "\n".join(
+            f"{row['sender_id']}: {row['message'][:GROUP_MESSAGE_MAX_CHARS]}"
+            for row in rows
+        )
+        messages = [
+            {"role": "system", "content": GROUP_SUMMARY_PROMPT},
+            {
+                "role": "user",
+                "content": f"Current summary:\n{summary or '(none)'}\n\nNew messages:\n{lines}",
+            },
+        ]
+        started = time.perf_counter()
+        updated = await llm.complete(
+            messages, temperature=0.2, max_tokens=GROUP_SUMMARY_MAX_TOKENS
+        )
+        self.fold_time.record(time.perf_counter() - started)
+        self.folds += 1
+        self.messages_folded += len(rows)
+        return updated.strip()
+
+    async def _load(self, group_id: str):
+        # Read from the table every time; another instance may have moved it on
+        checkpoint = self._checkpoints.get(group_id, ("", 0))
+        db = await get_client()
+        if not db:
+            return checkpoint
+        try:
+            result = await execute(
+                db.table("group_summaries")
+                .select("summary, last_message_id")
+                .eq("group_id", group_id)
+                .limit(1)
+            )
+        except Exception as e:
+            print(f"[GROUP SUMMARY] Failed to load checkpoint for {group_id}: {e!r}")
+            return checkpoint
+        if result.data:
+            row = result.data[0]
+            checkpoint = (row["summary"] or "", row["last_message_id"] or 0)
+        self._checkpoints[group_id] = checkpoint
+        return checkpoint
+
+    async def _save(self, group_id: str, summary: str, last_id: int):
+        self._checkpoints[group_id] = (summary, last_id)
+        db = await get_client()
+        if not db:
+            return
+        try:
+            await execute(
+                db.table("group_summaries").upsert(
+                    {
+                        "group_id": group_id,
+                        "summary": summary,
+                        "last_message_id": last_id,
+                        "updated_at": datetime.now(timezone.utc).isoformat(),
+                    },
+                    on_conflict="group_id",
+                )
+            )
+        except Exception as e:
+            # The in-memory checkpoint still saves work until the next restart
+            print(f"[GROUP SUMMARY] Failed to save checkpoint for {group_id}: {e!r}")
+
+    async def refresh_active(self):
+        """
+        Scheduler job: refresh groups with messages since the last run.
+        """
+        db = await get_client()
+        if not db:
+            return
+
+        since = self._last_scan or (
+            datetime.now(timezone.utc)
+            - timedelta(seconds=GROUP_SUMMARY_REFRESH_SECONDS)
+        )
+        self._last_scan = datetime.now(timezone.utc)
+        try:
+            result = await execute(
+                db.table("group_messages")
+                .select("group_id")
+                .gt("created_at", since.isoformat())
+                .limit(GROUP_SUMMARY_SCAN_LIMIT)
+            )
+        except Exception as e:
+            print(f"[GROUP SUMMARY] Failed to find active groups: {e!r}")
+            return
+
+        for group_id in {row["group_id"] for row in result.data or []}:
+            await self.refresh(group_id, priority=BACKGROUND)
+
+    def stats(self) -> dict:
+        return {
+            "groups": len(self._checkpoints),
+            "folds": self.folds,
+            "messages_folded": self.messages_folded,
+            "backlogs_skipped": self.backlogs_skipped,
+            "failures": self.failures,
+            "fold_time": self.fold_time.snapshot(),
+        }
+
+
+group_summarizer = GroupSummarizer()
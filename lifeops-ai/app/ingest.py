@@ -0,0 +1,248 @@
+import os
+import time
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from app.metrics import LatencyWindow, ValueWindow
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "8"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "1000"))
+# How long the webhook waits for queue space before pushing back on Meta
+INGEST_ENQUEUE_TIMEOUT_SECONDS = float(os.getenv("INGEST_ENQUEUE_TIMEOUT_SECONDS", "2"))
+INGEST_DRAIN_TIMEOUT_SECONDS = float(os.getenv("INGEST_DRAIN_TIMEOUT_SECONDS", "25"))
+# A sender's burst is handled once they've been quiet this long (0 disables)
+INGEST_COALESCE_SECONDS = float(os.getenv("INGEST_COALESCE_SECONDS", "0.8"))
+INGEST_COALESCE_MAX_WAIT_SECONDS = float(
+    os.getenv("INGEST_COALESCE_MAX_WAIT_SECONDS", "3")
+)
+INGEST_COALESCE_MAX_MESSAGES = int(os.getenv("INGEST_COALESCE_MAX_MESSAGES", "10"))
+
+
+@dataclass
+class InboundMessage:
+    """
+    A single text message pulled out of a WhatsApp webhook payload.
+    """
+
+    message_id: str
+    sender_id: str
+    text: str
+    group_id: str = None
+    user_name: str = None
+    received_at: float = field(default_factory=time.perf_counter)
+    # The original messages when several were coalesced into this one
+    parts: list = field(default_factory=list)
+
+
+def coalesce(messages: list) -> InboundMessage:
+    """
+    Merge consecutive messages from one sender into a single turn.
+    """
+    if len(messages) == 1:
+        return messages[0]
+
+    first = messages[0]
+    return InboundMessage(
+        message_id=first.message_id,
+        sender_id=first.sender_id,
+        text="\n".join(m.text for m in messages),
+        group_id=first.group_id,
+        user_name=next((m.user_name for m in reversed(messages) if m.user_name), None),
+        received_at=first.received_at,
+        parts=list(messages),
+    )
+
+
+class IngestQueue:
+    """
+    Bounded in-process queue drained by a pool of asyncio workers.
+
+    Messages are kept in one lane per sender. A lane is handed to at most one
+    worker at a time, so a sender's messages are processed in order while
+    different senders run in parallel.
+
+    A lane only becomes ready once the sender has been quiet for
+    `coalesce_seconds` (or their oldest message has waited
+    `coalesce_max_wait` seconds). The worker then takes the whole burst for
+    one chat and hands it to the handler as a single merged message.
+    """
+
+    def __init__(
+        self,
+        handler,
+        workers: int = INGEST_WORKERS,
+        max_size: int = INGEST_QUEUE_SIZE,
+        coalesce_seconds: float = INGEST_COALESCE_SECONDS,
+        coalesce_max_wait: float = INGEST_COALESCE_MAX_WAIT_SECONDS,
+        coalesce_max_messages: int = INGEST_COALESCE_MAX_MESSAGES,
+    ):
+        self._handler = handler
+        self.workers = workers
+        self.max_size = max_size
+        self.coalesce_seconds = coalesce_seconds
+        self.coalesce_max_wait = coalesce_max_wait
+        self.coalesce_max_messages = coalesce_max_messages
+
+        self._lanes = {}
+        self._scheduled = set()
+        self._timers = {}
+        self._ready: asyncio.Queue = None
+        self._capacity = asyncio.Semaphore(max_size)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = []
+        self._accepting = False
+
+        self.size = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.turn_sizes = ValueWindow()
+        self.queue_wait = LatencyWindow()
+        self.handle_time = LatencyWindow()
+
+    def start(self):
+        self._ready = asyncio.Queue()
+        self._accepting = True
+        self._tasks = [
+            asyncio.create_task(self._worker(i)) for i in range(self.workers)
+        ]
+        print(f"[INGEST] Started {self.workers} workers (queue size {self.max_size})")
+
+    async def put(self, message: InboundMessage) -> bool:
+        """
+        Enqueue a message, waiting briefly for space when the queue is full.
+        Returns False if the message was not accepted.
+        """
+        if not self._accepting:
+            self.rejected += 1
+            return False
+
+        try:
+            await asyncio.wait_for(
+                self._capacity.acquire(), timeout=INGEST_ENQUEUE_TIMEOUT_SECONDS
+            )
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            print(f"[INGEST] Queue full, rejecting message {message.message_id}")
+            return False
+
+        self._lanes.setdefault(message.sender_id, deque()).append(message)
+        self.size += 1
+        self.accepted += 1
+        self._idle.clear()
+
+        if message.sender_id not in self._scheduled:
+            self._debounce(message.sender_id)
+        return True
+
+    def _debounce(self, sender_id: str):
+        """
+        (Re)start the sender's quiet-window timer, capped by the max wait.
+        """
+        timer = self._timers.pop(sender_id, None)
+        if timer is not None:
+            timer.cancel()
+
+        waited = time.perf_counter() - self._lanes[sender_id][0].received_at
+        delay = min(self.coalesce_seconds, self.coalesce_max_wait - waited)
+        if delay <= 0:
+            self._release(sender_id)
+        else:
+            self._timers[sender_id] = asyncio.get_running_loop().call_later(
+                delay, self._release, sender_id
+            )
+
+    def _release(self, sender_id: str):
+        self._timers.pop(sender_id, None)
+        self._scheduled.add(sender_id)
+        self._ready.put_nowait(sender_id)
+
+    def _take_burst(self, lane: deque) -> list:
+        # Only merge messages meant for the same chat (DM vs a group)
+        burst = [lane.popleft()]
+        while (
+            lane
+            and len(burst) < self.coalesce_max_messages
+            and lane[0].group_id == burst[0].group_id
+        ):
+            burst.append(lane.popleft())
+        return burst
+
+    async def _worker(self, worker_id: int):
+        while True:
+            sender_id = await self._ready.get()
+            lane = self._lanes[sender_id]
+            burst = self._take_burst(lane)
+            message = coalesce(burst)
+            self.queue_wait.record(time.perf_counter() - message.received_at)
+            self.turn_sizes.record(len(burst))
+            if len(burst) > 1:
+                self.coalesced += len(burst) - 1
+
+            started = time.perf_counter()
+            try:
+                await self._handler(message)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                print(
+                    f"[INGEST] Worker {worker_id} failed on {message.message_id}: {e!r}"
+                )
+                import traceback
+
+                traceback.print_exc()
+            finally:
+                self.handle_time.record(time.perf_counter() - started)
+                self._finish(sender_id, lane, len(burst))
+
+    def _finish(self, sender_id: str, lane: deque, count: int):
+        self._scheduled.discard(sender_id)
+        if lane:
+            # Messages that arrived meanwhile get their own quiet window
+            self._debounce(sender_id)
+        else:
+            del self._lanes[sender_id]
+
+        self.size -= count
+        for _ in range(count):
+            self._capacity.release()
+        if self.size == 0:
+            self._idle.set()
+
+    async def stop(self, timeout: float = INGEST_DRAIN_TIMEOUT_SECONDS):
+        """
+        Stop accepting messages, let workers drain what is queued, then cancel them.
+        """
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"[INGEST] Drain timed out with {self.size} messages left")
+
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        print("[INGEST] Workers stopped")
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_size": self.max_size,
+            "depth": self.size,
+            "active_senders": len(self._lanes),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+            "messages_per_turn": self.turn_sizes.snapshot(),
+            "queue_wait": self.queue_wait.snapshot(),
+            "handle_time": self.handle_time.snapshot(),
+        }
@@ -0,0 +1,130 @@
+import os
+import re
+import json
+import time
+
+INTENTS_CONFIG = os.getenv(
+    "INTENTS_CONFIG", os.path.join(os.path.dirname(__file__), "intents.json")
+)
+INTENTS_RELOAD_SECONDS = float(os.getenv("INTENTS_RELOAD_SECONDS", "5"))
+
+# Keywords of these intents only count at the very start of the message
+ANCHORED_INTENTS = {"question"}
+
+
+def _trie_pattern(keywords) -> str:
+    """
+    Build a prefix-factored alternation, e.g. ["who", "who can", "when"]
+    becomes "wh(?:en|o(?:\\ can)?)". Longer keywords are tried first.
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        branches = [
+            re.escape(c) + build(child) for c, child in sorted(node.items()) if c
+        ]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class IntentMatch:
+    __slots__ = ("intents",)
+
+    def __init__(self, intents: frozenset):
+        self.intents = intents
+
+    @property
+    def mentioned(self) -> bool:
+        return "mention" in self.intents
+
+    def __contains__(self, intent: str) -> bool:
+        return intent in self.intents
+
+
+class IntentRouter:
+    """
+    Matches every configured keyword table against a message in one pass.
+
+    All keywords are compiled into a single regex wrapped in a lookahead, so
+    finditer reports a match at every position a keyword starts (overlapping
+    matches included). The alternation is factored by common prefix, which
+    lets the regex engine reject most positions on the first character.
+    Each keyword maps to the intents of every keyword it contains, which
+    covers the shorter matches the longest-first alternation hides. The
+    keyword file is re-read when it changes on disk.
+    """
+
+    def __init__(self, path: str = INTENTS_CONFIG):
+        self.path = path
+        self._mtime = None
+        self._checked_at = 0.0
+        self.reloads = 0
+        self._load()
+
+    def _load(self):
+        with open(self.path) as f:
+            tables = json.load(f)
+        self._mtime = os.stat(self.path).st_mtime
+        self._compile(tables)
+        self.reloads += 1
+
+    def _compile(self, tables: dict):
+        floating = {}
+        anchored = {}
+        for intent, keywords in tables.items():
+            target = anchored if intent in ANCHORED_INTENTS else floating
+            for keyword in keywords:
+                target.setdefault(keyword.lower(), set()).add(intent)
+
+        keywords = sorted(set(floating) | set(anchored), key=len, reverse=True)
+        self._floating = {}
+        self._anchored = {}
+        for keyword in keywords:
+            self._floating[keyword] = frozenset(
+                i for k, intents in floating.items() if k in keyword for i in intents
+            )
+            self._anchored[keyword] = frozenset(
+                i
+                for k, intents in anchored.items()
+                if keyword.startswith(k)
+                for i in intents
+            )
+
+        self._pattern = re.compile(f"(?=({_trie_pattern(keywords)}))")
+        self.tables = tables
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < INTENTS_RELOAD_SECONDS:
+            return
+        self._checked_at = now
+        try:
+            if os.stat(self.path).st_mtime != self._mtime:
+                self._load()
+                print(f"[INTENTS] Reloaded keyword tables from {self.path}")
+        except (OSError, ValueError) as e:
+            # Keep serving the last good tables
+            print(f"[INTENTS] Failed to reload {self.path}: {e!r}")
+
+    def route(self, message: str) -> IntentMatch:
+        self._maybe_reload()
+
+        intents = set()
+        for match in self._pattern.finditer(message.lower()):
+            keyword = match.group(1)
+            intents |= self._floating[keyword]
+            if match.start() == 0:
+                intents |= self._anchored[keyword]
+        return IntentMatch(frozenset(intents))
+
+
+intent_router = IntentRouter()
@@ -0,0 +1,536 @@
+import os
+import time
+import asyncio
+import httpx
+from openai import AsyncOpenAI
+from app.metrics import LatencyWindow, ValueWindow
+
+# Groq exposes an OpenAI-compatible API; point this at a local stub to test
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.3-70b-versatile")
+# Faster model used for hedged requests and while the primary's breaker is open
+# (empty disables hedging and failover)
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "llama-3.1-8b-instant")
+
+# Size LLM_MAX_CONCURRENCY to the Groq quota; extra callers wait in line
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "20"))
+# Deadline for one call, covering hedges and failover
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "20"))
+
+# Hedge once the primary is slower than its own p95 (never sooner than this)
+LLM_HEDGE_MIN_SECONDS = float(os.getenv("LLM_HEDGE_MIN_SECONDS", "1.5"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive errors and stays open for `cooldown`
+    seconds. After that a single probe call is let through; its result
+    closes the breaker or opens it again.
+    """
+
+    def __init__(
+        self,
+        failures: int = LLM_BREAKER_FAILURES,
+        cooldown: float = LLM_BREAKER_COOLDOWN_SECONDS,
+    ):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.state = "half_open"
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def record_success(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failures:
+            if self.state != "open":
+                self.times_opened += 1
+                print(
+                    f"[LLM] Circuit opened after {self.consecutive_failures} failures"
+                )
+            self.state = "open"
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def release(self):
+        # The call was cancelled (lost a hedge race) without an outcome
+        self._probing = False
+
+
+class ModelStats:
+    """
+    Latency and error counters for one model.
+    """
+
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.wins = 0
+        self.latency = LatencyWindow()
+        self.first_token = LatencyWindow()
+
+    def hedge_delay(self, window: LatencyWindow) -> float:
+        if window.count < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_MIN_SECONDS
+        return max(LLM_HEDGE_MIN_SECONDS, window.percentile(95))
+
+    def snapshot(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "wins": self.wins,
+            "breaker": self.breaker.state,
+            "breaker_opened": self.breaker.times_opened,
+            "latency": self.latency.snapshot(),
+            "first_token": self.first_token.snapshot(),
+        }
+
+
+class LLMGateway:
+    """
+    Async chat-completion client shared by the whole process.
+    Keeps one HTTP connection pool and caps the number of requests in flight.
+
+    Each call has one deadline. If the primary model hasn't answered by its
+    own p95 latency, a hedged request goes to the fallback model and the
+    first answer wins. A per-model circuit breaker sends traffic straight to
+    the fallback while the primary keeps failing.
+    """
+
+    def __init__(
+        self,
+        base_url: str = GROQ_BASE_URL,
+        model: str = LLM_MODEL,
+        fallback_model: str = LLM_FALLBACK_MODEL,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        pool_size: int = LLM_POOL_SIZE,
+        timeout: float = LLM_TIMEOUT_SECONDS,
+    ):
+        self.base_url = base_url
+        self.model = model
+        self.fallback_model = fallback_model if fallback_model != model else None
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._client: AsyncOpenAI = None
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._models = {}
+
+        self.waiting = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.failovers = 0
+        self.queue_wait = LatencyWindow()
+        self.latency = LatencyWindow()
+        self.first_token = LatencyWindow()
+        self.prompt_tokens = ValueWindow()
+        self.completion_tokens = ValueWindow()
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        # Created on first use so a missing GROQ_API_KEY doesn't break imports
+        if self._client is None:
+            self._client = AsyncOpenAI(
+                api_key=os.getenv("GROQ_API_KEY"),
+                base_url=self.base_url,
+                max_retries=0,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=self.pool_size,
+                        max_keepalive_connections=self.pool_size,
+                    ),
+                    timeout=self.timeout,
+                ),
+            )
+        return self._client
+
+    def _model_stats(self, model: str) -> ModelStats:
+        stats = self._models.get(model)
+        if stats is None:
+            stats = self._models[model] = ModelStats()
+        return stats
+
+    def _plan(self, model: str = None):
+        """
+        Return (first model to try, backup model or None) given breaker state.
+        """
+        primary = model or self.model
+        backup = self.fallback_model if primary != self.fallback_model else None
+        if backup and not self._model_stats(primary).breaker.allow():
+            self.failovers += 1
+            return backup, None
+        return primary, backup
+
+    def _can_hedge(self) -> bool:
+        # Under load a hedge would just take a slot from another caller
+        return not self._slots.locked()
+
+    async def _acquire_slot(self) -> float:
+        """
+        Wait for a free slot and return the time the call started.
+        """
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        started = time.perf_counter()
+        self.queue_wait.record(started - queued_at)
+        self.in_flight += 1
+        return started
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    async def _attempt(self, model: str, deadline: float, **params) -> str:
+        """
+        One non-streaming call to one model, bounded by the shared deadline.
+        """
+        stats = self._model_stats(model)
+        started = await self._acquire_slot()
+        stats.calls += 1
+        try:
+            response = await asyncio.wait_for(
+                self.client.chat.completions.create(model=model, **params),
+                timeout=deadline - time.perf_counter(),
+            )
+        except asyncio.CancelledError:
+            stats.breaker.release()
+            raise
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            stats.errors += 1
+            stats.breaker.record_failure()
+            raise
+        except Exception:
+            stats.errors += 1
+            stats.breaker.record_failure()
+            raise
+        else:
+            stats.latency.record(time.perf_counter() - started)
+            stats.breaker.record_success()
+            if response.usage:
+                self.prompt_tokens.record(response.usage.prompt_tokens)
+                self.completion_tokens.record(response.usage.completion_tokens)
+            return response.choices[0].message.content
+        finally:
+            self._release_slot()
+
+    async def complete(
+        self,
+        messages: list,
+        model: str = None,
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        timeout: float = None,
+        response_format: dict = None,
+    ) -> str:
+        """
+        Run one chat completion, hedging to the fallback model if the primary
+        is slow and failing over to it if the primary errors.
+        Pass response_format={"type": "json_object"} for JSON mode.
+        Raises asyncio.TimeoutError if no answer arrives within the timeout.
+        """
+        started = time.perf_counter()
+        deadline = started + (timeout or self.timeout)
+        params = dict(messages=messages, temperature=temperature, max_tokens=max_tokens)
+        if response_format:
+            params["response_format"] = response_format
+        first, backup = self._plan(model)
+
+        tasks = {asyncio.ensure_future(self._attempt(first, deadline, **params)): first}
+        hedge_at = started + self._model_stats(first).hedge_delay(
+            self._model_stats(first).latency
+        )
+        error = None
+        try:
+            while tasks:
+                wait = deadline - time.perf_counter()
+                if backup and hedge_at is not None:
+                    wait = min(wait, max(0.0, hedge_at - time.perf_counter()))
+                done, _ = await asyncio.wait(
+                    tasks, timeout=wait, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                for task in done:
+                    model_used = tasks.pop(task)
+                    if task.exception() is None:
+                        self._model_stats(model_used).wins += 1
+                        self.completed += 1
+                        return task.result()
+                    error = task.exception()
+
+                if time.perf_counter() >= deadline:
+                    raise asyncio.TimeoutError()
+                # Fail over once the primary has errored, or hedge a slow one
+                if not backup:
+                    continue
+                if error is not None:
+                    self.failovers += 1
+                elif hedge_at is not None and time.perf_counter() >= hedge_at:
+                    hedge_at = None
+                    if not self._can_hedge():
+                        # No spare slot; keep the backup for failover only
+                        continue
+                    self.hedges += 1
+                else:
+                    continue
+                tasks[
+                    asyncio.ensure_future(self._attempt(backup, deadline, **params))
+                ] = backup
+                backup = None
+
+            raise error
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.failed += 1
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.latency.record(time.perf_counter() - started)
+
+    async def _open_stream(self, model: str, deadline: float, **params):
+        """
+        Start a streaming call and wait for its first text delta.
+        Returns (stats, stream, iterator, first delta, started) and keeps the
+        slot until _close_stream.
+        """
+        stats = self._model_stats(model)
+        started = await self._acquire_slot()
+        stats.calls += 1
+        stream = None
+        try:
+            stream = await asyncio.wait_for(
+                self.client.chat.completions.create(model=model, stream=True, **params),
+                timeout=deadline - time.perf_counter(),
+            )
+            chunks = stream.__aiter__()
+            first = await self._next_delta(chunks, deadline)
+        except BaseException as e:
+            await self._close_stream(stats, stream, started, e)
+            raise
+        stats.first_token.record(time.perf_counter() - started)
+        return stats, stream, chunks, first, started
+
+    async def _next_delta(self, chunks, deadline: float) -> str:
+        """
+        Return the next non-empty text delta, or None at the end of the stream.
+        """
+        while True:
+            try:
+                chunk = await asyncio.wait_for(
+                    chunks.__anext__(), timeout=deadline - time.perf_counter()
+                )
+            except StopAsyncIteration:
+                return None
+
+            usage = getattr(chunk, "usage", None)
+            if usage:
+                self.prompt_tokens.record(usage.prompt_tokens)
+                self.completion_tokens.record(usage.completion_tokens)
+            if chunk.choices and chunk.choices[0].delta.content:
+                return chunk.choices[0].delta.content
+
+    async def _close_stream(
+        self, stats: ModelStats, stream, started: float, error=None
+    ):
+        try:
+            if stream is not None:
+                await stream.close()
+        finally:
+            if isinstance(error, asyncio.CancelledError):
+                stats.breaker.release()
+            elif error is not None:
+                stats.errors += 1
+                if isinstance(error, asyncio.TimeoutError):
+                    stats.timeouts += 1
+                stats.breaker.record_failure()
+            else:
+                stats.latency.record(time.perf_counter() - started)
+                stats.breaker.record_success()
+            self._release_slot()
+
+    async def stream(
+        self,
+        messages: list,
+        model: str = None,
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        timeout: float = None,
+    ):
+        """
+        Run one chat completion as a stream, yielding text deltas.
+
+        Hedging and failover work as in complete(), but are decided on the
+        first token: whichever model starts answering first is streamed and
+        the other request is cancelled. The timeout covers the whole stream
+        but not the time the caller spends between deltas.
+        """
+        started = time.perf_counter()
+        deadline = started + (timeout or self.timeout)
+        params = dict(messages=messages, temperature=temperature, max_tokens=max_tokens)
+        first, backup = self._plan(model)
+
+        opened = None
+        tasks = {
+            asyncio.ensure_future(self._open_stream(first, deadline, **params)): first
+        }
+        hedge_at = started + self._model_stats(first).hedge_delay(
+            self._model_stats(first).first_token
+        )
+        error = None
+        try:
+            while tasks and opened is None:
+                wait = deadline - time.perf_counter()
+                if backup and hedge_at is not None:
+                    wait = min(wait, max(0.0, hedge_at - time.perf_counter()))
+                done, _ = await asyncio.wait(
+                    tasks, timeout=wait, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                for task in done:
+                    tasks.pop(task)
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif opened is None:
+                        opened = task.result()
+                    else:
+                        # Both started in the same tick; keep the first
+                        stats, stream, _, _, opened_at = task.result()
+                        await self._close_stream(
+                            stats, stream, opened_at, asyncio.CancelledError()
+                        )
+                if opened is not None:
+                    break
+
+                if time.perf_counter() >= deadline:
+                    raise asyncio.TimeoutError()
+                # Fail over once the primary has errored, or hedge a slow one
+                if not backup:
+                    continue
+                if error is not None:
+                    self.failovers += 1
+                elif hedge_at is not None and time.perf_counter() >= hedge_at:
+                    hedge_at = None
+                    if not self._can_hedge():
+                        # No spare slot; keep the backup for failover only
+                        continue
+                    self.hedges += 1
+                else:
+                    continue
+                tasks[
+                    asyncio.ensure_future(self._open_stream(backup, deadline, **params))
+                ] = backup
+                backup = None
+
+            if opened is None:
+                raise error
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.failed += 1
+            self.latency.record(time.perf_counter() - started)
+            raise
+        except Exception:
+            self.failed += 1
+            self.latency.record(time.perf_counter() - started)
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+            # A loser that opened before it saw the cancel still holds a slot
+            for task in tasks:
+                try:
+                    stats, stream, _, _, opened_at = await task
+                except BaseException:
+                    continue
+                await self._close_stream(
+                    stats, stream, opened_at, asyncio.CancelledError()
+                )
+
+        stats, stream, chunks, delta, opened_at = opened
+        stats.wins += 1
+        self.first_token.record(time.perf_counter() - started)
+        error = None
+        try:
+            while delta is not None:
+                yield delta
+                delta = await self._next_delta(chunks, deadline)
+            self.completed += 1
+        except BaseException as e:
+            error = e
+            if isinstance(e, asyncio.TimeoutError):
+                self.timeouts += 1
+            if not isinstance(e, (asyncio.CancelledError, GeneratorExit)):
+                self.failed += 1
+            raise
+        finally:
+            if isinstance(error, GeneratorExit):
+                # The caller stopped reading; not the model's fault
+                error = asyncio.CancelledError()
+            await self._close_stream(stats, stream, opened_at, error)
+            self.latency.record(time.perf_counter() - started)
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model,
+            "fallback_model": self.fallback_model,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "hedges": self.hedges,
+            "failovers": self.failovers,
+            "queue_wait": self.queue_wait.snapshot(),
+            "latency": self.latency.snapshot(),
+            "first_token": self.first_token.snapshot(),
+            "prompt_tokens": self.prompt_tokens.snapshot(),
+            "completion_tokens": self.completion_tokens.snapshot(),
+            "models": {
+                model: stats.snapshot() for model, stats in self._models.items()
+            },
+        }
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+llm = LLMGateway()
@@ -5,9 +5,27 @@ import os
 load_dotenv()
 
 from fastapi import FastAPI
-from app.webhooks import router as webhook_router
+from app.webhooks import router as webhook_router, ingest_queue
 from app.oauth import router as oauth_router
-from app.scheduler import start_scheduler
+from app.scheduler import start_scheduler, stop_scheduler
+from app.db import close_db, write_stats, storage_stats
+from app.llm import llm
+from app.dedup import deduplicator
+from app.outbound import whatsapp_sender
+from app.profile import profiles
+from app.conversation_cache import conversation_cache
+from app.retrieval import memory_index
+from app.context import context_builder, summaries
+from app.streaming import reply_timings
+from app.response_cache import response_cache
+from app.admission import admission
+from app.reminders import reminder_dispatcher
+from app.coordination import scheduler_leader, shared_state
+from app.group_summary import group_summarizer
+from app.extraction import task_extractor
+from app.google_auth import google_tokens
+from app.calendar_sync import calendar_sync
+from app.retention import compactor
 
 app = FastAPI(title="Sona")
 
@@ -17,10 +35,58 @@ app.include_router(oauth_router)
 
 @app.on_event("startup")
 async def startup_event():
-    start_scheduler()
+    await start_scheduler()
+    await whatsapp_sender.start()
+    memory_index.start()
+    ingest_queue.start()
+    task_extractor.start()
+    await google_tokens.start()
+    calendar_sync.start()
     print("Sona started. 💜")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await ingest_queue.stop()
+    await task_extractor.stop()
+    await calendar_sync.stop()
+    await google_tokens.stop()
+    await stop_scheduler()
+    await whatsapp_sender.stop()
+    await llm.aclose()
+    await memory_index.close()
+    await shared_state.close()
+    await close_db()
+    print("Sona stopped.")
+
+
 @app.get("/")
 async def root():
     return {"message": "Sona is running. 💜"}
+
+
+@app.get("/stats")
+async def stats():
+    return {
+        "ingest": ingest_queue.stats(),
+        "dedup": deduplicator.stats(),
+        "admission": admission.stats(),
+        "llm": llm.stats(),
+        "profiles": profiles.stats(),
+        "conversation_cache": conversation_cache.stats(),
+        "retrieval": memory_index.stats(),
+        "context": context_builder.stats(),
+        "summaries": summaries.stats(),
+        "group_summaries": group_summarizer.stats(),
+        "task_extraction": task_extractor.stats(),
+        "google_tokens": google_tokens.stats(),
+        "calendar": calendar_sync.stats(),
+        "retention": compactor.stats(),
+        "replies": reply_timings.stats(),
+        "response_cache": response_cache.stats(),
+        "writes": write_stats(),
+        "storage": storage_stats(),
+        "outbound": whatsapp_sender.stats(),
+        "reminders": reminder_dispatcher.stats(),
+        "leader": scheduler_leader.stats(),
+    }
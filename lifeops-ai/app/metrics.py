@@ -0,0 +1,65 @@
+from collections import deque
+
+
+class LatencyWindow:
+    """
+    Rolling window of recent durations, reported as percentiles in milliseconds.
+    """
+
+    def __init__(self, size: int = 1000):
+        self._samples = deque(maxlen=size)
+        self.count = 0
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+        self.count += 1
+
+    def percentile(self, pct: float) -> float:
+        """
+        Return the given percentile in seconds, or 0.0 when no samples exist.
+        """
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def snapshot(self) -> dict:
+        if not self._samples:
+            return {"count": self.count}
+        return {
+            "count": self.count,
+            "p50_ms": round(self.percentile(50) * 1000, 2),
+            "p95_ms": round(self.percentile(95) * 1000, 2),
+            "p99_ms": round(self.percentile(99) * 1000, 2),
+            "max_ms": round(max(self._samples) * 1000, 2),
+        }
+
+
+class ValueWindow:
+    """
+    Rolling window of recent plain values (token counts, batch sizes, ...).
+    """
+
+    def __init__(self, size: int = 1000):
+        self._samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0
+
+    def record(self, value: float):
+        self._samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def snapshot(self) -> dict:
+        if not self._samples:
+            return {"count": self.count}
+        ordered = sorted(self._samples)
+        return {
+            "count": self.count,
+            "total": self.total,
+            "avg": round(sum(ordered) / len(ordered), 2),
+            "p50": ordered[len(ordered) // 2],
+            "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            "max": ordered[-1],
+        }
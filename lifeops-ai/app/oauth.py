@@ -1,17 +1,13 @@
-import os
 from fastapi import APIRouter, Request, HTTPException
 from fastapi.responses import RedirectResponse
 import httpx
-from app.db import supabase
+from app.google_auth import google_tokens, GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET
 
 router = APIRouter()
 
-GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
-GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
 # In production, this should be your actual domain
 REDIRECT_URI = "http://localhost:8000/auth/callback"
 AUTHORIZATION_URL = "https://accounts.google.com/o/oauth2/v2/auth"
-TOKEN_URL = "https://oauth2.googleapis.com/token"
 
 
 @router.get("/auth/google")
@@ -49,36 +45,13 @@ async def auth_callback(code: str, state: str):
             status_code=500, detail="Google Client Secret not configured"
         )
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            TOKEN_URL,
-            data={
-                "client_id": GOOGLE_CLIENT_ID,
-                "client_secret": GOOGLE_CLIENT_SECRET,
-                "code": code,
-                "grant_type": "authorization_code",
-                "redirect_uri": REDIRECT_URI,
-            },
-        )
-
-        if response.status_code != 200:
-            raise HTTPException(status_code=400, detail="Failed to retrieve token")
-
-        tokens = response.json()
+    tokens = await google_tokens.exchange_code(code, REDIRECT_URI)
+    if tokens is None:
+        raise HTTPException(status_code=400, detail="Failed to retrieve token")
 
-        # Store tokens in Supabase for the user (state = user_id)
-        # We only strictly need refresh_token for long-term access, but storing all for now
-        user_id = state
+    # Store tokens for the user (state = user_id); the manager keeps them fresh
+    await google_tokens.store(state, tokens)
 
-        # Update user record
-        try:
-            supabase.table("users").update({"google_tokens": tokens}).eq(
-                "whatsapp_id", user_id
-            ).execute()
-        except Exception as e:
-            # If user doesn't exist/error, logs it. In real app, handle user creation/error better.
-            print(f"Error saving tokens: {e}")
-
-        return {
-            "message": "Google Calendar connected successfully! You can close this window."
-        }
+    return {
+        "message": "Google Calendar connected successfully! You can close this window."
+    }
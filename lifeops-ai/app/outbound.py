@@ -0,0 +1,290 @@
+import os
+import time
+import random
+import sqlite3
+import asyncio
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from app.metrics import LatencyWindow
+from app.ratelimit import TokenBucket
+
+# Point this at a local stub to test without Meta
+WHATSAPP_GRAPH_URL = os.getenv("WHATSAPP_GRAPH_URL", "https://graph.facebook.com/v17.0")
+# Cloud API default throughput is 80 messages/second per business number
+WHATSAPP_SEND_RATE = float(os.getenv("WHATSAPP_SEND_RATE", "80"))
+WHATSAPP_SEND_BURST = float(os.getenv("WHATSAPP_SEND_BURST", "80"))
+WHATSAPP_SEND_WORKERS = int(os.getenv("WHATSAPP_SEND_WORKERS", "16"))
+WHATSAPP_SEND_MAX_RETRIES = int(os.getenv("WHATSAPP_SEND_MAX_RETRIES", "5"))
+WHATSAPP_OUTBOX_PATH = os.getenv("WHATSAPP_OUTBOX_PATH", "outbox.sqlite3")
+WHATSAPP_DRAIN_TIMEOUT_SECONDS = float(
+    os.getenv("WHATSAPP_DRAIN_TIMEOUT_SECONDS", "10")
+)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_CAP_SECONDS = 30.0
+
+
+class Outbox:
+    """
+    Small SQLite-backed outbox so queued replies survive a restart.
+    All access happens on one dedicated thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox")
+        self._conn: sqlite3.Connection = None
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recipient TEXT NOT NULL,
+                body TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+        self._conn.commit()
+        return self._conn.execute(
+            "SELECT id, recipient, body FROM outbox WHERE status = 'pending' ORDER BY id"
+        ).fetchall()
+
+    def _add(self, recipient: str, body: str) -> int:
+        cursor = self._conn.execute(
+            "INSERT INTO outbox (recipient, body) VALUES (?, ?)", (recipient, body)
+        )
+        self._conn.commit()
+        return cursor.lastrowid
+
+    def _remove(self, outbox_id: int):
+        self._conn.execute("DELETE FROM outbox WHERE id = ?", (outbox_id,))
+        self._conn.commit()
+
+    def _fail(self, outbox_id: int, attempts: int, error: str):
+        self._conn.execute(
+            "UPDATE outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+            (attempts, error, outbox_id),
+        )
+        self._conn.commit()
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def open(self) -> list:
+        """
+        Open the outbox and return the replies still pending from a previous run.
+        """
+        return await self._run(self._open)
+
+    async def add(self, recipient: str, body: str) -> int:
+        return await self._run(self._add, recipient, body)
+
+    async def remove(self, outbox_id: int):
+        await self._run(self._remove, outbox_id)
+
+    async def fail(self, outbox_id: int, attempts: int, error: str):
+        await self._run(self._fail, outbox_id, attempts, error)
+
+    async def close(self):
+        await self._run(self._close)
+
+
+class WhatsAppSender:
+    """
+    Long-lived outbound sender for the WhatsApp Cloud API.
+
+    Replies are written to the outbox, then delivered over one keep-alive
+    HTTP/2 pool, paced by a token bucket matched to the per-number throughput
+    limit. 429s and 5xx responses are retried with jittered exponential
+    backoff. Each recipient is pinned to one worker so their replies arrive
+    in order.
+    """
+
+    def __init__(
+        self,
+        graph_url: str = WHATSAPP_GRAPH_URL,
+        rate: float = WHATSAPP_SEND_RATE,
+        burst: float = WHATSAPP_SEND_BURST,
+        workers: int = WHATSAPP_SEND_WORKERS,
+        max_retries: int = WHATSAPP_SEND_MAX_RETRIES,
+        outbox_path: str = WHATSAPP_OUTBOX_PATH,
+    ):
+        self.graph_url = graph_url
+        self.workers = workers
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(rate, burst)
+        self.outbox = Outbox(outbox_path)
+
+        self._url = None
+        self._client: httpx.AsyncClient = None
+        self._queues = []
+        self._tasks = []
+
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.delivery_time = LatencyWindow()
+
+    async def start(self):
+        # Read credentials once instead of on every message
+        api_token = os.getenv("WHATSAPP_API_TOKEN")
+        phone_number_id = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
+        if not api_token or not phone_number_id:
+            print("Missing WhatsApp API credentials")
+            return
+
+        self._url = f"{self.graph_url}/{phone_number_id}/messages"
+        self._client = httpx.AsyncClient(
+            http2=True,
+            headers={
+                "Authorization": f"Bearer {api_token}",
+                "Content-Type": "application/json",
+            },
+            limits=httpx.Limits(
+                max_connections=self.workers, max_keepalive_connections=self.workers
+            ),
+            timeout=10.0,
+        )
+        self._queues = [asyncio.Queue() for _ in range(self.workers)]
+        self._tasks = [
+            asyncio.create_task(self._worker(queue)) for queue in self._queues
+        ]
+
+        pending = await self.outbox.open()
+        for outbox_id, recipient, body in pending:
+            self._enqueue(outbox_id, recipient, body)
+        if pending:
+            print(f"[OUTBOUND] Resuming {len(pending)} unsent replies from the outbox")
+
+    def _enqueue(self, outbox_id: int, recipient: str, body: str):
+        shard = zlib.crc32(recipient.encode()) % self.workers
+        self._queues[shard].put_nowait(
+            (outbox_id, recipient, body, time.perf_counter())
+        )
+
+    @property
+    def ready(self) -> bool:
+        return self._client is not None
+
+    async def send(self, to: str, message: str) -> bool:
+        """
+        Queue a text reply. Returns once it is durable in the outbox, or
+        False if there are no credentials to send it with.
+        """
+        if self._client is None:
+            print("Missing WhatsApp API credentials")
+            return False
+
+        outbox_id = await self.outbox.add(to, message)
+        self._enqueue(outbox_id, to, message)
+        return True
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            outbox_id, recipient, body, queued_at = await queue.get()
+            try:
+                attempts, error = await self._deliver(recipient, body)
+                if error is None:
+                    self.sent += 1
+                    self.delivery_time.record(time.perf_counter() - queued_at)
+                    await self.outbox.remove(outbox_id)
+                    print(f"Message sent successfully to {recipient}")
+                else:
+                    self.failed += 1
+                    await self.outbox.fail(outbox_id, attempts, error)
+                    print(f"Error sending WhatsApp message to {recipient}: {error}")
+            except Exception as e:
+                print(f"[OUTBOUND] Unexpected error for outbox #{outbox_id}: {e!r}")
+            finally:
+                queue.task_done()
+
+    async def _deliver(self, recipient: str, body: str):
+        """
+        Post one message, retrying transient failures.
+        Returns (attempts, error) where error is None on success.
+        """
+        payload = {
+            "messaging_product": "whatsapp",
+            "to": recipient,
+            "text": {"body": body},
+        }
+
+        error = None
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            retry_after = None
+            try:
+                response = await self._client.post(self._url, json=payload)
+            except httpx.TransportError as e:
+                error = repr(e)
+            else:
+                if response.status_code < 300:
+                    return attempt + 1, None
+                error = f"HTTP {response.status_code}: {response.text[:200]}"
+                if response.status_code not in RETRY_STATUSES:
+                    return attempt + 1, error
+                retry_after = response.headers.get("Retry-After")
+
+            if attempt < self.max_retries:
+                self.retries += 1
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+
+        return self.max_retries + 1, error
+
+    @staticmethod
+    def _backoff(attempt: int, retry_after: str = None) -> float:
+        # Full jitter keeps a burst of retries from hitting Meta in lockstep
+        delay = random.uniform(
+            0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt)
+        )
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        return delay
+
+    async def stop(self, timeout: float = WHATSAPP_DRAIN_TIMEOUT_SECONDS):
+        """
+        Try to deliver what is queued, then shut down. Anything left stays
+        in the outbox for the next start.
+        """
+        if self._client is None:
+            return
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues)),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            print("[OUTBOUND] Drain timed out, leaving the rest in the outbox")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._client.aclose()
+        await self.outbox.close()
+        self._client = None
+
+    def stats(self) -> dict:
+        return {
+            "queued": sum(queue.qsize() for queue in self._queues),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "delivery_time": self.delivery_time.snapshot(),
+        }
+
+
+whatsapp_sender = WhatsAppSender()
@@ -0,0 +1,113 @@
+import os
+from collections import OrderedDict
+from datetime import datetime, timezone
+from app.db import get_client, execute
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+
+
+class ProfileStore:
+    """
+    Per-user profile facts (name, timezone, ...) kept in the user_profiles
+    table, one row per (user_id, key), with a read-through LRU cache in front.
+    """
+
+    def __init__(self, max_users: int = PROFILE_CACHE_SIZE):
+        self.max_users = max_users
+        self._cache = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.skipped_writes = 0
+
+    async def get(self, user_id: str) -> dict:
+        """
+        Return the user's profile facts as a dict.
+        """
+        profile = self._cache.get(user_id)
+        if profile is not None:
+            self.hits += 1
+            self._cache.move_to_end(user_id)
+            return profile
+
+        self.misses += 1
+        profile = {}
+        db = await get_client()
+        if db:
+            try:
+                result = await execute(
+                    db.table("user_profiles")
+                    .select("key, value")
+                    .eq("user_id", user_id)
+                )
+                profile = {row["key"]: row["value"] for row in result.data or []}
+            except Exception as e:
+                print(f"Error loading profile for {user_id}: {e!r}")
+                return {}
+
+        self._remember(user_id, profile)
+        return profile
+
+    async def set(self, user_id: str, key: str, value: str) -> bool:
+        """
+        Upsert one fact. Skips the write when the value is unchanged.
+        Returns True if a write happened.
+        """
+        profile = await self.get(user_id)
+        if profile.get(key) == value:
+            self.skipped_writes += 1
+            return False
+
+        db = await get_client()
+        if not db:
+            return False
+
+        try:
+            await execute(
+                db.table("user_profiles").upsert(
+                    {
+                        "user_id": user_id,
+                        "key": key,
+                        "value": value,
+                        "updated_at": datetime.now(timezone.utc).isoformat(),
+                    },
+                    on_conflict="user_id,key",
+                )
+            )
+        except Exception as e:
+            print(f"[ERROR] Error saving profile fact {key} for {user_id}: {e!r}")
+            return False
+
+        self.writes += 1
+        self._remember(user_id, {**profile, key: value})
+        return True
+
+    def _remember(self, user_id: str, profile: dict):
+        self._cache[user_id] = profile
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_users:
+            self._cache.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "cached_users": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "skipped_writes": self.skipped_writes,
+        }
+
+
+def format_profile(profile: dict) -> str:
+    """
+    Render profile facts as a prompt section, or "" when there are none.
+    """
+    if not profile:
+        return ""
+
+    lines = "".join(f"- {key}: {value}\n" for key, value in sorted(profile.items()))
+    return f"\n\nAbout the user:\n{lines}"
+
+
+profiles = ProfileStore()
@@ -41,15 +41,22 @@
 # Be real. Be varied. Be confident.
 # """
 
-# TASK_EXTRACTION_PROMPT = """
-# Analyze the following conversation and extract actionable tasks.
-# For each task, identify:
-# 1. The task description.
-# 2. The owner (who needs to do it).
-# 3. The deadline (if explicitly stated or implied).
-
-# Format the output as a JSON list of objects.
-# """
+TASK_EXTRACTION_PROMPT = """
+Analyze the following conversation and extract actionable tasks.
+For each task, identify:
+1. The task description.
+2. The owner (who needs to do it).
+3. The deadline (if explicitly stated or implied).
+
+Each message is written as "sender: message". Only extract real commitments
+or requests, not jokes, questions or small talk. Use the sender exactly as
+written for the owner, or null if nobody owns it. Give deadlines as ISO 8601
+timestamps (the current time is given below), or null.
+
+Format the output as a JSON object:
+{"tasks": [{"task": "...", "owner": "..." or null, "due_at": "..." or null}]}
+Return {"tasks": []} if there are none.
+"""
 
 
 SYSTEM_PROMPT = """
@@ -101,3 +108,19 @@ BAD examples:
 
 Be real. Be varied. Be confident.
 """
+
+
+CONVERSATION_SUMMARY_PROMPT = """
+You keep a running summary of a WhatsApp chat between a user and Sona.
+Update the current summary with the new messages.
+Keep facts, plans, dates, names and open questions. Drop small talk.
+Reply with the updated summary only, in at most 5 short bullet points.
+"""
+
+
+GROUP_SUMMARY_PROMPT = """
+You keep a running summary of a WhatsApp group chat for Sona, the group's assistant.
+Update the current summary with the new messages (sender: message).
+Keep decisions, plans, dates, who is doing what and open questions. Drop small talk.
+Reply with the updated summary only, in at most 8 short bullet points.
+"""
@@ -0,0 +1,294 @@
+import os
+import time
+import heapq
+import asyncio
+from datetime import datetime, timedelta, timezone
+from app.db import get_client, execute, _parse_timestamp
+from app.metrics import LatencyWindow
+from app.outbound import whatsapp_sender
+
+# Pending tasks due within this window are held in memory
+REMINDER_WINDOW_SECONDS = float(os.getenv("REMINDER_WINDOW_SECONDS", "600"))
+REMINDER_PAGE_SIZE = int(os.getenv("REMINDER_PAGE_SIZE", "1000"))
+# Reminders due within this many seconds of each other are claimed together
+REMINDER_BATCH_SECONDS = float(os.getenv("REMINDER_BATCH_SECONDS", "1"))
+# Reminders missed for longer than this (e.g. a long outage) are not sent late
+REMINDER_CATCHUP_SECONDS = float(os.getenv("REMINDER_CATCHUP_SECONDS", "86400"))
+# How long to wait before retrying reminders the WhatsApp sender wasn't ready for
+REMINDER_RETRY_SECONDS = float(os.getenv("REMINDER_RETRY_SECONDS", "60"))
+
+
+def _recipient(row: dict) -> str:
+    # tasks.user_id references users.id; the WhatsApp number lives on users
+    user = row.get("users") or {}
+    return user.get("whatsapp_id")
+
+
+class ReminderDispatcher:
+    """
+    Sends a WhatsApp reminder when a pending task comes due.
+
+    Only tasks due within the next REMINDER_WINDOW_SECONDS are read, using
+    the (status, due_at) index, and kept in a min-heap ordered by due time.
+    The window is refreshed periodically by the scheduler, so tasks due
+    further out never touch memory. Pending tasks overdue by less than
+    REMINDER_CATCHUP_SECONDS are picked up by the same query, which is how
+    reminders missed during a restart catch up; older ones are marked
+    missed in one update, so the query never re-reads them.
+
+    A due batch is claimed with one conditional update
+    (status pending -> reminded). Only the rows that update returns get a
+    reminder, so a task is never reminded twice, even across restarts or
+    replicas. Claimed reminders go through the durable outbox. Recipients
+    are resolved and the sender checked before claiming, so a task is only
+    claimed when its reminder can actually be queued. Tasks with no owner
+    to remind are marked unaddressed; while the sender isn't ready, due
+    tasks are retried every REMINDER_RETRY_SECONDS until they are too late
+    and get marked missed.
+    """
+
+    def __init__(self, window: float = REMINDER_WINDOW_SECONDS):
+        self.window = window
+        self._heap = []
+        self._known = set()
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task = None
+        self._load_lock = asyncio.Lock()
+
+        self.loaded = 0
+        self.sent = 0
+        self.claimed_elsewhere = 0
+        self.missed = 0
+        self.failed_claims = 0
+        self.unaddressed = 0
+        self.undeliverable = 0
+        self.lateness = LatencyWindow()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def schedule(self, row: dict):
+        """
+        Track a task that was just created, if it falls inside the window.
+        Later tasks are picked up when the window reaches them.
+        """
+        if not row.get("due_at") or row.get("status", "pending") != "pending":
+            return
+        due_at = _parse_timestamp(row["due_at"])
+        if due_at <= datetime.now(timezone.utc) + timedelta(seconds=self.window):
+            self._push(row, due_at)
+
+    def _push(self, row: dict, due_at: datetime):
+        if row["id"] in self._known:
+            return
+        self._known.add(row["id"])
+        # Heap entries are (fire at, id, row); a retry fires after its due time
+        heapq.heappush(self._heap, (due_at.timestamp(), str(row["id"]), row))
+        # Wake the dispatcher in case this is now the earliest reminder
+        self._wake.set()
+
+    async def load_window(self):
+        """
+        Read pending tasks due before now + window. Run on start and by the
+        scheduler at half the window, so the heap always covers what is next.
+        """
+        db = await get_client()
+        if not db:
+            return
+
+        async with self._load_lock:
+            now = datetime.now(timezone.utc)
+            horizon = now + timedelta(seconds=self.window)
+            oldest = now - timedelta(seconds=REMINDER_CATCHUP_SECONDS)
+            await self._expire(db, oldest)
+            offset = 0
+            while True:
+                try:
+                    result = await execute(
+                        db.table("tasks")
+                        .select(
+                            "id, user_id, task_text, due_at, status, users(whatsapp_id)"
+                        )
+                        .eq("status", "pending")
+                        .gte("due_at", oldest.isoformat())
+                        .lte("due_at", horizon.isoformat())
+                        .order("due_at")
+                        .range(offset, offset + REMINDER_PAGE_SIZE - 1)
+                    )
+                except Exception as e:
+                    print(f"[REMINDERS] Failed to load upcoming tasks: {e!r}")
+                    return
+
+                rows = result.data or []
+                for row in rows:
+                    if row["id"] not in self._known:
+                        self.loaded += 1
+                        self._push(row, _parse_timestamp(row["due_at"]))
+                if len(rows) < REMINDER_PAGE_SIZE:
+                    break
+                offset += REMINDER_PAGE_SIZE
+
+    async def _expire(self, db, oldest: datetime):
+        """
+        Mark pending tasks due before `oldest` missed; they are too late to send.
+        """
+        try:
+            result = await execute(
+                db.table("tasks")
+                .update({"status": "missed"})
+                .eq("status", "pending")
+                .lt("due_at", oldest.isoformat())
+            )
+        except Exception as e:
+            print(f"[REMINDERS] Failed to expire missed tasks: {e!r}")
+            return
+        expired = result.data or []
+        for row in expired:
+            self._known.discard(row["id"])
+        self.missed += len(expired)
+
+    async def _run(self):
+        await self.load_window()
+        while True:
+            self._wake.clear()
+            timeout = None
+            if self._heap:
+                timeout = max(0.0, self._heap[0][0] - time.time())
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            # Everything due now, plus anything due within the batch window
+            cutoff = time.time() + REMINDER_BATCH_SECONDS
+            due = []
+            while self._heap and self._heap[0][0] <= cutoff:
+                due.append(heapq.heappop(self._heap))
+            if due:
+                try:
+                    await self._fire(due)
+                except Exception as e:
+                    print(f"[REMINDERS] Failed to fire {len(due)} reminders: {e!r}")
+
+    async def _fire(self, due: list):
+        now = time.time()
+        stale, fresh = [], []
+        for _, _, row in due:
+            late = now - _parse_timestamp(row["due_at"]).timestamp()
+            (stale if late > REMINDER_CATCHUP_SECONDS else fresh).append(row)
+
+        if stale:
+            claimed = await self._claim(stale, "missed")
+            self.missed += len(claimed)
+        if not fresh:
+            return
+
+        if not whatsapp_sender.ready:
+            # Still pending; back on the heap until sent or too late
+            self.undeliverable += len(fresh)
+            print(
+                f"[REMINDERS] WhatsApp sender not ready; retrying {len(fresh)} "
+                f"in {REMINDER_RETRY_SECONDS:g}s"
+            )
+            for row in fresh:
+                heapq.heappush(
+                    self._heap, (now + REMINDER_RETRY_SECONDS, str(row["id"]), row)
+                )
+            return
+        await self._resolve_recipients(fresh)
+        addressed = [row for row in fresh if _recipient(row)]
+        unaddressed = [row for row in fresh if not _recipient(row)]
+        if unaddressed:
+            # No owner to remind, now or later
+            self.unaddressed += len(await self._claim(unaddressed, "unaddressed"))
+        if not addressed:
+            return
+
+        claimed = await self._claim(addressed, "reminded")
+        self.claimed_elsewhere += len(addressed) - len(claimed)
+        rows = {str(row["id"]): row for row in addressed}
+        for claimed_row in claimed:
+            row = rows.get(str(claimed_row["id"]), claimed_row)
+            if await whatsapp_sender.send(
+                _recipient(row), f"⏰ Reminder: {row['task_text']}"
+            ):
+                self.sent += 1
+                self.lateness.record(
+                    max(0.0, now - _parse_timestamp(row["due_at"]).timestamp())
+                )
+
+    async def _resolve_recipients(self, rows: list):
+        """
+        Fill in users.whatsapp_id for rows scheduled without it.
+        """
+        missing = {
+            row["user_id"] for row in rows if row.get("user_id") and not _recipient(row)
+        }
+        if not missing:
+            return
+        db = await get_client()
+        if not db:
+            return
+        try:
+            result = await execute(
+                db.table("users").select("id, whatsapp_id").in_("id", list(missing))
+            )
+        except Exception as e:
+            print(f"[REMINDERS] Failed to look up {len(missing)} recipients: {e!r}")
+            return
+        numbers = {user["id"]: user["whatsapp_id"] for user in result.data or []}
+        for row in rows:
+            if not _recipient(row) and row.get("user_id") in numbers:
+                row["users"] = {"whatsapp_id": numbers[row["user_id"]]}
+
+    async def _claim(self, rows: list, status: str) -> list:
+        """
+        Move rows from pending to `status` in one update.
+        Returns the rows this call actually changed.
+        """
+        ids = [row["id"] for row in rows]
+        for task_id in ids:
+            self._known.discard(task_id)
+
+        db = await get_client()
+        if not db:
+            return []
+        try:
+            result = await execute(
+                db.table("tasks")
+                .update({"status": status})
+                .in_("id", ids)
+                .eq("status", "pending")
+            )
+        except Exception as e:
+            # Left pending; the next window load retries them
+            self.failed_claims += 1
+            print(f"[REMINDERS] Failed to claim {len(ids)} tasks: {e!r}")
+            return []
+        return result.data or []
+
+    def stats(self) -> dict:
+        return {
+            "scheduled": len(self._heap),
+            "next_due_in_seconds": (
+                round(self._heap[0][0] - time.time(), 1) if self._heap else None
+            ),
+            "loaded": self.loaded,
+            "sent": self.sent,
+            "claimed_elsewhere": self.claimed_elsewhere,
+            "missed": self.missed,
+            "failed_claims": self.failed_claims,
+            "unaddressed": self.unaddressed,
+            "undeliverable": self.undeliverable,
+            "lateness": self.lateness.snapshot(),
+        }
+
+
+reminder_dispatcher = ReminderDispatcher()
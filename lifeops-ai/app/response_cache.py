@@ -0,0 +1,210 @@
+import os
+import time
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from app.db import memory_listeners
+from app.retrieval import embed, TOKEN_RE
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "600"))
+# Cosine similarity above which a differently worded question counts as the same
+# (set to 0 to only serve exact matches)
+RESPONSE_CACHE_NEAR_THRESHOLD = float(os.getenv("RESPONSE_CACHE_NEAR_THRESHOLD", "0.9"))
+# Very short messages ("why?", "and tomorrow?") depend on the conversation
+RESPONSE_CACHE_MIN_CHARS = int(os.getenv("RESPONSE_CACHE_MIN_CHARS", "12"))
+
+# Conversation turns as save_memory stores them
+USER_TURN_PREFIX = "User said: "
+REPLY_TURN_PREFIX = "Sona replied: "
+
+
+def normalize(message: str) -> str:
+    return " ".join(TOKEN_RE.findall(message.lower()))
+
+
+def fingerprint(*parts) -> str:
+    """
+    Stable hash of everything besides the message that went into the prompt.
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, (list, tuple)):
+            part = "\x1e".join(part)
+        digest.update((part or "").encode())
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    Answers to questions already asked with the same context.
+
+    Entries are keyed on (scope, context fingerprint, normalized message).
+    The scope is the sender, plus the group for group chats, because the
+    prompt is built from that sender's own memories and profile; lookups
+    never cross scopes. A near-duplicate tier compares hashed embeddings of
+    questions within the same scope and fingerprint. Entries expire after a
+    TTL, the oldest are evicted past the size cap, and a user's entries are
+    dropped whenever a memory is saved for them that could change an answer:
+    anything except Sona's own replies and a repeat of a cached question.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RESPONSE_CACHE_SIZE,
+        ttl: float = RESPONSE_CACHE_TTL_SECONDS,
+        near_threshold: float = RESPONSE_CACHE_NEAR_THRESHOLD,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.near_threshold = near_threshold
+        # (scope, fingerprint, normalized) -> (response, expires_at)
+        self._entries = OrderedDict()
+        # (scope, fingerprint) -> {normalized: vector}
+        self._near = {}
+        # user_id -> keys of their entries, so invalidation only visits those
+        self._by_user = {}
+
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def scope(user_id: str, group_id: str = None) -> tuple:
+        return (user_id, group_id or "")
+
+    @staticmethod
+    def _cacheable(normalized: str) -> bool:
+        return len(normalized) >= RESPONSE_CACHE_MIN_CHARS
+
+    def get(self, scope: tuple, context: str, message: str) -> str:
+        """
+        Return a cached response or None.
+        """
+        normalized = normalize(message)
+        if not self._cacheable(normalized):
+            return None
+
+        now = time.monotonic()
+        key = (scope, context, normalized)
+        response = self._lookup(key, now)
+        if response is not None:
+            self.exact_hits += 1
+            return response
+
+        if self.near_threshold > 0:
+            candidates = self._near.get((scope, context))
+            if candidates:
+                texts = list(candidates)
+                scores = np.stack([candidates[t] for t in texts]) @ embed(normalized)
+                best = int(np.argmax(scores))
+                if scores[best] >= self.near_threshold:
+                    response = self._lookup((scope, context, texts[best]), now)
+                    if response is not None:
+                        self.near_hits += 1
+                        return response
+
+        self.misses += 1
+        return None
+
+    def _lookup(self, key: tuple, now: float) -> str:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        response, expires_at = entry
+        if expires_at <= now:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return response
+
+    def put(self, scope: tuple, context: str, message: str, response: str):
+        normalized = normalize(message)
+        if not self._cacheable(normalized):
+            return
+
+        key = (scope, context, normalized)
+        self._entries[key] = (response, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        self._by_user.setdefault(scope[0], set()).add(key)
+        if self.near_threshold > 0:
+            self._near.setdefault((scope, context), {})[normalized] = embed(normalized)
+        self.stores += 1
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: tuple):
+        self._entries.pop(key, None)
+        scope, context, normalized = key
+        keys = self._by_user.get(scope[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[scope[0]]
+        candidates = self._near.get((scope, context))
+        if candidates is not None:
+            candidates.pop(normalized, None)
+            if not candidates:
+                del self._near[(scope, context)]
+
+    def invalidate(self, user_id: str):
+        """
+        Drop every entry scoped to this user, in DMs and in groups.
+        """
+        stale = self._by_user.pop(user_id, ())
+        for key in stale:
+            self._remove(key)
+        if stale:
+            self.invalidations += 1
+
+    def _is_cached_question(self, user_id: str, normalized: str) -> bool:
+        keys = self._by_user.get(user_id)
+        if not keys:
+            return False
+        if any(key[2] == normalized for key in keys):
+            return True
+        if self.near_threshold <= 0 or not self._cacheable(normalized):
+            return False
+        vector = embed(normalized)
+        scopes = {(scope, context) for scope, context, _ in keys}
+        return any(
+            float(candidate @ vector) >= self.near_threshold
+            for near_key in scopes
+            for candidate in self._near.get(near_key, {}).values()
+        )
+
+    def on_memory(self, user_id: str, row: dict):
+        # Registered as a db.memory_listeners hook. The question being asked
+        # is saved before the lookup, so a repeat must not clear its answer.
+        content = row.get("content") or ""
+        if content.startswith(REPLY_TURN_PREFIX):
+            return
+        if content.startswith(USER_TURN_PREFIX) and self._is_cached_question(
+            user_id, normalize(content[len(USER_TURN_PREFIX) :])
+        ):
+            return
+        self.invalidate(user_id)
+
+    def stats(self) -> dict:
+        hits = self.exact_hits + self.near_hits
+        lookups = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+response_cache = ResponseCache()
+memory_listeners.append(response_cache.on_memory)
@@ -0,0 +1,345 @@
+import os
+import gzip
+import json
+import time
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from app.db import get_client, execute, db_load, memory_listeners, _parse_timestamp
+from app.llm import llm
+from app.prompts import CONVERSATION_SUMMARY_PROMPT
+from app.admission import admission, BACKGROUND
+from app.retrieval import memory_index
+from app.conversation_cache import conversation_cache
+from app.metrics import LatencyWindow
+
+# How often the scheduler runs compaction (0 disables it)
+COMPACTION_INTERVAL_SECONDS = float(os.getenv("COMPACTION_INTERVAL_SECONDS", "3600"))
+# Conversation turns older than this are rolled into per-period summaries
+COMPACTION_AFTER_DAYS = float(os.getenv("COMPACTION_AFTER_DAYS", "14"))
+COMPACTION_PERIOD_DAYS = float(os.getenv("COMPACTION_PERIOD_DAYS", "7"))
+COMPACTION_BATCH_SIZE = int(os.getenv("COMPACTION_BATCH_SIZE", "500"))
+COMPACTION_MAX_BATCHES = int(os.getenv("COMPACTION_MAX_BATCHES", "20"))
+# Pause between batches, and back off while live traffic uses this much of
+# the database concurrency limit
+COMPACTION_PAUSE_SECONDS = float(os.getenv("COMPACTION_PAUSE_SECONDS", "1"))
+COMPACTION_MAX_DB_LOAD = float(os.getenv("COMPACTION_MAX_DB_LOAD", "0.5"))
+COMPACTION_SUMMARY_MAX_TOKENS = int(os.getenv("COMPACTION_SUMMARY_MAX_TOKENS", "200"))
+COMPACTION_TURN_MAX_CHARS = int(os.getenv("COMPACTION_TURN_MAX_CHARS", "300"))
+# Per memory_type retention in days, e.g. "conversation_summary=365,general=730";
+# types not listed are kept forever
+MEMORY_RETENTION_DAYS = os.getenv("MEMORY_RETENTION_DAYS", "")
+GROUP_MESSAGE_RETENTION_DAYS = float(os.getenv("GROUP_MESSAGE_RETENTION_DAYS", "30"))
+# If set, deleted rows are appended here as gzipped JSON lines first
+RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR", "")
+
+SUMMARY_MEMORY_TYPE = "conversation_summary"
+
+
+def _retention_days(spec: str) -> dict:
+    days = {}
+    for pair in spec.split(","):
+        memory_type, _, value = pair.partition("=")
+        if memory_type.strip() and value.strip():
+            days[memory_type.strip()] = float(value)
+    return days
+
+
+class Compactor:
+    """
+    Keeps memories and group_messages from growing without bound.
+
+    Conversation turns ("User said"/"Sona replied") older than
+    COMPACTION_AFTER_DAYS are grouped per user and per
+    COMPACTION_PERIOD_DAYS period, summarized with one background LLM call
+    per group into a conversation_summary memory, and the raw rows are
+    deleted in bulk. A full batch ends at a period boundary so each period
+    gets one summary; only a single user's period larger than a batch is
+    summarized in batch-sized parts. Other memory types and group messages are deleted once
+    they pass their retention. Deleted rows can be archived to gzipped JSON
+    lines first.
+
+    Work happens in batches of COMPACTION_BATCH_SIZE with a pause between
+    them, waiting while live queries use more than COMPACTION_MAX_DB_LOAD
+    of the database concurrency limit, and stops after
+    COMPACTION_MAX_BATCHES per run; a backlog is worked off over several
+    runs instead of in one burst. Runs only on the scheduler leader.
+
+    Deleting needs the DELETE policies in supabase_schema.sql (or the
+    service-role key). A delete that removes nothing stops the run before
+    any summary is written, so a missing policy can't make the table grow.
+    """
+
+    def __init__(self):
+        self.retention = _retention_days(MEMORY_RETENTION_DAYS)
+        self._lock = asyncio.Lock()
+        self._batches = 0
+
+        self.runs = 0
+        self.turns_compacted = 0
+        self.summaries_written = 0
+        self.deleted = defaultdict(int)
+        self.archived = 0
+        self.throttled_seconds = 0.0
+        self.failures = 0
+        self.last_run = None
+        self.run_time = LatencyWindow()
+
+    async def run(self):
+        """
+        Scheduler job: one bounded pass over every retention rule.
+        """
+        if self._lock.locked():
+            return
+        db = await get_client()
+        if not db:
+            return
+
+        async with self._lock:
+            started = time.perf_counter()
+            self._batches = 0
+            now = datetime.now(timezone.utc)
+            try:
+                await self._compact_conversations(
+                    db, now - timedelta(days=COMPACTION_AFTER_DAYS)
+                )
+                for memory_type, days in self.retention.items():
+                    cutoff = now - timedelta(days=days)
+                    await self._expire(
+                        db,
+                        "memories",
+                        lambda query: query.eq("memory_type", memory_type).lt(
+                            "created_at", cutoff.isoformat()
+                        ),
+                    )
+                if GROUP_MESSAGE_RETENTION_DAYS > 0:
+                    cutoff = now - timedelta(days=GROUP_MESSAGE_RETENTION_DAYS)
+                    await self._expire(
+                        db,
+                        "group_messages",
+                        lambda query: query.lt("created_at", cutoff.isoformat()),
+                    )
+            except Exception as e:
+                self.failures += 1
+                print(f"[RETENTION] Compaction run failed: {e!r}")
+            self.runs += 1
+            self.last_run = now.isoformat()
+            self.run_time.record(time.perf_counter() - started)
+
+    async def _throttle(self) -> bool:
+        """
+        Wait before the next batch. Returns False once this run's budget is spent.
+        """
+        if self._batches >= COMPACTION_MAX_BATCHES:
+            return False
+        if self._batches:
+            await asyncio.sleep(COMPACTION_PAUSE_SECONDS)
+        waited = time.perf_counter()
+        while db_load() > COMPACTION_MAX_DB_LOAD:
+            await asyncio.sleep(COMPACTION_PAUSE_SECONDS)
+        self.throttled_seconds += time.perf_counter() - waited
+        self._batches += 1
+        return True
+
+    async def _compact_conversations(self, db, cutoff: datetime):
+        # Whole periods only, so a period is summarized once it has ended
+        period = COMPACTION_PERIOD_DAYS * 86400
+        cutoff = datetime.fromtimestamp(
+            cutoff.timestamp() // period * period, timezone.utc
+        )
+        while await self._throttle():
+            result = await execute(
+                db.table("memories")
+                .select("*")
+                .eq("memory_type", "conversation")
+                .lt("created_at", cutoff.isoformat())
+                .order("created_at")
+                .limit(COMPACTION_BATCH_SIZE)
+            )
+            rows = result.data or []
+            if not rows:
+                return
+            full = len(rows) == COMPACTION_BATCH_SIZE
+            if full:
+                rows = await self._whole_periods(db, rows, period)
+
+            groups = defaultdict(list)
+            for row in rows:
+                groups[(row["user_id"], _period(row, period))].append(row)
+
+            summaries, done = [], []
+            for (user_id, start), turns in groups.items():
+                summary = await self._summarize(turns)
+                if summary is None:
+                    # Shed or failed; the rest waits for the next run
+                    break
+                begin = datetime.fromtimestamp(start * period, timezone.utc)
+                summaries.append(
+                    {
+                        "user_id": user_id,
+                        "content": f"Conversation summary for {begin:%Y-%m-%d} to "
+                        f"{begin + timedelta(seconds=period):%Y-%m-%d}:\n{summary}",
+                        "memory_type": SUMMARY_MEMORY_TYPE,
+                        "created_at": turns[-1]["created_at"],
+                    }
+                )
+                done.extend(turns)
+
+            if summaries:
+                # Delete first: if deletes aren't allowed nothing else changes
+                removed = await self._delete(db, "memories", done)
+                if not removed:
+                    return
+                await self._write_summaries(db, summaries, removed)
+                self.turns_compacted += len(removed)
+            if len(done) < len(rows) or not full:
+                return
+
+    async def _whole_periods(self, db, rows: list, period: float) -> list:
+        """
+        Drop the batch's last period, which may continue past the batch.
+        If that is the only period, return one user's turns in it instead.
+        """
+        last = _period(rows[-1], period)
+        complete = [row for row in rows if _period(row, period) < last]
+        if complete:
+            return complete
+
+        begin = datetime.fromtimestamp(last * period, timezone.utc)
+        result = await execute(
+            db.table("memories")
+            .select("*")
+            .eq("memory_type", "conversation")
+            .eq("user_id", rows[0]["user_id"])
+            .gte("created_at", begin.isoformat())
+            .lt("created_at", (begin + timedelta(seconds=period)).isoformat())
+            .order("created_at")
+            .limit(COMPACTION_BATCH_SIZE)
+        )
+        return result.data or []
+
+    async def _write_summaries(self, db, summaries: list, turns: list):
+        try:
+            result = await execute(db.table("memories").insert(summaries))
+        except Exception:
+            # Put the turns back rather than lose them
+            await execute(
+                db.table("memories").insert(
+                    [
+                        {
+                            key: turn[key]
+                            for key in (
+                                "user_id",
+                                "content",
+                                "memory_type",
+                                "created_at",
+                            )
+                        }
+                        for turn in turns
+                    ]
+                )
+            )
+            raise
+        self.summaries_written += len(summaries)
+        # Same hooks as save_memory, so the retrieval index picks them up
+        for row in result.data or []:
+            conversation_cache.invalidate(row["user_id"])
+            for listener in memory_listeners:
+                listener(row["user_id"], row)
+
+    async def _summarize(self, turns: list) -> str:
+        if not await admission.admit(BACKGROUND):
+            return None
+        lines = "\n".join(
+            f"- {turn['content'][:COMPACTION_TURN_MAX_CHARS]}" for turn in turns
+        )
+        messages = [
+            {"role": "system", "content": CONVERSATION_SUMMARY_PROMPT},
+            {
+                "role": "user",
+                "content": f"Current summary:\n(none)\n\nNew messages:\n{lines}",
+            },
+        ]
+        try:
+            summary = await llm.complete(
+                messages, temperature=0.2, max_tokens=COMPACTION_SUMMARY_MAX_TOKENS
+            )
+        except Exception as e:
+            self.failures += 1
+            print(f"[RETENTION] Failed to summarize {len(turns)} turns: {e!r}")
+            return None
+        return summary.strip()
+
+    async def _expire(self, db, table: str, where):
+        """
+        Delete rows matching where(query), oldest first, in throttled batches.
+        """
+        while await self._throttle():
+            result = await execute(
+                where(db.table(table).select("*"))
+                .order("id")
+                .limit(COMPACTION_BATCH_SIZE)
+            )
+            rows = result.data or []
+            if rows and not await self._delete(db, table, rows):
+                return
+            if len(rows) < COMPACTION_BATCH_SIZE:
+                return
+
+    async def _delete(self, db, table: str, rows: list) -> list:
+        """
+        Delete rows by id. Returns the rows actually removed.
+        """
+        if RETENTION_ARCHIVE_DIR:
+            await asyncio.to_thread(self._archive, table, rows)
+        result = await execute(
+            db.table(table).delete().in_("id", [row["id"] for row in rows])
+        )
+        removed = result.data or []
+        if not removed:
+            self.failures += 1
+            print(
+                f"[RETENTION] Deleting from {table} removed no rows; it needs a "
+                "DELETE policy (supabase_schema.sql) or the service-role key"
+            )
+            return []
+        self.deleted[table] += len(removed)
+        if table == "memories":
+            by_user = defaultdict(list)
+            for row in removed:
+                by_user[row["user_id"]].append(row)
+            for user_id, user_rows in by_user.items():
+                # A loaded window would keep serving the deleted rows
+                conversation_cache.invalidate(user_id)
+                await memory_index.forget(user_id, user_rows)
+        return removed
+
+    def _archive(self, table: str, rows: list):
+        os.makedirs(RETENTION_ARCHIVE_DIR, exist_ok=True)
+        month = datetime.now(timezone.utc).strftime("%Y-%m")
+        path = os.path.join(RETENTION_ARCHIVE_DIR, f"{table}-{month}.jsonl.gz")
+        # Appending starts a new gzip member; readers see one continuous stream
+        with gzip.open(path, "at", encoding="utf-8") as archive:
+            for row in rows:
+                archive.write(json.dumps(row) + "\n")
+        self.archived += len(rows)
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "last_run": self.last_run,
+            "turns_compacted": self.turns_compacted,
+            "summaries_written": self.summaries_written,
+            "deleted": dict(self.deleted),
+            "archived": self.archived,
+            "throttled_seconds": round(self.throttled_seconds, 1),
+            "failures": self.failures,
+            "run_time": self.run_time.snapshot(),
+        }
+
+
+def _period(row: dict, period: float) -> float:
+    return _parse_timestamp(row["created_at"]).timestamp() // period
+
+
+compactor = Compactor()
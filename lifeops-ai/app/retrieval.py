@@ -0,0 +1,352 @@
+import os
+import re
+import time
+import zlib
+import asyncio
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from app.db import (
+    get_client,
+    execute,
+    memory_listeners,
+    memory_writes,
+    _parse_timestamp,
+)
+from app.metrics import LatencyWindow
+
+RETRIEVAL_DIM = int(os.getenv("RETRIEVAL_DIM", "1024"))
+RETRIEVAL_INDEX_DIR = os.getenv("RETRIEVAL_INDEX_DIR", "retrieval_index")
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.15"))
+RETRIEVAL_MAX_USERS = int(os.getenv("RETRIEVAL_MAX_USERS", "2000"))
+RETRIEVAL_BACKFILL_LIMIT = int(os.getenv("RETRIEVAL_BACKFILL_LIMIT", "2000"))
+RETRIEVAL_SAVE_INTERVAL_SECONDS = float(
+    os.getenv("RETRIEVAL_SAVE_INTERVAL_SECONDS", "30")
+)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by do for from has have i im in is it its me my "
+    "of on or s so t that the this to was we were what when with you your".split()
+)
+PREFIXES = ("User said: ", "Sona replied: ")
+
+
+def _strip_prefix(text: str) -> str:
+    for prefix in PREFIXES:
+        if text.startswith(prefix):
+            return text[len(prefix) :]
+    return text
+
+
+def _bucket(feature: str):
+    h = zlib.crc32(feature.encode())
+    return h % RETRIEVAL_DIM, 1.0 if h & 0x80000000 else -1.0
+
+
+def embed(text: str) -> np.ndarray:
+    """
+    Hashed bag of words and bigrams, L2-normalised. CPU only, no model files.
+    """
+    vector = np.zeros(RETRIEVAL_DIM, dtype=np.float32)
+    words = [
+        w for w in TOKEN_RE.findall(_strip_prefix(text).lower()) if w not in STOPWORDS
+    ]
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for feature in features:
+        index, sign = _bucket(feature)
+        vector[index] += sign
+
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector
+
+
+def _should_index(row: dict) -> bool:
+    # Profile facts are injected separately and Sona's own replies add noise
+    return row.get("memory_type") != "profile" and not row["content"].startswith(
+        "Sona replied: "
+    )
+
+
+class UserIndex:
+    """
+    Growable matrix of one user's memory vectors plus their texts.
+    """
+
+    def __init__(self):
+        self.vectors = np.zeros((16, RETRIEVAL_DIM), dtype=np.float32)
+        self.texts = []
+        self.timestamps = []
+        self.last_created_at = ""
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, text: str, created_at: str):
+        count = len(self.texts)
+        if count == len(self.vectors):
+            grown = np.zeros((count * 2, RETRIEVAL_DIM), dtype=np.float32)
+            grown[:count] = self.vectors
+            self.vectors = grown
+
+        self.vectors[count] = embed(text)
+        self.texts.append(text)
+        self.timestamps.append(created_at)
+        if created_at > self.last_created_at:
+            self.last_created_at = created_at
+        self.dirty = True
+
+    def remove(self, keys: set) -> int:
+        """
+        Drop entries whose (timestamp, text) is in keys. Returns how many.
+        """
+        keep = [
+            i
+            for i, key in enumerate(zip(self.timestamps, self.texts))
+            if key not in keys
+        ]
+        removed = len(self.texts) - len(keep)
+        if removed:
+            vectors = np.zeros((max(16, len(keep)), RETRIEVAL_DIM), dtype=np.float32)
+            vectors[: len(keep)] = self.vectors[keep]
+            self.vectors = vectors
+            self.texts = [self.texts[i] for i in keep]
+            self.timestamps = [self.timestamps[i] for i in keep]
+            self.dirty = True
+        return removed
+
+    def search(self, query: np.ndarray, k: int, min_score: float) -> list:
+        count = len(self.texts)
+        if not count:
+            return []
+
+        scores = self.vectors[:count] @ query
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (self.texts[i], float(scores[i])) for i in top if scores[i] >= min_score
+        ]
+
+
+class MemoryIndex:
+    """
+    Per-user semantic retrieval over memories, updated as save_memory writes
+    and persisted to disk so restarts don't re-embed everything.
+    """
+
+    def __init__(
+        self,
+        directory: str = RETRIEVAL_INDEX_DIR,
+        max_users: int = RETRIEVAL_MAX_USERS,
+    ):
+        self.directory = directory
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._loading = {}
+        self._early_rows = {}
+        self._task: asyncio.Task = None
+
+        self.loads_from_disk = 0
+        self.backfills = 0
+        self.query_time = LatencyWindow()
+
+    def _path(self, user_id: str) -> str:
+        name = hashlib.sha1(user_id.encode()).hexdigest()
+        return os.path.join(self.directory, f"{name}.npz")
+
+    def add(self, user_id: str, row: dict):
+        """
+        Index a freshly written memory. Registered as a db.memory_listeners hook.
+        """
+        if not _should_index(row):
+            return
+
+        index = self._users.get(user_id)
+        if index is None:
+            if user_id in self._loading:
+                # Applied once the user's index finishes loading
+                self._early_rows.setdefault(user_id, []).append(row)
+            return
+        index.add(row["content"], _iso(row["created_at"]))
+
+    async def forget(self, user_id: str, rows: list):
+        """
+        Drop deleted memories from the user's index, including one saved on disk.
+        """
+        index = self._users.get(user_id)
+        if index is None and (
+            user_id in self._loading or os.path.exists(self._path(user_id))
+        ):
+            index = await self._get_index(user_id)
+        if index is not None:
+            index.remove({(_iso(row["created_at"]), row["content"]) for row in rows})
+
+    async def search(self, user_id: str, text: str, k: int = 5) -> list:
+        """
+        Return up to k (content, score) pairs most similar to `text`.
+        """
+        index = await self._get_index(user_id)
+        started = time.perf_counter()
+        results = index.search(embed(text), k, RETRIEVAL_MIN_SCORE)
+        self.query_time.record(time.perf_counter() - started)
+        return results
+
+    async def _get_index(self, user_id: str) -> UserIndex:
+        index = self._users.get(user_id)
+        if index is not None:
+            self._users.move_to_end(user_id)
+            return index
+
+        # Concurrent callers for the same user share one load
+        loading = self._loading.get(user_id)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(user_id))
+            self._loading[user_id] = loading
+        try:
+            return await asyncio.shield(loading)
+        finally:
+            self._loading.pop(user_id, None)
+
+    async def _load(self, user_id: str) -> UserIndex:
+        index = await asyncio.to_thread(self._read, user_id)
+        if index is not None:
+            self.loads_from_disk += 1
+        else:
+            index = UserIndex()
+            self.backfills += 1
+
+        # Catch up on anything written after the file was saved
+        for row in await self._fetch_since(user_id, index.last_created_at):
+            if _should_index(row):
+                index.add(row["content"], _iso(row["created_at"]))
+
+        # Plus rows still in the write buffer or written while we loaded
+        seen = set(zip(index.timestamps, index.texts))
+        early = memory_writes.pending_rows(user_id=user_id)
+        early += self._early_rows.pop(user_id, [])
+        for row in early:
+            if not _should_index(row):
+                continue
+            key = (_iso(row["created_at"]), row["content"])
+            if key not in seen:
+                seen.add(key)
+                index.add(row["content"], key[0])
+
+        self._users[user_id] = index
+        await self._evict()
+        return index
+
+    async def _fetch_since(self, user_id: str, since: str) -> list:
+        db = await get_client()
+        if not db:
+            return []
+
+        query = db.table("memories").select("content, memory_type, created_at")
+        query = query.eq("user_id", user_id)
+        if since:
+            query = query.gt("created_at", since)
+        try:
+            result = await execute(
+                query.order("created_at", desc=True).limit(RETRIEVAL_BACKFILL_LIMIT)
+            )
+        except Exception as e:
+            print(f"[RETRIEVAL] Backfill failed for {user_id}: {e!r}")
+            return []
+        return list(reversed(result.data or []))
+
+    def _read(self, user_id: str) -> UserIndex:
+        path = self._path(user_id)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with np.load(path) as data:
+                if data["vectors"].shape[1] != RETRIEVAL_DIM:
+                    return None
+                index = UserIndex()
+                index.vectors = data["vectors"].astype(np.float32)
+                index.texts = data["texts"].tolist()
+                index.timestamps = data["timestamps"].tolist()
+        except Exception as e:
+            print(f"[RETRIEVAL] Ignoring unreadable index {path}: {e!r}")
+            return None
+
+        index.last_created_at = max(index.timestamps, default="")
+        return index
+
+    def _write(self, user_id: str, vectors, texts: list, timestamps: list):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(user_id)
+        tmp = f"{path}.tmp.npz"
+        np.savez(
+            tmp,
+            vectors=vectors,
+            texts=np.array(texts, dtype=str),
+            timestamps=np.array(timestamps, dtype=str),
+        )
+        os.replace(tmp, path)
+
+    async def save(self, user_id: str = None):
+        """
+        Persist dirty indexes (or just one user's) to disk.
+        """
+        user_ids = [user_id] if user_id else list(self._users)
+        for uid in user_ids:
+            index = self._users.get(uid)
+            if index is None or not index.dirty:
+                continue
+            count = len(index)
+            index.dirty = False
+            await asyncio.to_thread(
+                self._write,
+                uid,
+                index.vectors[:count].copy(),
+                list(index.texts),
+                list(index.timestamps),
+            )
+
+    async def _evict(self):
+        while len(self._users) > self.max_users:
+            user_id = next(iter(self._users))
+            await self.save(user_id)
+            self._users.pop(user_id, None)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(RETRIEVAL_SAVE_INTERVAL_SECONDS)
+            try:
+                await self.save()
+            except Exception as e:
+                print(f"[RETRIEVAL] Failed to save indexes: {e!r}")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.save()
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._users),
+            "vectors": sum(len(index) for index in self._users.values()),
+            "loads_from_disk": self.loads_from_disk,
+            "backfills": self.backfills,
+            "query_time": self.query_time.snapshot(),
+        }
+
+
+def _iso(created_at: str) -> str:
+    # One canonical form so stored and buffered timestamps compare correctly
+    return _parse_timestamp(created_at).isoformat()
+
+
+memory_index = MemoryIndex()
+memory_listeners.append(memory_index.add)
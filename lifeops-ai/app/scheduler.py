@@ -1,8 +1,95 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from app.reminders import reminder_dispatcher, REMINDER_WINDOW_SECONDS
+from app.coordination import (
+    scheduler_leader,
+    shared_state,
+    STATE_PURGE_INTERVAL_SECONDS,
+)
+from app.dedup import deduplicator
+from app.group_summary import group_summarizer, GROUP_SUMMARY_REFRESH_SECONDS
+from app.retention import compactor, COMPACTION_INTERVAL_SECONDS
 
 scheduler = AsyncIOScheduler()
 
 
-def start_scheduler():
+async def _purge_state():
+    # Expired rows are ignored on read but would otherwise stay forever
+    try:
+        expired = await shared_state.purge()
+        claimed = await deduplicator.purge()
+    except Exception as e:
+        print(f"[SCHEDULER] State purge failed: {e!r}")
+        return
+    if expired or claimed:
+        print(
+            f"[SCHEDULER] Purged {expired} expired shared-state keys, "
+            f"{claimed} old processed messages"
+        )
+
+
+def _start_jobs():
+    # Refresh the in-memory reminder window well before it runs out
+    scheduler.add_job(
+        reminder_dispatcher.load_window,
+        "interval",
+        seconds=REMINDER_WINDOW_SECONDS / 2,
+        id="reminder_window",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+    )
+    if GROUP_SUMMARY_REFRESH_SECONDS > 0:
+        scheduler.add_job(
+            group_summarizer.refresh_active,
+            "interval",
+            seconds=GROUP_SUMMARY_REFRESH_SECONDS,
+            id="group_summaries",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
+    if COMPACTION_INTERVAL_SECONDS > 0:
+        scheduler.add_job(
+            compactor.run,
+            "interval",
+            seconds=COMPACTION_INTERVAL_SECONDS,
+            id="compaction",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
+    if STATE_PURGE_INTERVAL_SECONDS > 0:
+        scheduler.add_job(
+            _purge_state,
+            "interval",
+            seconds=STATE_PURGE_INTERVAL_SECONDS,
+            id="state_purge",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
+    reminder_dispatcher.start()
+    print("Scheduled jobs running on this node")
+
+
+async def _stop_jobs():
+    scheduler.remove_all_jobs()
+    await reminder_dispatcher.stop()
+    print("Scheduled jobs stopped on this node")
+
+
+async def start_scheduler():
+    """
+    Start the scheduler; jobs only run while this node holds the scheduler
+    lease, so several workers never dispatch the same job.
+    """
     scheduler.start()
+    scheduler_leader.on_elected.append(_start_jobs)
+    scheduler_leader.on_demoted.append(_stop_jobs)
+    await scheduler_leader.start()
     print("Scheduler started...")
+
+
+async def stop_scheduler():
+    await scheduler_leader.stop()
+    scheduler.shutdown(wait=False)
@@ -0,0 +1,815 @@
+import os
+import re
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from postgrest import APIResponse, ReturnMethod
+from app.metrics import LatencyWindow
+
+# supabase: PostgREST over the network (default); sqlite: local file
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase")
+STORAGE_SQLITE_PATH = os.getenv("STORAGE_SQLITE_PATH", "sona.sqlite3")
+# With the sqlite backend, also copy every write to Supabase in the background
+STORAGE_REPLICATE = os.getenv("STORAGE_REPLICATE", "false").lower() == "true"
+STORAGE_REPLICATION_BATCH = int(os.getenv("STORAGE_REPLICATION_BATCH", "200"))
+STORAGE_REPLICATION_INTERVAL_SECONDS = float(
+    os.getenv("STORAGE_REPLICATION_INTERVAL_SECONDS", "0.5")
+)
+
+# Tables are created from these, first definition wins
+SCHEMA_FILES = [
+    os.path.join(os.path.dirname(__file__), "..", "supabase_schema.sql"),
+    os.path.join(os.path.dirname(__file__), "..", "schema.sql"),
+]
+
+IDENTIFIER_RE = re.compile(r"^\w+$")
+COMPARISONS = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+
+def _utc_iso(value) -> str:
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return value
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    # One fixed format, so timestamps compare correctly as text
+    return value.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+def _ident(name: str) -> str:
+    if not IDENTIFIER_RE.match(name):
+        raise ValueError(f"Unsupported identifier {name!r}")
+    return f'"{name}"'
+
+
+class Table:
+    """
+    What the query builder needs to know about one table.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.columns = []
+        self.primary_key = []
+        self.json_columns = set()
+        self.bool_columns = set()
+        self.timestamp_columns = set()
+        self.uuid_defaults = set()
+        # BIGSERIAL key: local values mean nothing to Supabase
+        self.serial_key = None
+        self.now_defaults = set()
+        # embedded table -> (local column, remote column)
+        self.references = {}
+
+    def encode(self, column: str, value):
+        if value is None:
+            return None
+        if column in self.json_columns:
+            return json.dumps(value)
+        if column in self.bool_columns:
+            return int(value) if not isinstance(value, str) else int(value == "true")
+        if column in self.timestamp_columns:
+            return _utc_iso(value)
+        return value
+
+    def decode(self, column: str, value):
+        if value is None:
+            return None
+        if column in self.json_columns:
+            return json.loads(value)
+        if column in self.bool_columns:
+            return bool(value)
+        return value
+
+
+def load_schema(paths: list = SCHEMA_FILES):
+    """
+    Translate the Postgres DDL in the schema files to SQLite.
+    Returns (tables by name, DDL statements).
+    """
+    tables, statements = {}, []
+    for path in paths:
+        with open(path) as f:
+            sql = re.sub(r"--[^\n]*", "", f.read())
+        for statement in sql.split(";"):
+            statement = " ".join(statement.split())
+            match = re.match(
+                r"create table if not exists (\w+) \((.*)\)$", statement, re.I
+            )
+            if match:
+                name, body = match.groups()
+                if name not in tables:
+                    tables[name] = table = Table(name)
+                    statements.append(_create_table(table, body))
+                continue
+            match = re.match(
+                r"create index if not exists \w+ on (\w+)", statement, re.I
+            )
+            if match and match.group(1) in tables:
+                statements.append(statement)
+    return tables, statements
+
+
+def _create_table(table: Table, body: str) -> str:
+    definitions = []
+    for part in _split(body, ","):
+        part = part.strip()
+        lowered = part.lower()
+        if lowered.startswith("primary key"):
+            table.primary_key = [
+                c.strip() for c in part[part.index("(") + 1 : -1].split(",")
+            ]
+            definitions.append(part)
+            continue
+        if lowered.startswith(("unique", "constraint", "foreign", "check")):
+            definitions.append(part)
+            continue
+
+        name, rest = part.split(" ", 1)
+        table.columns.append(name)
+        if "primary key" in rest.lower():
+            table.primary_key = [name]
+        reference = re.search(r"references (\w+)\s*\((\w+)\)", rest, re.I)
+        if reference:
+            table.references[reference.group(1)] = (name, reference.group(2))
+
+        if re.search(r"\bbigserial\b", rest, re.I):
+            table.serial_key = name
+            rest = "INTEGER PRIMARY KEY AUTOINCREMENT"
+        if re.search(r"default uuid_generate_v4\(\)", rest, re.I):
+            table.uuid_defaults.add(name)
+            rest = re.sub(r"default uuid_generate_v4\(\)", "", rest, flags=re.I)
+        if re.search(r"default now\(\)", rest, re.I):
+            table.now_defaults.add(name)
+            rest = re.sub(r"default now\(\)", "", rest, flags=re.I)
+        if re.search(r"timestamp with time zone|timestamptz", rest, re.I):
+            table.timestamp_columns.add(name)
+            rest = re.sub(
+                r"timestamp with time zone|timestamptz", "TEXT", rest, flags=re.I
+            )
+        if re.search(r"\bjsonb?\b", rest, re.I):
+            table.json_columns.add(name)
+            rest = re.sub(r"\bjsonb?\b", "TEXT", rest, flags=re.I)
+        if re.search(r"\bboolean\b", rest, re.I):
+            table.bool_columns.add(name)
+            rest = re.sub(r"\bboolean\b", "INTEGER", rest, flags=re.I)
+            rest = re.sub(r"default true", "DEFAULT 1", rest, flags=re.I)
+            rest = re.sub(r"default false", "DEFAULT 0", rest, flags=re.I)
+        rest = re.sub(r"\buuid\b", "TEXT", rest, flags=re.I)
+        definitions.append(f"{name} {rest.strip()}")
+    return f"CREATE TABLE IF NOT EXISTS {table.name} ({', '.join(definitions)})"
+
+
+def _split(text: str, separator: str) -> list:
+    """
+    Split on separator outside parentheses and double quotes.
+    """
+    parts, depth, quoted, current = [], 0, False, ""
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif char == separator and depth == 0 and not quoted:
+            parts.append(current)
+            current = ""
+            continue
+        current += char
+    parts.append(current)
+    return parts
+
+
+class QueryBuilder:
+    """
+    The subset of postgrest's fluent builder the app uses, compiled to SQL:
+    select (with embedded many-to-one tables), insert, upsert, update,
+    delete, the eq/neq/gt/gte/lt/lte/in_/is_ filters with not_, or_,
+    order, limit and range.
+    """
+
+    def __init__(self, store, table: str):
+        self._store = store
+        self._table = store.tables[table]
+        self._action = "select"
+        self._columns = "*"
+        self._rows = None
+        self._values = None
+        self._on_conflict = None
+        self._ignore_duplicates = False
+        self._returning = ReturnMethod.representation
+        self._filters = []
+        self._negate = False
+        self._order = []
+        self._limit = None
+        self._offset = None
+
+    def select(self, columns: str = "*", count=None):
+        self._columns = columns
+        return self
+
+    def insert(self, json, count=None, returning=ReturnMethod.representation, **_):
+        self._action = "insert"
+        self._rows = json if isinstance(json, list) else [json]
+        self._returning = returning
+        return self
+
+    def upsert(
+        self,
+        json,
+        count=None,
+        returning=ReturnMethod.representation,
+        ignore_duplicates: bool = False,
+        on_conflict: str = "",
+        **_,
+    ):
+        self.insert(json, returning=returning)
+        self._action = "upsert"
+        self._ignore_duplicates = ignore_duplicates
+        self._on_conflict = [c.strip() for c in on_conflict.split(",") if c.strip()]
+        return self
+
+    def update(self, json: dict, count=None, returning=ReturnMethod.representation):
+        self._action = "update"
+        self._values = json
+        self._returning = returning
+        return self
+
+    def delete(self, count=None, returning=ReturnMethod.representation):
+        self._action = "delete"
+        self._returning = returning
+        return self
+
+    @property
+    def not_(self):
+        self._negate = True
+        return self
+
+    def _filter(self, column: str, op: str, value):
+        self._filters.append(("and", [(column, op, value, self._negate)]))
+        self._negate = False
+        return self
+
+    def eq(self, column: str, value):
+        return self._filter(column, "eq", value)
+
+    def neq(self, column: str, value):
+        return self._filter(column, "neq", value)
+
+    def gt(self, column: str, value):
+        return self._filter(column, "gt", value)
+
+    def gte(self, column: str, value):
+        return self._filter(column, "gte", value)
+
+    def lt(self, column: str, value):
+        return self._filter(column, "lt", value)
+
+    def lte(self, column: str, value):
+        return self._filter(column, "lte", value)
+
+    def in_(self, column: str, values):
+        return self._filter(column, "in", list(values))
+
+    def is_(self, column: str, value):
+        return self._filter(column, "is", value)
+
+    def or_(self, filters: str, reference_table: str = None):
+        """
+        PostgREST or syntax, e.g. 'holder.eq."x",expires_at.lt.2024-01-01'.
+        """
+        conditions = []
+        for part in _split(filters, ","):
+            column, op, value = part.strip().split(".", 2)
+            negate = op == "not"
+            if negate:
+                op, value = value.split(".", 1)
+            conditions.append((column, op, value.strip('"'), negate))
+        self._filters.append(("or", conditions))
+        return self
+
+    def order(self, column: str, desc: bool = False, nullsfirst: bool = None, **_):
+        self._order.append((column, desc, nullsfirst))
+        return self
+
+    def limit(self, size: int, **_):
+        self._limit = size
+        return self
+
+    def range(self, start: int, end: int, **_):
+        self._offset = start
+        self._limit = end - start + 1
+        return self
+
+    async def execute(self) -> APIResponse:
+        rows = await self._store.run(self._run)
+        if self._returning == ReturnMethod.minimal:
+            rows = []
+        return APIResponse(data=rows, count=None)
+
+    # Everything below runs on the store's thread
+
+    def _run(self, conn: sqlite3.Connection) -> list:
+        if self._action == "select":
+            return self._select(conn)
+        with self._store.transaction(conn):
+            if self._action in ("insert", "upsert"):
+                rows = self._insert(conn)
+            elif self._action == "update":
+                rows = self._write(conn, self._update_sql())
+            else:
+                rows = self._write(conn, ("DELETE FROM {table}", []))
+            self._store.log_write(conn, self._table, self._action, rows)
+            return rows
+
+    def _column(self, name: str, prefixed: bool) -> tuple:
+        """
+        Resolve "col" or "embedded.col" to (Table, SQL expression).
+        """
+        if "." in name:
+            table, column = name.split(".", 1)
+            return self._store.tables[table], f"{_ident(table)}.{_ident(column)}"
+        if prefixed:
+            return self._table, f"{_ident(self._table.name)}.{_ident(name)}"
+        return self._table, _ident(name)
+
+    def _condition(self, column: str, op: str, value, negate: bool, prefixed: bool):
+        table, expression = self._column(column, prefixed)
+        name = column.rsplit(".", 1)[-1]
+        if op == "is":
+            value = {"null": None, "true": True, "false": False}.get(str(value).lower())
+            sql = f"{expression} IS NULL" if value is None else f"{expression} = ?"
+            params = [] if value is None else [int(value)]
+        elif op == "in":
+            if isinstance(value, str):
+                value = [v.strip('" ') for v in value.strip("()").split(",")]
+            if not value:
+                sql, params = "0", []
+            else:
+                placeholders = ", ".join("?" for _ in value)
+                sql = f"{expression} IN ({placeholders})"
+                params = [table.encode(name, v) for v in value]
+        elif op in COMPARISONS:
+            sql = f"{expression} {COMPARISONS[op]} ?"
+            params = [table.encode(name, value)]
+        else:
+            raise ValueError(f"Unsupported filter {op!r}")
+        if negate:
+            sql = f"NOT ({sql})"
+        return sql, params
+
+    def _where(self, prefixed: bool) -> tuple:
+        clauses, params = [], []
+        for kind, conditions in self._filters:
+            parts = []
+            for condition in conditions:
+                sql, values = self._condition(*condition, prefixed=prefixed)
+                parts.append(sql)
+                params.extend(values)
+            clauses.append(
+                f"({' OR '.join(parts)})" if kind == "or" else " AND ".join(parts)
+            )
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def _select(self, conn: sqlite3.Connection) -> list:
+        base = self._table
+        fields, joins, embeds = [], [], {}
+        for item in _split(self._columns, ","):
+            item = item.strip()
+            match = re.match(r"^(\w+)(!inner)?\((.*)\)$", item)
+            if match:
+                name, inner, columns = match.groups()
+                local, remote = base.references[name]
+                joins.append(
+                    f"{'INNER' if inner else 'LEFT'} JOIN {_ident(name)} ON "
+                    f"{_ident(base.name)}.{_ident(local)} = {_ident(name)}.{_ident(remote)}"
+                )
+                embedded = self._store.tables[name]
+                names = (
+                    embedded.columns
+                    if columns.strip() == "*"
+                    else [c.strip() for c in columns.split(",")]
+                )
+                embeds[name] = names
+                fields.extend(
+                    f'{_ident(name)}.{_ident(c)} AS "{name}.{c}"' for c in names
+                )
+            elif item == "*":
+                fields.append(f"{_ident(base.name)}.*")
+            else:
+                fields.append(f"{_ident(base.name)}.{_ident(item)}")
+
+        where, params = self._where(prefixed=True)
+        sql = f"SELECT {', '.join(fields)} FROM {_ident(base.name)} {' '.join(joins)}{where}"
+        if self._order:
+            terms = []
+            for column, desc, nullsfirst in self._order:
+                _, expression = self._column(column, prefixed=True)
+                # Postgres puts nulls last ascending and first descending
+                if nullsfirst is None:
+                    nullsfirst = desc
+                terms.append(
+                    f"({expression} IS NULL) {'DESC' if nullsfirst else 'ASC'}"
+                )
+                terms.append(f"{expression} {'DESC' if desc else 'ASC'}")
+            sql += " ORDER BY " + ", ".join(terms)
+        if self._limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [self._limit, self._offset or 0]
+
+        rows = []
+        for record in conn.execute(sql, params):
+            row = {}
+            for key in record.keys():
+                if "." in key:
+                    continue
+                row[key] = base.decode(key, record[key])
+            for name, columns in embeds.items():
+                embedded = self._store.tables[name]
+                values = {c: embedded.decode(c, record[f"{name}.{c}"]) for c in columns}
+                row[name] = (
+                    values if any(v is not None for v in values.values()) else None
+                )
+            rows.append(row)
+        return rows
+
+    def _decode(self, record: sqlite3.Row) -> dict:
+        return {key: self._table.decode(key, record[key]) for key in record.keys()}
+
+    def _insert(self, conn: sqlite3.Connection) -> list:
+        table = self._table
+        conflict = self._on_conflict or table.primary_key
+        now = _utc_iso(datetime.now(timezone.utc))
+        rows = []
+        for given in self._rows:
+            row = dict(given)
+            for column in table.uuid_defaults:
+                row.setdefault(column, str(uuid.uuid4()))
+            for column in table.now_defaults:
+                row.setdefault(column, now)
+            columns = list(row)
+            sql = (
+                f"INSERT INTO {_ident(table.name)} ({', '.join(map(_ident, columns))}) "
+                f"VALUES ({', '.join('?' for _ in columns)})"
+            )
+            if self._action == "upsert":
+                target = ", ".join(map(_ident, conflict))
+                updates = [c for c in given if c not in conflict]
+                if self._ignore_duplicates:
+                    sql += f" ON CONFLICT ({target}) DO NOTHING"
+                else:
+                    # A no-op update still returns the existing row, like PostgREST
+                    updates = updates or conflict[:1]
+                    assignments = ", ".join(
+                        f"{_ident(c)} = excluded.{_ident(c)}" for c in updates
+                    )
+                    sql += f" ON CONFLICT ({target}) DO UPDATE SET {assignments}"
+            sql += " RETURNING *"
+            params = [table.encode(c, row[c]) for c in columns]
+            rows.extend(self._decode(r) for r in conn.execute(sql, params))
+        return rows
+
+    def _update_sql(self) -> tuple:
+        columns = list(self._values)
+        assignments = ", ".join(f"{_ident(c)} = ?" for c in columns)
+        params = [self._table.encode(c, self._values[c]) for c in columns]
+        return f"UPDATE {{table}} SET {assignments}", params
+
+    def _write(self, conn: sqlite3.Connection, statement: tuple) -> list:
+        sql, params = statement
+        where, where_params = self._where(prefixed=False)
+        sql = sql.format(table=_ident(self._table.name)) + where + " RETURNING *"
+        return [self._decode(r) for r in conn.execute(sql, params + where_params)]
+
+
+class SQLiteStore:
+    """
+    A local SQLite database that answers the same query builder calls as
+    the Supabase client, so db.py, tools/tasks.py and the rest run on it
+    unchanged (STORAGE_BACKEND=sqlite).
+
+    Tables come from supabase_schema.sql and schema.sql, translated to
+    SQLite. The file uses WAL, every query is parameterized so sqlite3's
+    statement cache reuses the compiled statement, and all access happens
+    on one dedicated thread.
+
+    With replication on, each write also appends its resulting rows to a
+    _replication_log table in the same transaction, and a Replicator copies
+    them to Supabase in order. The local file then acts as a low-latency
+    write-ahead tier: reads and writes never wait on the network, and
+    nothing is lost if Supabase is down or the process restarts.
+    """
+
+    def __init__(self, path: str = STORAGE_SQLITE_PATH, replicate: bool = False):
+        self.path = path
+        self.replicate = replicate
+        self.tables, self._statements = load_schema()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+        self._conn: sqlite3.Connection = None
+
+        self.queries = 0
+        self.query_time = LatencyWindow()
+        self.pending_replication = 0
+
+    def __bool__(self):
+        return True
+
+    def table(self, name: str) -> QueryBuilder:
+        return QueryBuilder(self, name)
+
+    async def run(self, fn):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._timed, fn)
+
+    def _timed(self, fn):
+        started = time.perf_counter()
+        try:
+            return fn(self._connect())
+        finally:
+            self.queries += 1
+            self.query_time.record(time.perf_counter() - started)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None, cached_statements=512
+            )
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in self._statements:
+                conn.execute(statement)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS _replication_log (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    entry TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS _replication_ids (
+                    table_name TEXT NOT NULL,
+                    local_id INTEGER NOT NULL,
+                    remote_id INTEGER NOT NULL,
+                    PRIMARY KEY (table_name, local_id)
+                )
+                """)
+            self.pending_replication = conn.execute(
+                "SELECT COUNT(*) FROM _replication_log"
+            ).fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def transaction(self, conn: sqlite3.Connection):
+        return _Transaction(conn)
+
+    def log_write(
+        self, conn: sqlite3.Connection, table: Table, action: str, rows: list
+    ):
+        if not self.replicate or not rows:
+            return
+        key = table.primary_key
+        if action == "delete":
+            entry = {
+                "op": "delete",
+                "table": table.name,
+                "key": key,
+                "rows": [{c: row[c] for c in key} for row in rows],
+            }
+        else:
+            op = "insert" if action == "insert" else "upsert"
+            entry = {"op": op, "table": table.name, "key": key, "rows": rows}
+        conn.execute(
+            "INSERT INTO _replication_log (entry, created_at) VALUES (?, ?)",
+            (json.dumps(entry), time.time()),
+        )
+        self.pending_replication += 1
+
+    def read_log(self, conn: sqlite3.Connection, limit: int) -> list:
+        return [
+            (row["id"], json.loads(row["entry"]), row["created_at"])
+            for row in conn.execute(
+                "SELECT id, entry, created_at FROM _replication_log ORDER BY id LIMIT ?",
+                (limit,),
+            )
+        ]
+
+    def remote_ids(self, conn: sqlite3.Connection, table: str, local_ids: list) -> dict:
+        placeholders = ", ".join("?" for _ in local_ids)
+        return dict(
+            conn.execute(
+                "SELECT local_id, remote_id FROM _replication_ids "
+                f"WHERE table_name = ? AND local_id IN ({placeholders})",
+                [table, *local_ids],
+            ).fetchall()
+        )
+
+    def map_ids(self, conn: sqlite3.Connection, table: str, mapping: dict):
+        conn.executemany(
+            "INSERT OR REPLACE INTO _replication_ids VALUES (?, ?, ?)",
+            [(table, local, remote) for local, remote in mapping.items()],
+        )
+
+    def unmap_ids(self, conn: sqlite3.Connection, table: str, local_ids: list):
+        conn.executemany(
+            "DELETE FROM _replication_ids WHERE table_name = ? AND local_id = ?",
+            [(table, local) for local in local_ids],
+        )
+
+    def trim_log(self, conn: sqlite3.Connection, upto: int):
+        cursor = conn.execute("DELETE FROM _replication_log WHERE id <= ?", (upto,))
+        self.pending_replication -= cursor.rowcount
+
+    async def close(self):
+        def _close(conn):
+            conn.close()
+            self._conn = None
+
+        if self._conn is not None:
+            await self.run(_close)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "queries": self.queries,
+            "query_time": self.query_time.snapshot(),
+            "replication_pending": self.pending_replication,
+        }
+
+
+class _Transaction:
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+class Replicator:
+    """
+    Copies the SQLite store's write log to Supabase, oldest first.
+
+    Consecutive writes to the same table are merged into one upsert (or
+    one delete), keeping only the latest version of each row. An entry is
+    removed from the log only after Supabase accepted it; on failure the
+    replicator backs off and retries the same entries, so Supabase always
+    converges on the local state.
+
+    Tables keyed by a BIGSERIAL (memories, group_messages) are copied as
+    plain inserts without the id, so Supabase's sequence assigns it, and
+    the local -> remote id pairs are kept in _replication_ids for later
+    updates and deletes. Rows that already have a remote id are not
+    inserted again when a batch is retried.
+    """
+
+    def __init__(self, store: SQLiteStore, remote, execute):
+        self.store = store
+        # Coroutine functions: remote() returns the Supabase client
+        self._remote = remote
+        self._execute = execute
+        self._task: asyncio.Task = None
+
+        self.replicated = 0
+        self.failures = 0
+        self.lag = LatencyWindow()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        backoff = STORAGE_REPLICATION_INTERVAL_SECONDS
+        while True:
+            entries = await self.store.run(
+                lambda conn: self.store.read_log(conn, STORAGE_REPLICATION_BATCH)
+            )
+            if not entries:
+                await asyncio.sleep(STORAGE_REPLICATION_INTERVAL_SECONDS)
+                continue
+            try:
+                await self._apply(entries)
+            except Exception as e:
+                self.failures += 1
+                print(f"[STORAGE] Replication failed, retrying: {e!r}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+                continue
+            backoff = STORAGE_REPLICATION_INTERVAL_SECONDS
+            upto = entries[-1][0]
+            await self.store.run(lambda conn: self.store.trim_log(conn, upto))
+            now = time.time()
+            for _, _, created_at in entries:
+                self.lag.record(now - created_at)
+            self.replicated += len(entries)
+
+    async def _apply(self, entries: list):
+        db = await self._remote()
+        if not db:
+            raise RuntimeError("Supabase not configured")
+
+        # Merge runs of the same operation on the same table
+        runs = []
+        for _, entry, _ in entries:
+            last = runs[-1] if runs else None
+            if last and (last["op"], last["table"]) == (entry["op"], entry["table"]):
+                last["rows"].extend(entry["rows"])
+            else:
+                runs.append({**entry, "rows": list(entry["rows"])})
+
+        for run in runs:
+            key = run["key"]
+            # One statement can't touch the same row twice; the last write wins
+            latest = {tuple(row[c] for c in key): row for row in run["rows"]}
+            rows = list(latest.values())
+            serial_key = self.store.tables[run["table"]].serial_key
+            if serial_key:
+                await self._apply_serial(db, run["op"], run["table"], serial_key, rows)
+                continue
+            table = db.table(run["table"])
+            if run["op"] in ("insert", "upsert"):
+                await self._execute(
+                    table.upsert(
+                        rows, on_conflict=",".join(key), returning=ReturnMethod.minimal
+                    )
+                )
+            elif len(key) == 1:
+                await self._execute(
+                    table.delete(returning=ReturnMethod.minimal).in_(
+                        key[0], [row[key[0]] for row in rows]
+                    )
+                )
+            else:
+                for row in rows:
+                    query = db.table(run["table"]).delete(
+                        returning=ReturnMethod.minimal
+                    )
+                    for column in key:
+                        query = query.eq(column, row[column])
+                    await self._execute(query)
+
+    async def _apply_serial(self, db, op: str, name: str, serial_key: str, rows: list):
+        local_ids = [row[serial_key] for row in rows]
+        known = await self.store.run(
+            lambda conn: self.store.remote_ids(conn, name, local_ids)
+        )
+        if op == "delete":
+            remote_ids = [known[i] for i in local_ids if i in known]
+            if remote_ids:
+                await self._execute(
+                    db.table(name)
+                    .delete(returning=ReturnMethod.minimal)
+                    .in_(serial_key, remote_ids)
+                )
+            await self.store.run(
+                lambda conn: self.store.unmap_ids(conn, name, local_ids)
+            )
+            return
+
+        new = [row for row in rows if row[serial_key] not in known]
+        if new:
+            result = await self._execute(
+                db.table(name).insert(
+                    [{c: v for c, v in row.items() if c != serial_key} for row in new]
+                )
+            )
+            # PostgREST returns inserted rows in the order they were sent
+            mapping = {
+                row[serial_key]: remote[serial_key]
+                for row, remote in zip(new, result.data or [])
+            }
+            await self.store.run(lambda conn: self.store.map_ids(conn, name, mapping))
+        if op == "upsert":
+            for row in rows:
+                if row[serial_key] in known:
+                    await self._execute(
+                        db.table(name)
+                        .update(
+                            {c: v for c, v in row.items() if c != serial_key},
+                            returning=ReturnMethod.minimal,
+                        )
+                        .eq(serial_key, known[row[serial_key]])
+                    )
+
+    def stats(self) -> dict:
+        return {
+            "replicated": self.replicated,
+            "pending": self.store.pending_replication,
+            "failures": self.failures,
+            "lag": self.lag.snapshot(),
+        }
@@ -0,0 +1,78 @@
+import os
+import re
+import time
+from app.metrics import LatencyWindow, ValueWindow
+
+# Send replies as they are generated, one WhatsApp message per chunk
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "true").lower() in ("1", "true", "yes")
+# Fragments shorter than this are held back and joined with what follows
+STREAM_MIN_CHUNK_CHARS = int(os.getenv("STREAM_MIN_CHUNK_CHARS", "20"))
+
+# A line break, or sentence punctuation followed by whitespace
+BOUNDARY_RE = re.compile(r"\n+|(?<=[.!?…])[\"')\]]*\s+")
+
+
+class SentenceSplitter:
+    """
+    Cuts a stream of text deltas into chunks at line or sentence boundaries.
+    """
+
+    def __init__(self, min_chars: int = STREAM_MIN_CHUNK_CHARS):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, delta: str) -> list:
+        """
+        Add a delta and return the chunks that are now complete.
+        """
+        self._buffer += delta
+        chunks = []
+        start = 0
+        for match in BOUNDARY_RE.finditer(self._buffer):
+            # A boundary at the very end may still grow (e.g. "3." then "5")
+            if match.end() == len(self._buffer):
+                break
+            chunk = self._buffer[start : match.start()].strip()
+            if len(chunk) < self.min_chars:
+                continue
+            if chunk:
+                chunks.append(chunk)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return chunks
+
+    def flush(self) -> str:
+        """
+        Return whatever is left once the stream has ended.
+        """
+        rest, self._buffer = self._buffer.strip(), ""
+        return rest
+
+
+class ReplyTimings:
+    """
+    How quickly users see the start of a reply versus the whole of it.
+    """
+
+    def __init__(self):
+        self.first_message = LatencyWindow()
+        self.total = LatencyWindow()
+        self.chunks = ValueWindow()
+
+    def record(self, started: float, first_sent: float, chunks: int):
+        finished = time.perf_counter()
+        if first_sent is not None:
+            self.first_message.record(first_sent - started)
+        self.total.record(finished - started)
+        self.chunks.record(chunks)
+
+    def stats(self) -> dict:
+        return {
+            "streaming": STREAM_REPLIES,
+            "time_to_first_message": self.first_message.snapshot(),
+            "total_time": self.total.snapshot(),
+            "messages_per_reply": self.chunks.snapshot(),
+        }
+
+
+reply_timings = ReplyTimings()
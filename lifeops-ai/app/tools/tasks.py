@@ -1,4 +1,5 @@
-from app.db import supabase
+from app.db import get_client, execute
+from app.reminders import reminder_dispatcher
 
 
 async def create_task(user_id: str, group_id: str, task_text: str, due_at: str = None):
@@ -12,11 +13,27 @@ async def create_task(user_id: str, group_id: str, task_text: str, due_at: str =
         "due_at": due_at,
         "status": "pending",
     }
+    db = await get_client()
+    if not db:
+        print("Supabase not configured")
+        return None
+
     try:
-        response = supabase.table("tasks").insert(data).execute()
+        response = await execute(db.table("tasks").insert(data))
+        owner = None
+        if due_at and user_id:
+            # What the reminder dispatcher reads when it loads tasks itself
+            users = await execute(
+                db.table("users").select("whatsapp_id").eq("id", user_id).limit(1)
+            )
+            owner = users.data[0] if users.data else None
+        # Picked up right away if it is due soon, otherwise by a later window
+        for row in response.data or []:
+            row["users"] = owner
+            reminder_dispatcher.schedule(row)
         return response
     except Exception as e:
-        print(f"Error creating task: {e}")
+        print(f"Error creating task: {e!r}")
         return None
 
 
@@ -24,15 +41,91 @@ async def get_tasks(user_id: str):
     """
     Get pending tasks for a user.
     """
+    db = await get_client()
+    if not db:
+        print("Supabase not configured")
+        return []
+
     try:
-        response = (
-            supabase.table("tasks")
-            .select("*")
-            .eq("user_id", user_id)
-            .eq("status", "pending")
-            .execute()
+        response = await execute(
+            db.table("tasks").select("*").eq("user_id", user_id).eq("status", "pending")
         )
         return response.data
     except Exception as e:
-        print(f"Error fetching tasks: {e}")
+        print(f"Error fetching tasks: {e!r}")
+        return []
+
+
+async def _resolve_ids(db, table: str, column: str, external_ids: set) -> dict:
+    """
+    Map WhatsApp ids to row ids in users/groups, creating missing rows.
+    """
+    if not external_ids:
+        return {}
+    response = await execute(
+        db.table(table).upsert(
+            [{column: external_id} for external_id in external_ids],
+            on_conflict=column,
+        )
+    )
+    return {row[column]: row["id"] for row in response.data or []}
+
+
+async def create_tasks(group_id: str, tasks: list) -> list:
+    """
+    Insert several tasks for a WhatsApp group in one request.
+    Each task is {"task_text", "owner" (WhatsApp id or None), "due_at"};
+    tasks whose owner isn't a known user are saved without a due time.
+    Returns the inserted rows.
+    """
+    db = await get_client()
+    if not db or not tasks:
+        return []
+
+    # tasks.user_id/group_id reference users.id/groups.id, not WhatsApp ids
+    groups = await _resolve_ids(db, "groups", "whatsapp_group_id", {group_id})
+    owners = await _resolve_ids(
+        db, "users", "whatsapp_id", {t["owner"] for t in tasks if t.get("owner")}
+    )
+    rows = []
+    for task in tasks:
+        user_id = owners.get(task.get("owner"))
+        rows.append(
+            {
+                "user_id": user_id,
+                "group_id": groups.get(group_id),
+                "task_text": task["task_text"],
+                # Nobody to remind, so keep it out of the reminder window
+                "due_at": task.get("due_at") if user_id else None,
+                "status": "pending",
+            }
+        )
+    response = await execute(db.table("tasks").insert(rows))
+    recipients = {user_id: owner for owner, user_id in owners.items()}
+    for row in response.data or []:
+        # What the reminder dispatcher reads when it loads tasks itself
+        row["users"] = {"whatsapp_id": recipients.get(row["user_id"])}
+        reminder_dispatcher.schedule(row)
+    return response.data or []
+
+
+async def get_group_tasks(group_id: str, limit: int = 200) -> list:
+    """
+    Get pending tasks for a WhatsApp group.
+    """
+    db = await get_client()
+    if not db:
+        return []
+
+    try:
+        response = await execute(
+            db.table("tasks")
+            .select("task_text, groups!inner(whatsapp_group_id)")
+            .eq("groups.whatsapp_group_id", group_id)
+            .eq("status", "pending")
+            .limit(limit)
+        )
+        return response.data or []
+    except Exception as e:
+        print(f"Error fetching group tasks: {e!r}")
         return []
@@ -1,5 +1,10 @@
 from fastapi import APIRouter, Request, HTTPException, Query
+from fastapi.responses import JSONResponse
 from app.agent import process_message
+from app.profile import profiles
+from app.ingest import IngestQueue, InboundMessage
+from app.dedup import deduplicator
+from app.outbound import whatsapp_sender
 import os
 import json
 
@@ -28,65 +33,24 @@ async def verify_webhook(
 async def handle_message(request: Request):
     """
     Handle incoming messages from WhatsApp.
+    Messages are queued for the worker pool so Meta gets its 200 right away.
     """
     body = await request.json()
     print(f"Received webhook: {body}")  # Debug log
 
     try:
-        if body.get("object") == "whatsapp_business_account":
-            for entry in body.get("entry", []):
-                for change in entry.get("changes", []):
-                    value = change.get("value", {})
-                    if "messages" in value:
-                        # Extract user profile name from contacts if available
-                        user_name = None
-                        contacts = value.get("contacts", [])
-                        if contacts and len(contacts) > 0:
-                            profile = contacts[0].get("profile", {})
-                            user_name = profile.get("name")
-
-                        for message in value.get("messages", []):
-                            if message.get("type") == "text":
-                                sender_id = message.get("from")
-                                message_text = message.get("text", {}).get("body")
-
-                                # Save user name to memory if we have it
-                                if user_name:
-                                    from app.db import save_memory
-
-                                    await save_memory(
-                                        sender_id,
-                                        f"User's name is {user_name}",
-                                        "profile",
-                                    )
-
-                                # Extract group information if present
-                                group_id = None
-                                context = message.get("context", {})
-
-                                # Check if message is from a group
-                                # WhatsApp Business API provides group info in metadata
-                                metadata = value.get("metadata", {})
-                                display_phone = metadata.get("display_phone_number")
-
-                                # If there's a group_id in the context, it's a group chat
-                                if context.get("group_jid"):
-                                    group_id = context.get("group_jid")
-
-                                print(
-                                    f"Processing message from {sender_id} (group: {group_id}): {message_text}"
-                                )
-
-                                # Process message and get AI response
-                                response_text = await process_message(
-                                    sender_id, message_text, group_id, user_name
-                                )
-
-                                if response_text:
-                                    # Send reply back to WhatsApp
-                                    await send_whatsapp_message(
-                                        sender_id, response_text
-                                    )
+        for message in parse_messages(body):
+            if deduplicator.check_and_mark(message.message_id):
+                print(f"Skipping duplicate delivery of {message.message_id}")
+                continue
+
+            if not await ingest_queue.put(message):
+                deduplicator.forget(message.message_id)
+                # Non-2xx makes Meta redeliver later instead of dropping the message
+                return JSONResponse(
+                    status_code=503,
+                    content={"status": "busy", "message": "Queue is full"},
+                )
 
         return {"status": "success"}
     except Exception as e:
@@ -97,39 +61,97 @@ async def handle_message(request: Request):
         return {"status": "error", "message": str(e)}
 
 
-async def send_whatsapp_message(to: str, message: str):
+def parse_messages(body: dict) -> list:
     """
-    Send a message to WhatsApp user using the WhatsApp Business API.
+    Extract the text messages from a WhatsApp webhook payload.
+    """
+    messages = []
+    if body.get("object") != "whatsapp_business_account":
+        return messages
+
+    for entry in body.get("entry", []):
+        for change in entry.get("changes", []):
+            value = change.get("value", {})
+            if "messages" not in value:
+                continue
+
+            # Extract user profile name from contacts if available
+            user_name = None
+            contacts = value.get("contacts", [])
+            if contacts and len(contacts) > 0:
+                profile = contacts[0].get("profile", {})
+                user_name = profile.get("name")
+
+            for message in value.get("messages", []):
+                if message.get("type") != "text":
+                    continue
+
+                # If there's a group_id in the context, it's a group chat
+                context = message.get("context", {})
+                group_id = context.get("group_jid")
+
+                messages.append(
+                    InboundMessage(
+                        message_id=message.get("id"),
+                        sender_id=message.get("from"),
+                        text=message.get("text", {}).get("body"),
+                        group_id=group_id,
+                        user_name=user_name,
+                    )
+                )
+
+    return messages
+
+
+async def handle_inbound(message: InboundMessage):
     """
-    import httpx
+    Run one queued message through the agent and send the reply.
+    Called by the ingest workers.
+    """
+    sender_id = message.sender_id
+
+    # A coalesced burst is claimed message by message
+    parts = [
+        part
+        for part in message.parts or [message]
+        if await deduplicator.claim(part.message_id)
+    ]
+    if not parts:
+        print(f"Message {message.message_id} already handled by another worker")
+        return
+    text = "\n".join(part.text for part in parts)
 
-    WHATSAPP_API_TOKEN = os.getenv("WHATSAPP_API_TOKEN")
-    PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID")  # You'll need to add this
+    # Save user name to the profile if we have it (no-op when unchanged)
+    if message.user_name:
+        await profiles.set(sender_id, "name", message.user_name)
 
-    if not WHATSAPP_API_TOKEN or not PHONE_NUMBER_ID:
-        print("Missing WhatsApp API credentials")
-        return
+    print(
+        f"Processing {len(parts)} message(s) from {sender_id} (group: {message.group_id}): {text}"
+    )
+
+    streamed = False
+
+    async def send_chunk(chunk: str):
+        nonlocal streamed
+        streamed = True
+        await send_whatsapp_message(sender_id, chunk)
+
+    # Process message and get AI response; streamed replies are sent as they come
+    response_text = await process_message(
+        sender_id, text, message.group_id, message.user_name, on_chunk=send_chunk
+    )
 
-    url = f"https://graph.facebook.com/v17.0/{PHONE_NUMBER_ID}/messages"
-
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_API_TOKEN}",
-        "Content-Type": "application/json",
-    }
-
-    payload = {
-        "messaging_product": "whatsapp",
-        "to": to,
-        "text": {"body": message},
-    }
-
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(url, headers=headers, json=payload)
-            response.raise_for_status()
-            print(f"Message sent successfully to {to}")
-        except Exception as e:
-            print(f"Error sending WhatsApp message: {e}")
-            print(
-                f"Response: {response.text if 'response' in locals() else 'No response'}"
-            )
+    if response_text and not streamed:
+        # Send reply back to WhatsApp
+        await send_whatsapp_message(sender_id, response_text)
+
+
+ingest_queue = IngestQueue(handle_inbound)
+
+
+async def send_whatsapp_message(to: str, message: str):
+    """
+    Send a message to WhatsApp user using the WhatsApp Business API.
+    The reply goes through the outbox and is delivered in the background.
+    """
+    await whatsapp_sender.send(to, message)
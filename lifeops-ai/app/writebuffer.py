@@ -0,0 +1,138 @@
+import time
+import asyncio
+from collections import deque
+from postgrest import ReturnMethod
+from app.metrics import LatencyWindow
+
+
+class WriteBuffer:
+    """
+    Write-behind buffer for one table.
+
+    Rows are collected in memory and written as a single multi-row insert
+    once `batch_size` rows are waiting or `flush_interval` seconds have
+    passed, whichever comes first. Unflushed rows can be read back with
+    pending_rows() so callers still see their own recent writes.
+    """
+
+    def __init__(
+        self,
+        table: str,
+        get_client,
+        execute,
+        batch_size: int = 50,
+        flush_interval: float = 0.5,
+        max_pending: int = 5000,
+    ):
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._get_client = get_client
+        self._execute = execute
+
+        self._pending = []
+        self._in_flight = []
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task = None
+
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.failed_flushes = 0
+        self.batch_sizes = deque(maxlen=1000)
+        self.flush_latency = LatencyWindow()
+
+    def add(self, row: dict):
+        """
+        Queue a row for the next flush. Never blocks.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+        self._pending.append(row)
+        if len(self._pending) > self.max_pending:
+            # Database is unreachable for a while; keep the newest rows
+            del self._pending[0]
+            self.rows_dropped += 1
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+
+    def pending_rows(self, **match) -> list:
+        """
+        Return rows not yet confirmed by the database whose fields equal `match`.
+        """
+        return [
+            row
+            for row in self._in_flight + self._pending
+            if all(row.get(k) == v for k, v in match.items())
+        ]
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    async def flush(self):
+        """
+        Write everything queued so far.
+        """
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[: self.batch_size]
+                del self._pending[: self.batch_size]
+                self._in_flight = batch
+
+                started = time.perf_counter()
+                try:
+                    db = await self._get_client()
+                    await self._execute(
+                        db.table(self.table).insert(
+                            batch, returning=ReturnMethod.minimal
+                        )
+                    )
+                except Exception as e:
+                    self.failed_flushes += 1
+                    print(
+                        f"[ERROR] Failed to flush {len(batch)} rows to {self.table}: {e!r}"
+                    )
+                    # Put the batch back and try again on the next tick
+                    self._pending[:0] = batch
+                    return
+                finally:
+                    self._in_flight = []
+
+                self.flush_latency.record(time.perf_counter() - started)
+                self.rows_written += len(batch)
+                self.batch_sizes.append(len(batch))
+
+    async def close(self):
+        """
+        Stop the background flusher and write out what is left.
+        """
+        if self._task is not None:
+            # Holding the lock means we never cancel a flush halfway through
+            async with self._flush_lock:
+                self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending) + len(self._in_flight),
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "failed_flushes": self.failed_flushes,
+            "avg_batch_size": (
+                round(sum(self.batch_sizes) / len(self.batch_sizes), 2)
+                if self.batch_sizes
+                else 0
+            ),
+            "max_batch_size": max(self.batch_sizes, default=0),
+            "flush_latency": self.flush_latency.snapshot(),
+        }
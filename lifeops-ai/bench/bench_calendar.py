@@ -0,0 +1,122 @@
+"""
+Calendar sync check and benchmark against the local Calendar stub.
+
+    python -m bench.bench_calendar [--events 500] [--queries 10000]
+
+Runs a full sync, then incremental syncs after adds, edits and deletes,
+then a 410 resync, comparing the local store with the stub after each
+step. Finally times list_events/conflict lookups from the local store
+against fetching the week from the API on every request, as before.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta, timezone
+import httpx
+from app.google_auth import google_tokens
+from app.calendar_sync import calendar_sync
+from bench.stub_calendar import create_app, random_event
+
+USER = "bench-user"
+
+
+def check(stub, label: str):
+    """
+    The local store must hold exactly the stub's live events.
+    """
+    expected = {
+        item["id"]: item["summary"]
+        for _, item in stub.state.events.values()
+        if item.get("status") != "cancelled"
+    }
+    store = calendar_sync._stores[USER]
+    actual = {event_id: event["summary"] for event_id, event in store.events.items()}
+    assert actual == expected, f"{label}: store differs from the calendar"
+    print(f"  {label}: ok ({len(actual)} events)")
+
+
+async def run(events: int, queries: int):
+    stub = create_app(events)
+    google_tokens.client = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=stub), base_url="http://stub"
+    )
+    google_tokens._tokens[USER] = {
+        "access_token": "bench",
+        "expires_at": time.time() + 3600,
+    }
+    calendar_sync.base_url = "http://stub"
+
+    print("sync")
+    assert await calendar_sync.sync(USER)
+    check(stub, "full sync")
+
+    for i in range(20):
+        stub.state.put(random_event(f"new{i}"))
+    edited = random.sample(
+        [key for key in stub.state.events if key.startswith("seed")], 10
+    )
+    for event_id in edited:
+        _, item = stub.state.events[event_id]
+        stub.state.put({**item, "summary": item["summary"] + " (moved)"})
+    for event_id in random.sample(sorted(stub.state.events), 10):
+        stub.state.delete(event_id)
+    before = stub.state.requests
+    assert await calendar_sync.sync(USER)
+    check(stub, "incremental sync")
+    print(f"    {stub.state.requests - before} request(s)")
+
+    stub.state.expire()
+    stub.state.put(random_event("after-expiry"))
+    assert await calendar_sync.sync(USER)
+    check(stub, "410 resync")
+    assert calendar_sync.expired_tokens == 1
+
+    now = datetime.now(timezone.utc)
+    week = now + timedelta(days=7)
+    started = time.perf_counter()
+    for _ in range(queries):
+        await calendar_sync.events(USER, now, week)
+    local = (time.perf_counter() - started) / queries
+
+    started = time.perf_counter()
+    for _ in range(queries):
+        start = now + timedelta(minutes=random.randrange(0, 7 * 24 * 60, 15))
+        await calendar_sync.conflicts(USER, start, start + timedelta(hours=1))
+    conflicts = (time.perf_counter() - started) / queries
+
+    rounds = max(1, queries // 100)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        response = await google_tokens.client.get(
+            "/calendars/primary/events",
+            params={
+                "timeMin": now.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "timeMax": week.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "singleEvents": "true",
+                "orderBy": "startTime",
+            },
+        )
+        response.raise_for_status()
+    remote = (time.perf_counter() - started) / rounds
+
+    print(f"list_events from store: {local * 1e6:.1f} µs/request")
+    print(f"conflict check:         {conflicts * 1e6:.1f} µs/request")
+    print(
+        f"fetch week from API:    {remote * 1e6:.1f} µs/request (in-process stub, no network)"
+    )
+    print(calendar_sync.stats())
+    await google_tokens.client.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=10000)
+    args = parser.parse_args()
+    asyncio.run(run(args.events, args.queries))
+
+
+if __name__ == "__main__":
+    main()
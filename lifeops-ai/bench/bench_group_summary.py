@@ -0,0 +1,97 @@
+"""
+Group summary check and benchmark, with the LLM replaced by a stub.
+
+    python -m bench.bench_group_summary [--messages 500] [--llm-latency 0.2]
+
+First asks for a summary with no database configured, which must answer
+without raising. Then writes --messages group messages to a temporary
+SQLite store and times summary requests: the first one may only make
+GROUP_SUMMARY_REQUEST_CHUNKS LLM calls however long the backlog is, and
+a repeat with no new messages must make none.
+"""
+
+import os
+
+# No Supabase for the first check; set before app.db reads them
+os.environ["STORAGE_BACKEND"] = "supabase"
+os.environ["SUPABASE_URL"] = ""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import tempfile
+import time
+import app.db as db
+from app.llm import llm
+from app.storage import SQLiteStore
+from app.group_summary import group_summarizer, GROUP_SUMMARY_REQUEST_CHUNKS
+
+GROUP = "bench-group@g.us"
+SENDER = "bench-sender"
+
+
+class StubLLM:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    async def complete(self, messages, **kwargs) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return f"summary after {self.calls} calls"
+
+
+async def timed(label: str, stub: StubLLM) -> str:
+    calls = stub.calls
+    started = time.perf_counter()
+    summary = await group_summarizer.summarize(GROUP, SENDER)
+    elapsed = time.perf_counter() - started
+    print(f"  {label}: {elapsed * 1000:.1f} ms, {stub.calls - calls} LLM calls")
+    return summary
+
+
+async def run(messages: int, latency: float):
+    stub = StubLLM(latency)
+    llm.complete = stub.complete
+
+    print("No database:")
+    summary = await timed("summary", stub)
+    assert summary == "", f"expected an empty summary, got {summary!r}"
+    assert stub.calls == 0
+
+    print(f"SQLite store, {messages} messages:")
+    path = tempfile.NamedTemporaryFile(suffix=".sqlite3", delete=False).name
+    db.STORAGE_BACKEND = "sqlite"
+    db._store = SQLiteStore(path)
+    try:
+        # save_group_context logs every call
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(messages):
+                await db.save_group_context(GROUP, f"message {i}", SENDER)
+        await db.group_writes.flush()
+
+        calls = stub.calls
+        assert await timed("first summary", stub)
+        assert stub.calls - calls <= GROUP_SUMMARY_REQUEST_CHUNKS
+
+        calls = stub.calls
+        await timed("repeat summary", stub)
+        assert stub.calls == calls, "nothing new, but the LLM was called"
+    finally:
+        await db.close_db()
+        os.unlink(path)
+
+    print(f"ok; stats: {group_summarizer.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    args = parser.parse_args()
+    asyncio.run(run(args.messages, args.llm_latency))
+
+
+if __name__ == "__main__":
+    main()
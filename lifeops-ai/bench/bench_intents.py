@@ -0,0 +1,114 @@
+"""
+Micro-benchmark: compiled intent router vs the old keyword chains.
+
+    python -m bench.bench_intents [--messages 100000]
+
+Replays synthetic group-chat traffic (mostly chatter that Sona ignores)
+through both implementations, checks they agree, and prints the
+per-message cost.
+"""
+
+import argparse
+import random
+import time
+from app.intents import intent_router
+
+CHATTER = [
+    "lol",
+    "haha that's amazing",
+    "ok see you there",
+    "did anyone watch the game last night",
+    "brb",
+    "i'm running 5 min late",
+    "send the pics pls",
+    "omg yes",
+    "that restaurant was so good",
+    "anyone up for coffee tomorrow morning",
+]
+TRIGGERS = [
+    "what time is the meeting?",
+    "who can pick up the cake",
+    "sona remind me to call mom at 6",
+    "@sona can you summarize this chat",
+    "deadline for the report is friday",
+    "need help moving the couch saturday",
+    "how do we split the bill",
+    "? anyone",
+    "Sona what's on my calendar",
+    "todo: book flights",
+]
+
+
+def legacy_route(message: str):
+    """
+    The per-message keyword chains from agent.py before the router.
+    """
+    msg_lower = message.lower()
+    mentioned = "sona" in msg_lower or "@sona" in msg_lower
+
+    respond = message.startswith("?") or any(
+        msg_lower.startswith(q)
+        for q in ["what", "when", "who", "where", "how", "can someone"]
+    )
+    help_keywords = [
+        "deadline",
+        "due date",
+        "meeting",
+        "schedule",
+        "task",
+        "remind",
+        "todo",
+        "who's doing",
+        "who can",
+        "need help",
+    ]
+    respond = respond or any(keyword in msg_lower for keyword in help_keywords)
+
+    summary = "summary" in msg_lower or "summarize" in msg_lower
+    task = any(w in msg_lower for w in ["remind", "task", "todo", "due", "deadline"])
+    calendar = (
+        "schedule" in msg_lower or "calendar" in msg_lower or "meeting" in msg_lower
+    )
+    return mentioned, respond, summary, task, calendar
+
+
+def router_route(message: str):
+    route = intent_router.route(message)
+    return (
+        route.mentioned,
+        "question" in route or "group_help" in route,
+        "summary" in route,
+        "task" in route,
+        "calendar" in route,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--trigger-ratio", type=float, default=0.1)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    messages = [
+        rng.choice(TRIGGERS if rng.random() < args.trigger_ratio else CHATTER)
+        for _ in range(args.messages)
+    ]
+
+    mismatches = [m for m in set(messages) if legacy_route(m) != router_route(m)]
+    if mismatches:
+        print(f"Router disagrees with legacy chains on: {mismatches}")
+
+    for name, fn in (("legacy", legacy_route), ("router", router_route)):
+        started = time.perf_counter()
+        for message in messages:
+            fn(message)
+        elapsed = time.perf_counter() - started
+        print(
+            f"{name:>6}: {elapsed * 1e6 / len(messages):6.2f} µs/message "
+            f"({len(messages) / elapsed:,.0f} messages/s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,588 @@
+"""
+End-to-end load test: synthetic WhatsApp webhooks through the whole app,
+with Groq, Supabase and the Graph API replaced by local stubs.
+
+    python -m bench.bench_webhook [--rate 20] [--duration 30] \\
+        [--llm-latency 0.6] [--db-latency 0.01] [--graph-latency 0.05] \\
+        [--label baseline] [--compare bench/results/baseline-....json]
+
+bench/stub_groq.py, bench/stub_postgrest.py and bench/stub_graph.py run
+as subprocesses on free ports, each with its own latency, so they don't
+share this process's event loop. The app itself runs in this process
+behind httpx's ASGI transport, and its output goes to a log file.
+
+Traffic arrives open-loop (Poisson, --rate per second): DMs, group
+chatter with context.group_jid that Sona should ignore, and @sona
+mentions in groups. Some turns are bursts of several messages in quick
+succession, some deliveries are repeated with the same message id like
+Meta's retries, and a 503 from the webhook is retried with backoff.
+
+Reported: throughput, end-to-end latency from the webhook POST to the
+first reply reaching the Graph stub, webhook ack latency, event-loop lag,
+and every p50/p95/p99 window in /stats as per-stage time. Results are
+written as JSON under bench/results/; --compare flags metrics that got
+worse than an earlier run by more than --tolerance and exits non-zero,
+so two releases can be compared with the same settings.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+import httpx
+from app.metrics import LatencyWindow
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+
+DM_TEXTS = [
+    "hey, how's it going?",
+    "remind me to call mom at 6",
+    "what's on my plate today?",
+    "add buy milk to my tasks",
+    "can you help me plan my week",
+    "i finished the report finally",
+    "what did we talk about yesterday?",
+    "I need to book flights for march",
+]
+GROUP_CHATTER = [
+    "lol",
+    "haha that's amazing",
+    "ok see you there",
+    "did anyone watch the game last night",
+    "brb",
+    "send the pics pls",
+    "omg yes",
+    "that restaurant was so good",
+]
+MENTIONS = [
+    "@sona can you summarize this chat",
+    "@sona remind everyone about saturday",
+    "@sona what did we decide about dinner",
+    "@sona who's bringing the cake",
+]
+
+# Metrics where a bigger number is better; everything else is a duration
+# or a count of problems
+HIGHER_IS_BETTER = {"throughput.messages_per_second", "throughput.replies_per_second"}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stub(module: str, port: int, *args) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", module, "--port", str(port), *map(str, args)],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def wait_ready(process: subprocess.Popen, url: str, timeout: float = 20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"stub for {url} exited with {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError(f"stub for {url} did not start")
+
+
+def webhook_payload(
+    message_id: str, sender: str, name: str, text: str, group: str = None
+) -> dict:
+    message = {
+        "from": sender,
+        "id": message_id,
+        "timestamp": str(int(time.time())),
+        "type": "text",
+        "text": {"body": text},
+    }
+    if group:
+        message["context"] = {"group_jid": group}
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [
+            {
+                "id": "bench",
+                "changes": [
+                    {
+                        "field": "messages",
+                        "value": {
+                            "messaging_product": "whatsapp",
+                            "metadata": {"phone_number_id": "bench"},
+                            "contacts": [{"profile": {"name": name}, "wa_id": sender}],
+                            "messages": [message],
+                        },
+                    }
+                ],
+            }
+        ],
+    }
+
+
+class LoadGenerator:
+    """
+    Open-loop webhook traffic, remembering when each message that should
+    get a reply was first posted.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, args):
+        self.client = client
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.users = [f"1555{n:07d}" for n in range(args.users)]
+        self.groups = {
+            f"120363{n:06d}@g.us": self.rng.sample(
+                self.users, min(len(self.users), args.group_size)
+            )
+            for n in range(args.groups)
+        }
+        self._next_id = 0
+        self._tasks = set()
+
+        # sender -> post times of messages that expect a reply
+        self.expected = defaultdict(list)
+        self.messages = 0
+        self.turns = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.errors = 0
+        self.ack_time = LatencyWindow(size=None)
+
+    async def run(self, duration: float):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + duration
+        while loop.time() < deadline:
+            await asyncio.sleep(self.rng.expovariate(self.args.rate))
+            task = asyncio.create_task(self._turn())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+
+    async def _turn(self):
+        """
+        One sender's turn: a single message or a burst, in a DM or a group.
+        """
+        self.turns += 1
+        roll = self.rng.random()
+        group = None
+        if roll < self.args.dm_share:
+            sender = self.rng.choice(self.users)
+            texts = DM_TEXTS
+        else:
+            group = self.rng.choice(sorted(self.groups))
+            sender = self.rng.choice(self.groups[group])
+            mention = self.rng.random() < self.args.mention_share
+            texts = MENTIONS if mention else GROUP_CHATTER
+
+        size = 1
+        if self.rng.random() < self.args.burst_share:
+            size = self.rng.randint(2, self.args.burst_max)
+        for i in range(size):
+            if i:
+                await asyncio.sleep(self.rng.uniform(0.05, 0.4))
+            # Only the last message of a group burst carries the mention
+            text = self.rng.choice(
+                texts if group is None or i == size - 1 else GROUP_CHATTER
+            )
+            await self._message(sender, text, group)
+
+    async def _message(self, sender: str, text: str, group: str):
+        self._next_id += 1
+        message_id = f"wamid.bench{self._next_id}"
+        payload = webhook_payload(
+            message_id, sender, f"User {sender[-4:]}", text, group
+        )
+        self.messages += 1
+        if group is None or "@sona" in text:
+            self.expected[sender].append(time.time())
+        await self._post(payload)
+        if self.rng.random() < self.args.retry_share:
+            # Meta redelivers when it didn't see the 200 in time
+            await asyncio.sleep(self.rng.uniform(0.2, 2))
+            self.duplicates += 1
+            await self._post(payload)
+
+    async def _post(self, payload: dict):
+        for attempt in range(4):
+            started = time.perf_counter()
+            try:
+                response = await self.client.post("/webhook", json=payload)
+            except Exception:
+                self.errors += 1
+                return
+            self.ack_time.record(time.perf_counter() - started)
+            if response.status_code != 503:
+                if response.status_code >= 300:
+                    self.errors += 1
+                return
+            self.rejected += 1
+            await asyncio.sleep(2**attempt)
+        self.errors += 1
+
+
+def match_replies(expected: dict, deliveries: list) -> tuple:
+    """
+    Pair replies with the messages that caused them. A reply to a sender
+    answers every message of theirs posted before it that is still open (a
+    coalesced burst gets one reply); its latency counts from the oldest.
+    Later chunks of a streamed reply find nothing open and are skipped.
+    """
+    by_sender = defaultdict(list)
+    for delivery in deliveries:
+        by_sender[delivery["to"]].append(delivery["at"])
+
+    latency = LatencyWindow(size=None)
+    unanswered = 0
+    for sender, sent in expected.items():
+        sent = sorted(sent)
+        i = 0
+        for at in sorted(by_sender.get(sender, [])):
+            if i < len(sent) and sent[i] < at:
+                latency.record(at - sent[i])
+                while i < len(sent) and sent[i] < at:
+                    i += 1
+        unanswered += len(sent) - i
+    return latency, unanswered
+
+
+async def monitor_lag(window: LatencyWindow, interval: float = 0.01):
+    """
+    How late a short sleep wakes up: time the loop spent on something else.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        window.record(max(0.0, loop.time() - expected))
+
+
+def stage_times(stats: dict, prefix: str = "") -> dict:
+    """
+    Every latency window in /stats, keyed by its path.
+    """
+    stages = {}
+    for key, value in stats.items():
+        if not isinstance(value, dict):
+            continue
+        path = f"{prefix}{key}"
+        if "p50_ms" in value:
+            stages[path] = value
+        else:
+            stages.update(stage_times(value, f"{path}."))
+    return stages
+
+
+async def drain(client: httpx.AsyncClient, stubs: httpx.AsyncClient, timeout: float):
+    """
+    Wait until nothing is queued or in flight and replies stop arriving.
+    """
+    deadline = time.monotonic() + timeout
+    last = -1
+    while time.monotonic() < deadline:
+        stats = (await client.get("/stats")).json()
+        delivered = (await stubs.get("/stub/stats")).json()["delivered"]
+        idle = (
+            stats["ingest"]["depth"] == 0
+            and stats["ingest"]["active_senders"] == 0
+            and stats["outbound"]["queued"] == 0
+            and stats["llm"]["in_flight"] == 0
+        )
+        if idle and delivered == last:
+            return True
+        last = delivered
+        await asyncio.sleep(0.5)
+    return False
+
+
+async def run(args, urls: dict, log_path: str) -> dict:
+    # Imported here so the stub endpoints in the environment are picked up
+    from app.main import app
+
+    lag = LatencyWindow(size=None)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://sona", timeout=30
+    ) as client, httpx.AsyncClient(base_url=urls["graph"]) as graph:
+        async with app.router.lifespan_context(app):
+            monitor = asyncio.create_task(monitor_lag(lag))
+            generator = LoadGenerator(client, args)
+            print(
+                f"running {args.duration:.0f}s at {args.rate}/s (app log: {log_path})",
+                file=sys.stderr,
+            )
+            started = time.time()
+            await generator.run(args.duration)
+            drained = await drain(client, graph, args.drain_timeout)
+            elapsed = time.time() - started
+            stats = (await client.get("/stats")).json()
+            monitor.cancel()
+
+    deliveries = httpx.get(f"{urls['graph']}/stub/deliveries").json()["deliveries"]
+    e2e, unanswered = match_replies(generator.expected, deliveries)
+    expected = sum(len(sent) for sent in generator.expected.values())
+    return {
+        "workload": {
+            "turns": generator.turns,
+            "messages": generator.messages,
+            "duplicate_deliveries": generator.duplicates,
+            "expecting_reply": expected,
+            "drained": drained,
+        },
+        "throughput": {
+            "elapsed_seconds": round(elapsed, 2),
+            "messages_per_second": round(generator.messages / elapsed, 2),
+            "replies_per_second": round(e2e.count / elapsed, 2),
+        },
+        "end_to_end": e2e.snapshot(),
+        "webhook_ack": generator.ack_time.snapshot(),
+        "event_loop_lag": lag.snapshot(),
+        "problems": {
+            "unanswered": unanswered,
+            "webhook_rejected": generator.rejected,
+            "webhook_errors": generator.errors,
+            "duplicates_processed": max(
+                0, generator.duplicates - stats["dedup"]["duplicates"]
+            ),
+        },
+        "stages": stage_times(stats),
+        "stubs": {
+            "graph": httpx.get(f"{urls['graph']}/stub/stats").json(),
+            "postgrest": httpx.get(f"{urls['postgrest']}/stub/stats").json(),
+        },
+    }
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    values = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[f"{prefix}{key}"] = value
+    return values
+
+
+def compare(current: dict, baseline: dict, tolerance: float, floor_ms: float) -> list:
+    """
+    Metrics that got worse by more than tolerance (relative) against the
+    baseline. Durations that moved by less than floor_ms are noise.
+    """
+    now, before = flatten(current), flatten(baseline)
+    keys = [
+        key
+        for key in now
+        if key in before
+        and (
+            key in HIGHER_IS_BETTER
+            or key.startswith("problems.")
+            or key.endswith(("p50_ms", "p95_ms", "p99_ms"))
+        )
+    ]
+    regressions = []
+    for key in sorted(keys):
+        old, new = before[key], now[key]
+        if key in HIGHER_IS_BETTER:
+            worse = new < old * (1 - tolerance)
+        elif key.startswith("problems."):
+            worse = new > old
+        else:
+            worse = new > old * (1 + tolerance) and new - old > floor_ms
+        if worse:
+            regressions.append((key, old, new))
+    return regressions
+
+
+def report(results: dict):
+    workload, throughput = results["workload"], results["throughput"]
+    print(
+        f"{workload['messages']} messages in {workload['turns']} turns "
+        f"({workload['duplicate_deliveries']} redelivered), "
+        f"{workload['expecting_reply']} expecting a reply"
+    )
+    print(
+        f"throughput: {throughput['messages_per_second']} messages/s, "
+        f"{throughput['replies_per_second']} replies/s "
+        f"over {throughput['elapsed_seconds']}s"
+    )
+    for name in ("end_to_end", "webhook_ack", "event_loop_lag"):
+        window = results[name]
+        print(
+            f"{name:15} p50 {window.get('p50_ms', 0):8.1f} ms  "
+            f"p95 {window.get('p95_ms', 0):8.1f} ms  "
+            f"p99 {window.get('p99_ms', 0):8.1f} ms  (n={window['count']})"
+        )
+    print(f"problems: {results['problems']}")
+    print("stages (p50 / p95 / p99 ms):")
+    for path, window in sorted(results["stages"].items()):
+        print(
+            f"  {path:45} {window['p50_ms']:8.1f} {window['p95_ms']:8.1f} "
+            f"{window['p99_ms']:8.1f}  (n={window['count']})"
+        )
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=20, help="turns per second")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--group-size", type=int, default=8)
+    parser.add_argument("--dm-share", type=float, default=0.6)
+    parser.add_argument("--mention-share", type=float, default=0.3)
+    parser.add_argument("--burst-share", type=float, default=0.15)
+    parser.add_argument("--burst-max", type=int, default=4)
+    parser.add_argument("--retry-share", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=0.6)
+    parser.add_argument("--llm-jitter", type=float, default=0.5)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--db-latency", type=float, default=0.01)
+    parser.add_argument("--db-jitter", type=float, default=0.5)
+    parser.add_argument("--graph-latency", type=float, default=0.05)
+    parser.add_argument("--graph-error-rate", type=float, default=0.0)
+    parser.add_argument("--drain-timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--output", help="results file (default: bench/results/)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--floor-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="sona-bench-")
+    ports = {name: free_port() for name in ("groq", "postgrest", "graph")}
+    urls = {name: f"http://127.0.0.1:{port}" for name, port in ports.items()}
+    stubs = [
+        start_stub(
+            "bench.stub_groq",
+            ports["groq"],
+            "--latency",
+            f"*={args.llm_latency}",
+            "--error-rate",
+            f"*={args.llm_error_rate}",
+            "--jitter",
+            args.llm_jitter,
+            "--token-delay",
+            args.token_delay,
+        ),
+        start_stub(
+            "bench.stub_postgrest",
+            ports["postgrest"],
+            "--path",
+            os.path.join(workdir, "postgrest.sqlite3"),
+            "--latency",
+            args.db_latency,
+            "--jitter",
+            args.db_jitter,
+        ),
+        start_stub(
+            "bench.stub_graph",
+            ports["graph"],
+            "--latency",
+            args.graph_latency,
+            "--error-rate",
+            args.graph_error_rate,
+        ),
+    ]
+
+    os.environ.update(
+        {
+            "GROQ_BASE_URL": f"{urls['groq']}/v1",
+            "GROQ_API_KEY": "bench",
+            "STORAGE_BACKEND": "supabase",
+            "SUPABASE_URL": urls["postgrest"],
+            "SUPABASE_KEY": "bench",
+            "WHATSAPP_GRAPH_URL": urls["graph"],
+            "WHATSAPP_API_TOKEN": "bench",
+            "WHATSAPP_PHONE_NUMBER_ID": "bench",
+            "WHATSAPP_OUTBOX_PATH": os.path.join(workdir, "outbox.sqlite3"),
+            "COORDINATION_SQLITE_PATH": os.path.join(workdir, "coordination.sqlite3"),
+            "RETRIEVAL_INDEX_DIR": os.path.join(workdir, "retrieval_index"),
+        }
+    )
+    log_path = os.path.join(workdir, "app.log")
+    try:
+        wait_ready(stubs[0], f"{urls['groq']}/docs")
+        wait_ready(stubs[1], f"{urls['postgrest']}/stub/stats")
+        wait_ready(stubs[2], f"{urls['graph']}/stub/stats")
+        with open(log_path, "w") as log, contextlib.redirect_stdout(log):
+            results = asyncio.run(run(args, urls, log_path))
+    finally:
+        for stub in stubs:
+            stub.terminate()
+        for stub in stubs:
+            stub.wait()
+
+    results = {
+        "label": args.label,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "config": vars(args),
+        **results,
+    }
+    report(results)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output = os.path.join(RESULTS_DIR, f"{args.label}-{stamp}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results: {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        changed = sorted(
+            key
+            for key, value in vars(args).items()
+            if key not in ("label", "output", "compare")
+            and baseline.get("config", {}).get(key) != value
+        )
+        if changed:
+            print(f"warning: settings differ from the baseline: {', '.join(changed)}")
+        regressions = compare(results, baseline, args.tolerance, args.floor_ms)
+        print(
+            f"compared with {baseline.get('label')} ({baseline.get('commit')}): "
+            f"{len(regressions)} regression(s)"
+        )
+        for key, old, new in regressions:
+            print(f"  {key}: {old} -> {new}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Local stand-in for the Google Calendar events.list endpoint, with
+incremental sync.
+
+    python -m bench.stub_calendar --port 8082 --events 500
+
+Then run Sona with GOOGLE_CALENDAR_URL=http://127.0.0.1:8082. Sync tokens
+encode a generation and a change sequence number; POST /stub/expire bumps
+the generation so every outstanding token gets 410 Gone, like Google does
+when a token is too old.
+"""
+
+import argparse
+import random
+import uvicorn
+from datetime import datetime, timedelta, timezone
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def _parse(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _start(item: dict) -> datetime:
+    return _parse(item["start"]["dateTime"])
+
+
+def _end(item: dict) -> datetime:
+    return _parse(item["end"]["dateTime"])
+
+
+def random_event(event_id: str, days: float = 30) -> dict:
+    start = datetime.now(timezone.utc) + timedelta(hours=random.uniform(-12, days * 24))
+    start = start.replace(
+        minute=random.choice([0, 15, 30, 45]), second=0, microsecond=0
+    )
+    end = start + timedelta(minutes=random.choice([15, 30, 60, 90, 120]))
+    return {
+        "id": event_id,
+        "status": "confirmed",
+        "summary": f"Event {event_id}",
+        "start": {"dateTime": start.isoformat()},
+        "end": {"dateTime": end.isoformat()},
+    }
+
+
+def create_app(events: int = 0) -> FastAPI:
+    app = FastAPI(title="Stub Calendar")
+    state = app.state
+    # event id -> (sequence number of its last change, item)
+    state.events = {}
+    state.sequence = 0
+    state.generation = 1
+    state.requests = 0
+
+    def put(item: dict):
+        state.sequence += 1
+        state.events[item["id"]] = (state.sequence, dict(item))
+
+    def delete(event_id: str):
+        _, item = state.events[event_id]
+        put({"id": event_id, "status": "cancelled", "start": item["start"]})
+
+    def expire():
+        state.generation += 1
+
+    state.put = put
+    state.delete = delete
+    state.expire = expire
+    for i in range(events):
+        put(random_event(f"seed{i}"))
+
+    @app.get("/calendars/{calendar_id}/events")
+    async def list_events(request: Request):
+        state.requests += 1
+        params = request.query_params
+        page_size = min(int(params.get("maxResults", 250)), 2500)
+
+        if "pageToken" in params:
+            offset, upto, since = (int(part) for part in params["pageToken"].split(":"))
+        else:
+            offset, upto, since = 0, state.sequence, -1
+            if "syncToken" in params:
+                generation, _, since = params["syncToken"].partition(":")
+                if int(generation) != state.generation:
+                    return JSONResponse(
+                        status_code=410,
+                        content={
+                            "error": {"code": 410, "message": "Sync token expired"}
+                        },
+                    )
+                since = int(since)
+
+        changes = sorted(
+            (seq, item) for seq, item in state.events.values() if since < seq <= upto
+        )
+        items = [item for _, item in changes]
+        if since < 0:
+            # Full listing: no tombstones, optionally limited to a time window
+            items = [item for item in items if item.get("status") != "cancelled"]
+            if "timeMin" in params:
+                time_min = _parse(params["timeMin"])
+                items = [item for item in items if _end(item) >= time_min]
+            if "timeMax" in params:
+                time_max = _parse(params["timeMax"])
+                items = [item for item in items if _start(item) < time_max]
+            if params.get("orderBy") == "startTime":
+                items.sort(key=_start)
+
+        page = {"kind": "calendar#events", "items": items[offset : offset + page_size]}
+        if offset + page_size < len(items):
+            page["nextPageToken"] = f"{offset + page_size}:{upto}:{since}"
+        elif "timeMax" not in params:
+            page["nextSyncToken"] = f"{state.generation}:{upto}"
+        return page
+
+    @app.post("/stub/expire")
+    async def expire_tokens():
+        expire()
+        return {"generation": state.generation}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--events", type=int, default=200)
+    args = parser.parse_args()
+
+    uvicorn.run(
+        create_app(args.events), host=args.host, port=args.port, log_level="warning"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Local stand-in for the WhatsApp Cloud API messages endpoint.
+
+    python -m bench.stub_graph --port 8084 --latency 0.05 --error-rate 0.02
+
+Then run Sona with WHATSAPP_GRAPH_URL=http://127.0.0.1:8084 and any
+WHATSAPP_API_TOKEN / WHATSAPP_PHONE_NUMBER_ID. Every accepted message is
+recorded with its arrival time (time.time()), and GET /stub/deliveries
+returns them so a load test can match replies to the webhooks that caused
+them. Errors are 429s with Retry-After, like Meta's rate limiting.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def create_app(
+    latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0
+) -> FastAPI:
+    app = FastAPI(title="Stub Graph API")
+    app.state.deliveries = []
+    app.state.requests = 0
+    app.state.errors = 0
+
+    @app.post("/{phone_number_id}/messages")
+    async def messages(phone_number_id: str, request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        await asyncio.sleep(latency * (1 + jitter * random.expovariate(1.0)))
+        if random.random() < error_rate:
+            app.state.errors += 1
+            return JSONResponse(
+                status_code=429,
+                headers={"Retry-After": "1"},
+                content={"error": {"message": "stub rate limit", "code": 130429}},
+            )
+
+        message_id = f"wamid.stub{len(app.state.deliveries)}"
+        app.state.deliveries.append(
+            {
+                "to": body.get("to"),
+                "body": body.get("text", {}).get("body", ""),
+                "at": time.time(),
+            }
+        )
+        return {
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": body.get("to"), "wa_id": body.get("to")}],
+            "messages": [{"id": message_id}],
+        }
+
+    @app.get("/stub/deliveries")
+    async def deliveries(since: int = 0):
+        return {
+            "total": len(app.state.deliveries),
+            "deliveries": app.state.deliveries[since:],
+        }
+
+    @app.get("/stub/stats")
+    async def stats():
+        return {
+            "requests": app.state.requests,
+            "errors": app.state.errors,
+            "delivered": len(app.state.deliveries),
+        }
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8084)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    uvicorn.run(
+        create_app(args.latency, args.jitter, args.error_rate),
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Local OpenAI-compatible stand-in for Groq's chat completions endpoint.
+
+    python -m bench.stub_groq --port 8081 \
+        --latency llama-3.3-70b-versatile=0.8 --jitter 0.5 \
+        --error-rate llama-3.3-70b-versatile=0.1
+
+Then run Sona with GROQ_BASE_URL=http://127.0.0.1:8081/v1. Per-model
+latency and error rates let you exercise hedging, failover and the
+circuit breaker without a Groq account.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+REPLY = (
+    "Got it! I'll keep that in mind for later. "
+    "Let me know if you want me to set a reminder too.\n"
+    "Anything else on your plate today?"
+)
+# Answer for response_format={"type": "json_object"} requests (task extraction)
+JSON_REPLY = '{"tasks": []}'
+
+
+def _pairs(values: list) -> dict:
+    pairs = {}
+    for value in values or []:
+        model, _, number = value.partition("=")
+        pairs[model] = float(number)
+    return pairs
+
+
+def create_app(
+    latency: dict = None,
+    error_rate: dict = None,
+    jitter: float = 0.0,
+    token_delay: float = 0.01,
+    reply: str = REPLY,
+) -> FastAPI:
+    """
+    latency and error_rate map model name to seconds / probability;
+    "*" applies to models not listed.
+    """
+    latency = latency or {}
+    error_rate = error_rate or {}
+    app = FastAPI(title="Stub Groq")
+    app.state.requests = 0
+
+    def lookup(table: dict, model: str) -> float:
+        return table.get(model, table.get("*", 0.0))
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "")
+        app.state.requests += 1
+
+        # Time to first token, with a long tail when jitter is set
+        delay = lookup(latency, model) * (1 + jitter * random.expovariate(1.0))
+        await asyncio.sleep(delay)
+        if random.random() < lookup(error_rate, model):
+            return JSONResponse(
+                status_code=503, content={"error": {"message": "stub overloaded"}}
+            )
+
+        response_format = body.get("response_format") or {}
+        text = JSON_REPLY if response_format.get("type") == "json_object" else reply
+        words = text.split(" ")
+        created = int(time.time())
+        usage = {
+            "prompt_tokens": sum(
+                len(m.get("content", "")) // 4 for m in body["messages"]
+            ),
+            "completion_tokens": len(words),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if not body.get("stream"):
+            return {
+                "id": "stub",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": usage,
+            }
+
+        async def events():
+            for i, word in enumerate(words):
+                chunk = {
+                    "id": "stub",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "delta": {"content": word if i == 0 else f" {word}"},
+                            "finish_reason": None,
+                        }
+                    ],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(token_delay)
+            final = {
+                "id": "stub",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", action="append", help="model=seconds")
+    parser.add_argument("--error-rate", action="append", help="model=probability")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    args = parser.parse_args()
+
+    app = create_app(
+        latency=_pairs(args.latency),
+        error_rate=_pairs(args.error_rate),
+        jitter=args.jitter,
+        token_delay=args.token_delay,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
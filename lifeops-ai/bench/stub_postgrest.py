@@ -0,0 +1,158 @@
+"""
+Local stand-in for Supabase's PostgREST API, backed by a SQLite file.
+
+    python -m bench.stub_postgrest --port 8083 --latency 0.02 --jitter 0.5
+
+Then run Sona with SUPABASE_URL=http://127.0.0.1:8083 and any
+SUPABASE_KEY. Requests are translated back into app/storage.py query
+builder calls, so the tables, filters and embeds behave the same as with
+STORAGE_BACKEND=sqlite, but every query pays a network round trip plus
+the configured latency, like a hosted database does.
+"""
+
+import argparse
+import asyncio
+import random
+import sqlite3
+import tempfile
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+from postgrest import ReturnMethod
+from app.storage import SQLiteStore, _split
+
+# Query parameters that aren't column filters
+RESERVED = {"select", "order", "limit", "offset", "or", "on_conflict", "columns"}
+# Operators whose builder method name differs (Python keywords)
+METHODS = {"in": "in_", "is": "is_"}
+
+
+def _prefer(request: Request) -> dict:
+    prefer = {}
+    for part in request.headers.get("prefer", "").split(","):
+        key, _, value = part.strip().partition("=")
+        if key:
+            prefer[key] = value
+    return prefer
+
+
+def _apply_filters(query, params):
+    for column, value in params.multi_items():
+        if column in RESERVED:
+            continue
+        op, _, operand = value.partition(".")
+        if op == "not":
+            op, _, operand = operand.partition(".")
+            query = query.not_
+        query = getattr(query, METHODS.get(op, op))(column, operand)
+    if "or" in params:
+        query = query.or_(params["or"][1:-1])
+    return query
+
+
+def _apply_modifiers(query, params):
+    for term in _split(params.get("order", ""), ","):
+        if not term:
+            continue
+        column, *flags = term.split(".")
+        nullsfirst = (
+            True if "nullsfirst" in flags else False if "nullslast" in flags else None
+        )
+        query = query.order(column, desc="desc" in flags, nullsfirst=nullsfirst)
+    if "limit" in params and "offset" in params:
+        start = int(params["offset"])
+        query = query.range(start, start + int(params["limit"]) - 1)
+    elif "limit" in params:
+        query = query.limit(int(params["limit"]))
+    return query
+
+
+def _error(status: int, code: str, message: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=status,
+        content={"code": code, "message": message, "details": None, "hint": None},
+    )
+
+
+def create_app(path: str = None, latency: float = 0.0, jitter: float = 0.0) -> FastAPI:
+    app = FastAPI(title="Stub PostgREST")
+    if path is None:
+        path = tempfile.NamedTemporaryFile(suffix=".sqlite3", delete=False).name
+    app.state.store = SQLiteStore(path)
+    app.state.requests = 0
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        await app.state.store.close()
+
+    @app.api_route("/rest/v1/{table}", methods=["GET", "POST", "PATCH", "DELETE"])
+    async def table(table: str, request: Request):
+        app.state.requests += 1
+        await asyncio.sleep(latency * (1 + jitter * random.expovariate(1.0)))
+
+        store = app.state.store
+        if table not in store.tables:
+            return _error(404, "42P01", f"relation {table} does not exist")
+        params = request.query_params
+        prefer = _prefer(request)
+        returning = ReturnMethod(prefer.get("return", "representation"))
+        body = await request.json() if request.method in ("POST", "PATCH") else None
+
+        query = store.table(table)
+        if request.method == "GET":
+            query = query.select(params.get("select", "*"))
+        elif request.method == "POST":
+            resolution = prefer.get("resolution")
+            if resolution:
+                query = query.upsert(
+                    body,
+                    returning=returning,
+                    ignore_duplicates=resolution == "ignore-duplicates",
+                    on_conflict=params.get("on_conflict", ""),
+                )
+            else:
+                query = query.insert(body, returning=returning)
+        elif request.method == "PATCH":
+            query = query.update(body, returning=returning)
+        else:
+            query = query.delete(returning=returning)
+
+        try:
+            query = _apply_modifiers(_apply_filters(query, params), params)
+            result = await query.execute()
+        except sqlite3.IntegrityError as e:
+            return _error(409, "23505", str(e))
+        except (ValueError, KeyError, sqlite3.Error) as e:
+            return _error(400, "PGRST100", str(e))
+
+        status = 201 if request.method == "POST" else 200
+        if returning == ReturnMethod.minimal:
+            return Response(status_code=204 if status == 200 else status)
+        return JSONResponse(status_code=status, content=result.data)
+
+    @app.get("/stub/stats")
+    async def stats():
+        return {"requests": app.state.requests, **app.state.store.stats()}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8083)
+    parser.add_argument("--path", help="SQLite file (default: a new temp file)")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    args = parser.parse_args()
+
+    uvicorn.run(
+        create_app(args.path, args.latency, args.jitter),
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+    )
+
+
+if __name__ == "__main__":
+    main()
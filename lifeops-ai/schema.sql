@@ -29,6 +29,9 @@ create table if not exists tasks (
   created_at timestamptz default now()
 );
 
+-- Reminder dispatcher reads pending tasks by due time
+create index if not exists idx_tasks_status_due_at on tasks(status, due_at);
+
 -- Agent Logs table
 create table if not exists agent_logs (
   id uuid primary key default uuid_generate_v4(),
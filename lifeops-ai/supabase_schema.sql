@@ -13,6 +13,8 @@ CREATE TABLE IF NOT EXISTS memories (
 -- Create indexes for memories
 CREATE INDEX IF NOT EXISTS idx_memories_user_id ON memories(user_id);
 CREATE INDEX IF NOT EXISTS idx_memories_created_at ON memories(created_at);
+-- Compaction finds old rows of one memory_type
+CREATE INDEX IF NOT EXISTS idx_memories_type_created_at ON memories(memory_type, created_at);
 
 -- Table: group_messages
 -- Stores group conversation context
@@ -44,3 +46,68 @@ CREATE POLICY "Enable read access for all users" ON group_messages
 
 CREATE POLICY "Enable insert for all users" ON group_messages
     FOR INSERT WITH CHECK (true);
+
+-- Retention (app/retention.py) deletes expired and compacted rows
+CREATE POLICY "Enable delete for all users" ON memories
+    FOR DELETE USING (true);
+
+CREATE POLICY "Enable delete for all users" ON group_messages
+    FOR DELETE USING (true);
+
+-- Table: processed_messages
+-- WhatsApp message IDs already handled (used when DEDUP_SHARED=true)
+CREATE TABLE IF NOT EXISTS processed_messages (
+    message_id TEXT PRIMARY KEY,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_processed_messages_created_at ON processed_messages(created_at);
+
+-- Table: user_profiles
+-- One row per profile fact (name, timezone, ...) per user
+CREATE TABLE IF NOT EXISTS user_profiles (
+    user_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (user_id, key)
+);
+
+ALTER TABLE user_profiles ENABLE ROW LEVEL SECURITY;
+
+-- Profile writes are upserts, which need UPDATE as well as INSERT
+CREATE POLICY "Enable read access for all users" ON user_profiles
+    FOR SELECT USING (true);
+
+CREATE POLICY "Enable insert for all users" ON user_profiles
+    FOR INSERT WITH CHECK (true);
+
+CREATE POLICY "Enable update for all users" ON user_profiles
+    FOR UPDATE USING (true) WITH CHECK (true);
+
+-- Table: leases
+-- Leader election, e.g. which instance runs the scheduler
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+-- Table: shared_state
+-- Small key/value state shared by workers (COORDINATION_BACKEND=supabase)
+CREATE TABLE IF NOT EXISTS shared_state (
+    key TEXT PRIMARY KEY,
+    value TEXT,
+    expires_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_shared_state_expires_at ON shared_state(expires_at);
+
+-- Table: group_summaries
+-- Rolling summary per group and the last group_messages row it covers
+CREATE TABLE IF NOT EXISTS group_summaries (
+    group_id TEXT PRIMARY KEY,
+    summary TEXT,
+    last_message_id BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);